@@ -1,14 +1,11 @@
-import ollama
 import pandas as pd
 import json
 
-file_path = "aug_data.csv" 
-df = pd.read_csv(file_path)
+from dedup import REPORT, fan_out
+from instrumentation import METRICS, instrumented
+from llmclient import LLMClient
 
-required_columns = ['id', 'Sentence', 'aspect_sentiment_pairs']
-for col in required_columns:
-    if col not in df.columns:
-        raise KeyError(f"Dataset must have '{col}' column.")
+client = LLMClient(model="llama2:7b")
 
 def generate_prompt(original_text, aspects_sentiments):
     aspects_text = ", ".join([f"\"{aspect}\" (sentiment: \"{sentiment}\")" for aspect, sentiment in aspects_sentiments])
@@ -32,8 +29,7 @@ def generate_adversarial_text(row):
         return original_text 
 
     prompt = generate_prompt(original_text, aspects_sentiments)
-    response = ollama.generate(model="llama2:7b", prompt=prompt)
-    adv_text = str(response.get("response", "")).strip()
+    adv_text = client.generate(prompt).strip()
 
 
     if ":" in adv_text:
@@ -52,7 +48,48 @@ def generate_adversarial_text(row):
         return original_text
     return adv_text
 
-df["Sentence"] = df.apply(generate_adversarial_text, axis=1)
-output_file = "adversarial_data.csv"
-df.to_csv(output_file, index=False)
-print(f"Adversarial dataset saved: {output_file}")
+
+def generate_adversarial_texts(rows):
+    """
+    Adversarial text for every row, querying the LLM once per cluster of
+    duplicate sentences with the same aspect_sentiment_pairs. Rows whose
+    representative came back unchanged keep their own sentence.
+    """
+    rows = list(rows)
+
+    def compute(reps):
+        texts = client.map(generate_adversarial_text, reps, fallback=lambda row: row["Sentence"])
+        return [None if text == row["Sentence"] else text for row, text in zip(reps, texts)]
+
+    results = fan_out(
+        compute,
+        rows,
+        text=lambda row: row["Sentence"],
+        group=lambda row: str(row["aspect_sentiment_pairs"]),
+        stage="adversarial"
+    )
+    return [row["Sentence"] if text is None else text for row, text in zip(rows, results)]
+
+
+@instrumented("adversarial")
+def main():
+    file_path = "aug_data.csv"
+    df = pd.read_csv(file_path)
+
+    required_columns = ['id', 'Sentence', 'aspect_sentiment_pairs']
+    for col in required_columns:
+        if col not in df.columns:
+            raise KeyError(f"Dataset must have '{col}' column.")
+
+    METRICS.set("absa_stage_rows", len(df), stage="adversarial")
+    df["Sentence"] = generate_adversarial_texts(df.to_dict("records"))
+    output_file = "adversarial_data.csv"
+    df.to_csv(output_file, index=False)
+    print(f"Adversarial dataset saved: {output_file}")
+    print(f"LLM cache: {client.cache.stats()}")
+    print(REPORT.summary("adversarial"))
+    REPORT.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,47 @@
+import os
+import re
+import json
+import time
+import hashlib
 import pandas as pd
 import openai
 
+from dedup import REPORT, fan_out
+from instrumentation import METRICS, instrumented
+from llmcache import LLMCache
+
 openai.api_key = ""
+cache = LLMCache()
+
+MODEL = "gpt-4o-mini"
+# Number of sentences sent per request; 1 keeps the original one-prompt-per-sentence mode.
+PACK_SIZE = int(os.environ.get("ASPECT_PACK_SIZE", 1))
+
+# Requests actually sent to the API by this process (cache hits excluded).
+usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "splits": 0}
+
+
+def request(prompt):
+    start = time.perf_counter()
+    try:
+        response = openai.chat.completions.create(
+            model=MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3
+        )
+    except Exception:
+        METRICS.inc("absa_llm_requests_total", model=MODEL, kind="chat", outcome="failed")
+        raise
+    METRICS.observe("absa_llm_request_seconds", time.perf_counter() - start, model=MODEL, kind="chat")
+    usage["requests"] += 1
+    if getattr(response, "usage", None) is not None:
+        usage["prompt_tokens"] += response.usage.prompt_tokens
+        usage["completion_tokens"] += response.usage.completion_tokens
+        METRICS.inc("absa_llm_tokens_total", response.usage.prompt_tokens, model=MODEL, type="prompt")
+        METRICS.inc("absa_llm_tokens_total", response.usage.completion_tokens, model=MODEL, type="completion")
+    return response.choices[0].message.content
+
+
 def process_sentence(sentence):
     prompt = f"""
 Objective: Extract all correct aspect-sentiment pairs from the sentence provided below. 
@@ -21,18 +61,172 @@ Expected Output: [["delivery times", "positive"], ["customer service", "negative
 - Do not include any explanations, commentary,what u did, or extra text but only the outputs for the given sentence.
 """
     
-    response = openai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.3
-    )
-    
-    return response.choices[0].message.content
+    sent = []
+
+    def compute():
+        sent.append(True)
+        return request(prompt)
+
+    result = cache.get_or_compute(MODEL, prompt, compute, temperature=0.3)
+    METRICS.inc("absa_llm_requests_total", model=MODEL, kind="chat", outcome="sent" if sent else "cached")
+    return result
+
+
+def sentence_id(sentence):
+    """
+    ID of a sentence inside a packed prompt. It only depends on the sentence,
+    so the same sentence keeps its ID whatever pack it lands in.
+    """
+    return "s" + hashlib.sha1(sentence.encode("utf-8")).hexdigest()[:10]
+
+
+def packed_key(sentence):
+    """
+    Cache key of one sentence's answer in packed mode, whatever pack (or
+    fallback prompt) answered it.
+    """
+    return cache.make_key(MODEL, sentence, kind="packed", temperature=0.3)
+
+
+def build_pack_prompt(pack):
+    """
+    Prompt for a pack of (id, sentence) pairs: the rules are sent once and the
+    answer is a JSON object keyed by sentence ID.
+    """
+    sentences = json.dumps(dict(pack), ensure_ascii=False, indent=0)
+    return f"""
+Objective: Extract all correct aspect-sentiment pairs from each of the sentences provided below.
+The sentences are given as a JSON object mapping a sentence ID to the sentence.
+Output a single JSON object with every sentence ID as a key, mapped to the JSON list of pairs for that sentence in the format: [["aspect1", "sentiment1"], ["aspect2", "sentiment2"]].
+
+Sentences: {sentences}
+
+Rules:
+- Assign "positive" sentiment for positive opinions.
+- Assign "negative" sentiment for negative opinions.
+- For sentences  where the sentiment is absent for an aspect (e.g., "It took half an hour to get our check, which was perfect since we could sit, have drinks and talk!", here drinks' sentiment is neutral"),they are neutral sentiments.
+- Use an empty list [] for a sentence without aspects.
+- Include every sentence ID exactly once and no other keys.
+- Format the output as a JSON object like in the following example: 
+
+Example:
+Input: {{"s0": "I have to say they have one of the fastest delivery times in the city, but their customer service could use some improvement."}}
+Expected Output: {{"s0": [["delivery times", "positive"], ["customer service", "negative"]]}}
+- Do not include any explanations, commentary,what u did, or extra text but only the outputs for the given sentences.
+"""
+
+
+def parse_pack_response(content, ids):
+    """
+    Pairs of every ID in `ids` that the response answered with a well-formed
+    list of [aspect, sentiment] pairs, as {id: JSON string}. Missing and
+    malformed entries are left out so the caller can retry them.
+    """
+    content = re.sub(r"^```(?:json)?|```$", "", content.strip()).strip()
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        answer = json.loads(content[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(answer, dict):
+        return {}
+
+    parsed = {}
+    for id in ids:
+        pairs = answer.get(id)
+        if isinstance(pairs, list) and all(isinstance(p, list) and len(p) == 2 for p in pairs):
+            parsed[id] = json.dumps(pairs, ensure_ascii=False)
+    return parsed
+
+
+def process_pack(pack, results):
+    """
+    Answer a pack of (id, sentence) pairs into `results`. If the response
+    misses some IDs, the missing sentences are asked again: on their own
+    when part of the pack was answered, otherwise split in two halves. A
+    single sentence that still fails falls back to the per-sentence prompt.
+    Every answer, fallbacks included, is cached under the sentence's packed
+    key, so a rerun does not send it through a pack again.
+    """
+    parsed = parse_pack_response(request(build_pack_prompt(pack)), [id for id, _ in pack])
+    METRICS.inc("absa_llm_requests_total", model=MODEL, kind="packed", outcome="sent")
+    for id, sentence in pack:
+        if id in parsed:
+            results[id] = parsed[id]
+            cache.put(packed_key(sentence), parsed[id], model=MODEL)
+
+    missing = [(id, sentence) for id, sentence in pack if id not in parsed]
+    if not missing:
+        return
+    usage["splits"] += 1
+    METRICS.inc("absa_llm_retries_total", stage="aspectsentiment")
+    if len(pack) == 1:
+        id, sentence = pack[0]
+        results[id] = process_sentence(sentence)
+        cache.put(packed_key(sentence), results[id], model=MODEL)
+    elif len(missing) < len(pack):
+        process_pack(missing, results)
+    else:
+        middle = len(pack) // 2
+        process_pack(pack[:middle], results)
+        process_pack(pack[middle:], results)
+
+
+def process_sentences_packed(sentences, pack_size=PACK_SIZE):
+    """
+    aspect_sentiment_pairs for a list of sentences, sending `pack_size`
+    sentences per request. Each answered sentence is cached on its own, so a
+    rerun with another pack size only asks for the sentences still missing.
+    """
+    results = {}
+    pending = {}
+    for sentence in sentences:
+        id = sentence_id(sentence)
+        if id in results or id in pending:
+            continue
+        cached = cache.get(packed_key(sentence))
+        if cached is None:
+            pending[id] = sentence
+        else:
+            results[id] = cached
+            METRICS.inc("absa_llm_requests_total", model=MODEL, kind="packed", outcome="cached")
+
+    pending = list(pending.items())
+    for start in range(0, len(pending), pack_size):
+        process_pack(pending[start:start + pack_size], results)
+    return [results[sentence_id(sentence)] for sentence in sentences]
+
+
+def extract_pairs(sentences, pack_size=PACK_SIZE):
+    """
+    aspect_sentiment_pairs for every sentence, with one request per
+    duplicate cluster, or per pack of clusters when pack_size > 1.
+    """
+    if pack_size > 1:
+        compute = lambda reps: process_sentences_packed([str(s) for s in reps], pack_size)
+    else:
+        compute = lambda reps: [process_sentence(s) for s in reps]
+    return fan_out(compute, sentences, stage="aspectsentiment")
+
+
+@instrumented("aspectsentiment")
+def main():
+    df = pd.read_csv("merged.csv", encoding="utf-8")
+    METRICS.set("absa_stage_rows", len(df), stage="aspectsentiment")
+
+    df["aspect_sentiment_pairs"] = extract_pairs(df["Sentence"])
+
+    df.to_csv("fulloutput.csv", encoding="utf-8", index=False)
 
-df = pd.read_csv("merged.csv", encoding="utf-8")
+    print("Data augmentation complete! Check 'sample_output_data.csv'.")
+    print(f"LLM cache: {cache.stats()}")
+    print(f"API usage (pack size {PACK_SIZE}): {usage}")
+    print(REPORT.summary("aspectsentiment"))
+    REPORT.save()
 
-df["aspect_sentiment_pairs"] = df["Sentence"].apply(process_sentence)
 
-df.to_csv("fulloutput.csv", encoding="utf-8", index=False)
+if __name__ == "__main__":
+    main()
 
-print("Data augmentation complete! Check 'sample_output_data.csv'.")
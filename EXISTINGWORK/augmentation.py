@@ -1,7 +1,11 @@
 import pandas as pd
-import ollama
 
-df = pd.read_csv("processed_sentences.csv", encoding="utf-8")
+from dedup import REPORT, fan_out
+from instrumentation import METRICS, instrumented
+from llmclient import LLMClient
+
+client = LLMClient(model="llama2:7b")
+
 
 def process_sentence(sentence):
     prompt = f"""You are given a CSV dataset with two columns: id, sentences. The output dataset must be the modified dataset of the input dataset 
@@ -18,17 +22,39 @@ Now, process the following sentence:
 Sentence: {sentence}
 Output:"""
 
-    response = ollama.chat(model="llama2:7b", messages=[{"role": "user", "content": prompt}])
-    result = response["message"]["content"]
-    
-    
+    result = client.chat(prompt)
+
     if ":" in result:
-        result = result.split(":", 1)[-1].strip()  
-    
+        result = result.split(":", 1)[-1].strip()
+
     return result
 
-df["Sentence"] = df["Sentence"].apply(process_sentence)
-df.to_csv("aug_data.csv", encoding="utf-8", index=False)
-print("Data augmentation complete! Check 'aug_data.csv'.")
+
+def augment_sentences(sentences):
+    """
+    Augment every sentence, querying the LLM once per duplicate cluster.
+    A sentence whose representative failed keeps its own text.
+    """
+    sentences = list(sentences)
+    augmented = fan_out(
+        lambda reps: client.map(process_sentence, reps, fallback=lambda sentence: None),
+        sentences,
+        stage="augmentation"
+    )
+    return [sentence if result is None else result for sentence, result in zip(sentences, augmented)]
+
+
+@instrumented("augmentation")
+def main():
+    df = pd.read_csv("processed_sentences.csv", encoding="utf-8")
+    METRICS.set("absa_stage_rows", len(df), stage="augmentation")
+    df["Sentence"] = augment_sentences(df["Sentence"])
+    df.to_csv("aug_data.csv", encoding="utf-8", index=False)
+    print("Data augmentation complete! Check 'aug_data.csv'.")
+    print(f"LLM cache: {client.cache.stats()}")
+    print(REPORT.summary("augmentation"))
+    REPORT.save()
 
 
+if __name__ == "__main__":
+    main()
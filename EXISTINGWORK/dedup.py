@@ -0,0 +1,295 @@
+import os
+import re
+import sys
+import json
+import zlib
+import argparse
+import importlib.util
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Jaccard similarity of character 5-gram sets above which two sentences are
+# reported as near-duplicates; 1.0 (the default) skips near-duplicate search.
+# Near-duplicates are only reported: results are shared between exact
+# duplicates alone, since a near-duplicate can differ in exactly the word
+# that decides its label.
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 1.0))
+DEDUP_REPORT = os.environ.get("DEDUP_REPORT", "dedup_report.json")
+# Representatives (and their results) a streaming stage keeps across chunks;
+# the least recently matched are dropped first and recomputed if they recur.
+DEDUP_MAX_ENTRIES = int(os.environ.get("DEDUP_MAX_ENTRIES", 100000))
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Two sentences whose words differ in one of these are never near-duplicates.
+# Words are compared after normalize(), which drops apostrophes ("didnt").
+NEGATIONS = {
+    "not", "no", "never", "nothing", "nobody", "none", "neither", "nor", "hardly", "barely", "without",
+    "dont", "doesnt", "didnt", "isnt", "wasnt", "arent", "werent", "cant", "cannot", "couldnt",
+    "wont", "wouldnt", "shouldnt", "havent", "hasnt", "hadnt", "aint",
+}
+OPINION_WORDS = {
+    "good", "great", "excellent", "amazing", "awesome", "best", "better", "delicious", "tasty", "fresh",
+    "friendly", "nice", "lovely", "perfect", "wonderful", "fantastic", "recommend", "love", "loved",
+    "like", "liked", "enjoy", "enjoyed", "fast", "quick", "cheap", "clean", "cozy", "attentive",
+    "bad", "worse", "worst", "terrible", "awful", "horrible", "poor", "rude", "slow", "bland", "cold",
+    "stale", "dirty", "noisy", "loud", "overpriced", "expensive", "disappointing", "disappointed",
+    "mediocre", "hate", "hated", "small", "big", "cramped", "greasy", "salty", "soggy", "undercooked",
+}
+
+
+def _load_clean_sentence():
+    if "pre_processing" not in sys.modules:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pre-processing.py")
+        spec = importlib.util.spec_from_file_location("pre_processing", path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["pre_processing"] = module
+        spec.loader.exec_module(module)
+    return sys.modules["pre_processing"].clean_sentence
+
+
+clean_sentence = _load_clean_sentence()
+
+
+def normalize(text):
+    """
+    Near-duplicate key of a sentence: clean_sentence from pre-processing.py
+    with runs of whitespace collapsed.
+    """
+    return " ".join(clean_sentence(str(text)).split())
+
+
+def exact_key(text):
+    """
+    Exact-duplicate key: the text with runs of whitespace collapsed. Case and
+    punctuation are kept, because the shared results quote the sentence's
+    tokens (pairs, rewrites) and must match every row they are given to.
+    """
+    return " ".join(str(text).split())
+
+
+def sentiment_words(text):
+    return set(re.findall(r"[a-z0-9]+", text)) & (NEGATIONS | OPINION_WORDS)
+
+
+class DedupIndex:
+    """
+    Incremental clustering of sentences into exact duplicates, with optional
+    near-duplicate detection for reporting.
+
+    Exact duplicates share the same exact_key and get the same representative.
+    With threshold < 1.0, a sentence that is not an exact duplicate is also
+    compared with earlier representatives: MinHash signatures over character
+    shingles of the normalized text and LSH banding find candidates, and each
+    candidate is confirmed with the true Jaccard similarity. Candidates whose
+    words differ in a negation or opinion word are refused. A near-duplicate
+    still gets its own representative (so fan_out computes it separately);
+    the representative it resembles is recorded in `near_of`.
+
+    `group` restricts clustering to sentences with equal group values, for
+    stages whose output also depends on other columns. Results computed for
+    representatives are kept in `results`, so the index can be reused across
+    chunks of a stream. With `max_entries`, trim() keeps only that many of
+    the most recently matched representatives, so memory stays bounded on a
+    long stream; a sentence whose representative was dropped is computed
+    again.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=64, bands=8, shingle_size=5, seed=0,
+                 max_entries=None):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.max_entries = max_entries
+        self.exact = OrderedDict()
+        self.next_rep = 0
+        self.near_of = {}
+        self.shingles = {}
+        self.words = {}
+        self.bands_of = {}
+        self.buckets = {}
+        self.results = {}
+
+    def shingle(self, text):
+        k = self.shingle_size
+        if len(text) <= k:
+            return {text}
+        return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+    def signature(self, shingles):
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((self.a[:, None] * x[None, :] + self.b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+    def assign(self, text, group=None):
+        """
+        Return (representative id, kind) for `text`, where kind is "new",
+        "exact" or "near". Only "exact" returns an earlier representative.
+        """
+        key = (group, exact_key(text))
+        if key in self.exact:
+            self.exact.move_to_end(key)
+            return self.exact[key], "exact"
+
+        rep = self.next_rep
+        self.next_rep += 1
+        self.exact[key] = rep
+        if self.threshold >= 1.0:
+            return rep, "new"
+
+        normalized = normalize(text)
+        shingles = self.shingle(normalized)
+        words = sentiment_words(normalized)
+        signature = self.signature(shingles)
+        bands = [
+            (group, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+        kind = "new"
+        for other in sorted({r for band in bands for r in self.buckets.get(band, ())}):
+            other_shingles = self.shingles[other]
+            if (self.words[other] == words
+                    and len(shingles & other_shingles) / len(shingles | other_shingles) >= self.threshold):
+                self.near_of[rep] = other
+                kind = "near"
+                break
+
+        self.shingles[rep] = shingles
+        self.words[rep] = words
+        if kind == "new":
+            self.bands_of[rep] = bands
+            for band in bands:
+                self.buckets.setdefault(band, []).append(rep)
+        return rep, kind
+
+    def trim(self):
+        """
+        Drop the least recently matched representatives beyond `max_entries`.
+        """
+        if self.max_entries is None:
+            return
+        while len(self.exact) > self.max_entries:
+            _, rep = self.exact.popitem(last=False)
+            self.results.pop(rep, None)
+            self.shingles.pop(rep, None)
+            self.words.pop(rep, None)
+            self.near_of.pop(rep, None)
+            for band in self.bands_of.pop(rep, ()):
+                bucket = self.buckets[band]
+                bucket.remove(rep)
+                if not bucket:
+                    del self.buckets[band]
+
+
+class DedupReport:
+    """
+    Per-stage counts of rows seen, rows actually computed, and the expensive
+    calls (LLM requests, parses) that fan-out avoided. Near-duplicates are
+    counted but always computed.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def record(self, stage, rows, computed, exact, near, avoided):
+        entry = self.stages.setdefault(stage, {
+            "rows": 0, "computed": 0, "exact_duplicates": 0, "near_duplicates": 0, "calls_avoided": 0
+        })
+        entry["rows"] += rows
+        entry["computed"] += computed
+        entry["exact_duplicates"] += exact
+        entry["near_duplicates"] += near
+        entry["calls_avoided"] += avoided
+
+    def summary(self, stage):
+        entry = self.stages.get(stage)
+        if not entry:
+            return f"{stage}: no rows"
+        return (
+            f"{stage}: computed {entry['computed']} of {entry['rows']} rows "
+            f"({entry['exact_duplicates']} exact duplicates shared, "
+            f"{entry['near_duplicates']} near duplicates computed separately), "
+            f"{entry['calls_avoided']} calls avoided"
+        )
+
+    def save(self, path=DEDUP_REPORT):
+        """
+        Write this process's stages into the shared report, keeping the
+        entries other stages wrote earlier.
+        """
+        data = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        data.update(self.stages)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+
+REPORT = DedupReport()
+
+
+def fan_out(compute, items, text=lambda item: item, group=None, index=None, stage="stage", cost=None):
+    """
+    Return compute's result for every item while calling it only once per
+    set of exact duplicates (see exact_key); near-duplicates are computed.
+
+    `compute` receives the list of representatives that have no result yet
+    and returns their results in order. `text` and `group` pick the sentence
+    and the exact-match group of an item. `cost(result)` gives the number of
+    calls one result took (1 by default) and feeds the avoided-calls count.
+    """
+    items = list(items)
+    index = index if index is not None else DedupIndex()
+    assignment = []
+    pending = {}
+    exact = near = 0
+    for position, item in enumerate(items):
+        rep, kind = index.assign(text(item), group(item) if group else None)
+        assignment.append(rep)
+        exact += kind == "exact"
+        near += kind == "near"
+        if rep not in index.results and rep not in pending:
+            pending[rep] = position
+
+    if pending:
+        computed = compute([items[position] for position in pending.values()])
+        index.results.update(zip(pending, computed))
+
+    cost = cost or (lambda result: 1)
+    avoided = sum(cost(index.results[rep]) for rep in assignment) - sum(cost(index.results[rep]) for rep in pending)
+    REPORT.record(stage, len(items), len(pending), exact, near, avoided)
+    results = [index.results[rep] for rep in assignment]
+    index.trim()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report exact and near-duplicate sentences in a CSV file.")
+    parser.add_argument("input_file", nargs="?", default="merged.csv")
+    parser.add_argument("--column", default="Sentence")
+    parser.add_argument("--threshold", type=float, default=min(DEDUP_THRESHOLD, 0.9))
+    parser.add_argument("--output", default="dedup_clusters.csv")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input_file, encoding="utf-8")
+    index = DedupIndex(threshold=args.threshold)
+    assigned = [index.assign(sentence) for sentence in df[args.column]]
+    df["cluster"] = [index.near_of.get(rep, rep) for rep, _ in assigned]
+    df["duplicate"] = [kind if kind != "new" else "" for _, kind in assigned]
+    df.to_csv(args.output, encoding="utf-8", index=False)
+
+    kinds = pd.Series([kind for _, kind in assigned], dtype=object)
+    print(f"{len(df)} rows, {df['cluster'].nunique()} clusters: "
+          f"{(kinds == 'exact').sum()} exact and {(kinds == 'near').sum()} near duplicates. "
+          f"Clusters saved to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class EmbeddingCache:
+    """
+    Persistent store of sentence embeddings, keyed by model ID and sentence hash.
+
+    Vectors are kept in one float32 memory-mapped file per model under `path`,
+    and a SQLite index maps (model, sentence hash) to a row of that file, so a
+    lookup only pages in the rows it needs. The store is shared by every run
+    that points at the same directory.
+
+    When the index grows beyond `max_entries`, the least recently used entries
+    are evicted and their rows are reused by later inserts.
+
+    Several processes (e.g. parallel k-fold workers) may open the same
+    directory. Each model's vector file has a single writer: the first
+    process to store vectors for a model holds an exclusive lock on its file,
+    and other processes only read that model's entries. Fine-tuned folds have
+    different weights and therefore separate files, so parallel folds each
+    append to their own file. Without fcntl (Windows) there is no file lock,
+    and the directory must not be shared by concurrent processes.
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        if path is None:
+            path = os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache")
+        if max_entries is None:
+            max_entries = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 1_000_000))
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA busy_timeout=60000")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT, key TEXT, row INTEGER, last_access REAL, PRIMARY KEY (model, key))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_access)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, dim INTEGER, used INTEGER)")
+        self.conn.commit()
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.arrays = {}
+        self.free = {}
+        self.writers = {}
+
+    @staticmethod
+    def key(sentence):
+        return hashlib.sha1(sentence.encode("utf-8")).hexdigest()
+
+    def _file(self, model):
+        return os.path.join(self.path, hashlib.sha1(model.encode("utf-8")).hexdigest()[:16] + ".f32")
+
+    def _array(self, model, dim=None):
+        """
+        Memory map of the model's vectors, created with `dim` columns on first use.
+        Returns None for a model that has never been stored.
+        """
+        if model in self.arrays:
+            return self.arrays[model]
+        row = self.conn.execute("SELECT dim, used FROM models WHERE model = ?", (model,)).fetchone()
+        if row is None:
+            if dim is None:
+                return None
+            self.conn.execute("INSERT OR IGNORE INTO models (model, dim, used) VALUES (?, ?, 0)", (model, dim))
+            self.conn.commit()
+            open(self._file(model), "ab").close()
+            dim, used = self.conn.execute("SELECT dim, used FROM models WHERE model = ?", (model,)).fetchone()
+        else:
+            dim, used = row
+        taken = {r for (r,) in self.conn.execute("SELECT row FROM embeddings WHERE model = ?", (model,))}
+        self.free[model] = [r for r in range(used) if r not in taken]
+        self.arrays[model] = self._map(model, dim)
+        return self.arrays[model]
+
+    def _writable(self, model):
+        """
+        Whether this process writes the model's vector file, claiming the
+        file's lock if no other process holds it.
+        """
+        if model not in self.writers:
+            handle = open(self._file(model), "ab")
+            if fcntl is not None:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    handle.close()
+                    handle = None
+            if handle is not None:
+                # Another writer may have used rows since the free list was built.
+                self.arrays.pop(model, None)
+                self._array(model)
+            self.writers[model] = handle
+        return self.writers[model] is not None
+
+    def _map(self, model, dim):
+        capacity = os.path.getsize(self._file(model)) // (4 * dim)
+        if capacity == 0:
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.memmap(self._file(model), dtype=np.float32, mode="r+", shape=(capacity, dim))
+
+    def _allocate(self, model, count):
+        """
+        Rows for `count` new vectors: freed rows first, then rows past the
+        high-water mark, growing the file geometrically when it is full.
+        """
+        rows = [self.free[model].pop() for _ in range(min(count, len(self.free[model])))]
+        missing = count - len(rows)
+        if missing:
+            used = self.conn.execute("SELECT used FROM models WHERE model = ?", (model,)).fetchone()[0]
+            rows.extend(range(used, used + missing))
+            self.conn.execute("UPDATE models SET used = ? WHERE model = ?", (used + missing, model))
+            array = self.arrays[model]
+            if used + missing > len(array):
+                dim = array.shape[1]
+                capacity = max(used + missing, 2 * len(array), 1024)
+                if isinstance(array, np.memmap):
+                    array.flush()
+                with open(self._file(model), "r+b") as f:
+                    f.truncate(capacity * dim * 4)
+                self.arrays[model] = self._map(model, dim)
+        return rows
+
+    def _rows(self, model, keys):
+        rows = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows.update(self.conn.execute(
+                f"SELECT key, row FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                (model, *batch)
+            ).fetchall())
+        return rows
+
+    def get_many(self, model, sentences):
+        """
+        Cached vectors for `sentences` in order, with None for every miss.
+        """
+        keys = [self.key(sentence) for sentence in sentences]
+        with self.lock:
+            array = self._array(model)
+            found = {}
+            if array is not None:
+                found = self._rows(model, keys)
+                if found and max(found.values()) >= len(array):
+                    # The file was grown by the process that writes it.
+                    array = self.arrays[model] = self._map(model, array.shape[1])
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND key = ?",
+                    [(now, model, key) for key in found]
+                )
+                self.conn.commit()
+            vectors = [np.array(array[found[key]]) if key in found else None for key in keys]
+            self.hits += sum(v is not None for v in vectors)
+            self.misses += sum(v is None for v in vectors)
+        return vectors
+
+    def put_many(self, model, sentences, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        entries = {self.key(sentence): vector for sentence, vector in zip(sentences, vectors)}
+        now = time.time()
+        with self.lock:
+            self._array(model, dim=vectors.shape[1])
+            if not self._writable(model):
+                return
+            # The write lock is taken before reading the row counters, so
+            # processes writing other models never get the same rows.
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                existing = self._rows(model, entries)
+                new_keys = [key for key in entries if key not in existing]
+                rows = dict(zip(new_keys, self._allocate(model, len(new_keys))))
+                rows.update({key: existing[key] for key in entries if key in existing})
+                array = self.arrays[model]
+                for key, vector in entries.items():
+                    array[rows[key]] = vector
+                if isinstance(array, np.memmap):
+                    array.flush()
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, key, row, last_access) VALUES (?, ?, ?, ?)",
+                    [(model, key, rows[key], now) for key in entries]
+                )
+                self.entries += len(new_keys)
+                self._evict()
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    def encode(self, model, sentences, encode_fn):
+        """
+        Embeddings for `sentences`, calling `encode_fn` once on the distinct
+        sentences that are not cached yet and storing its output.
+        """
+        sentences = list(sentences)
+        vectors = self.get_many(model, sentences)
+        missing = list(dict.fromkeys(s for s, v in zip(sentences, vectors) if v is None))
+        if missing:
+            computed = np.asarray(encode_fn(missing), dtype=np.float32)
+            self.put_many(model, missing, computed)
+            by_sentence = dict(zip(missing, computed))
+            vectors = [v if v is not None else by_sentence[s] for s, v in zip(sentences, vectors)]
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(vectors)
+
+    def _evict(self):
+        excess = self.entries - self.max_entries
+        if excess <= 0:
+            return
+        stale = self.conn.execute(
+            "SELECT model, key, row FROM embeddings ORDER BY last_access LIMIT ?", (excess,)
+        ).fetchall()
+        self.conn.executemany("DELETE FROM embeddings WHERE model = ? AND key = ?", [(m, k) for m, k, _ in stale])
+        for model, _, row in stale:
+            if model in self.free:
+                self.free[model].append(row)
+        self.entries -= len(stale)
+
+    def stats(self):
+        """
+        Hits and misses of this process plus the current size of the store.
+        """
+        with self.lock:
+            models = self.conn.execute("SELECT COUNT(*) FROM models").fetchone()[0]
+            entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "models": models,
+        }
+
+    def close(self):
+        with self.lock:
+            for array in self.arrays.values():
+                if isinstance(array, np.memmap):
+                    array.flush()
+            self.arrays.clear()
+            for handle in self.writers.values():
+                if handle is not None:
+                    handle.close()
+            self.writers.clear()
+            self.conn.close()
+
+
+def model_fingerprint(model):
+    """
+    ID of the weights that produce the embeddings: a hash over the SetFit
+    body's parameters and its normalization flag, or over the exported body
+    file of an onnxabsa.OnnxSpanModel. Fine-tuned models therefore never
+    share entries with the checkpoint they started from.
+    """
+    digest = hashlib.sha1()
+    if hasattr(model, "body_path"):
+        digest.update(json.dumps(model.config, sort_keys=True).encode("utf-8"))
+        with open(model.body_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return "onnx-" + digest.hexdigest()
+
+    digest.update(str(model.normalize_embeddings).encode("utf-8"))
+    for name, tensor in model.model_body.state_dict().items():
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.detach().float().cpu().numpy().tobytes())
+    return "setfit-" + digest.hexdigest()
+
+
+def cache_embeddings(model, cache, model_id=None):
+    """
+    Route `model.encode` through `cache`. Works for SetFitModel (including the
+    aspect and polarity models of an AbsaModel) and onnxabsa.OnnxSpanModel.
+    The model ID is taken when this is called, so attach the cache after
+    training has finished.
+    """
+    model_id = model_id or model_fingerprint(model)
+    encode = model.encode
+
+    def cached_encode(inputs, batch_size=32, **kwargs):
+        def compute(missing):
+            embeddings = encode(missing, batch_size=batch_size, **kwargs)
+            if hasattr(embeddings, "detach"):
+                embeddings = embeddings.detach().float().cpu().numpy()
+            return embeddings
+
+        embeddings = cache.encode(model_id, inputs, compute)
+        if getattr(model, "has_differentiable_head", False):
+            import torch
+
+            return torch.from_numpy(embeddings).to(model.device)
+        return embeddings
+
+    model.encode = cached_encode
+    return model
+
+
+def cache_absa_embeddings(absa_model, cache):
+    cache_embeddings(absa_model.aspect_model, cache)
+    cache_embeddings(absa_model.polarity_model, cache)
+    return absa_model
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import pickle
+import traceback
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+KFOLD_WORKERS = int(os.environ.get("KFOLD_WORKERS", 1))
+
+
+def write_json(path, data):
+    """
+    Replace `path` atomically, so an interrupted write never leaves a
+    truncated results file behind.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+    os.replace(tmp_path, path)
+
+
+class FoldContext:
+    """
+    Checkpoint directory of one fold. Stages run inside `with ctx.stage(name)`
+    are timed and marked complete when the block finishes, so a rerun can skip
+    them and reload what they saved under ctx.path(name) instead.
+    """
+
+    def __init__(self, fold, directory):
+        self.fold = fold
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.state_path = os.path.join(directory, "state.json")
+        self.state = {"completed": [], "timings": {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def completed(self, name):
+        return name in self.state["completed"]
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.state["timings"][name] = time.perf_counter() - start
+        if name not in self.state["completed"]:
+            self.state["completed"].append(name)
+        write_json(self.state_path, self.state)
+
+    def save(self, name, value):
+        with open(self.path(f"{name}.pkl"), "wb") as f:
+            pickle.dump(value, f)
+
+    def load(self, name):
+        with open(self.path(f"{name}.pkl"), "rb") as f:
+            return pickle.load(f)
+
+    @property
+    def timings(self):
+        return dict(self.state["timings"])
+
+
+def _run(run_fold, fold, train_index, val_index, directory, threads):
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    ctx = FoldContext(fold, directory)
+    start = time.perf_counter()
+    metrics = run_fold(fold, train_index, val_index, ctx)
+    return metrics, time.perf_counter() - start, ctx.timings
+
+
+class FoldScheduler:
+    """
+    Run the folds of a k-fold experiment, optionally several at once, and
+    keep all their results in one JSON file.
+
+    `run_fold(fold, train_index, val_index, ctx)` trains and evaluates one
+    fold and returns its metrics; `ctx` is the fold's FoldContext for in-fold
+    checkpoints. Folds already marked done in `results_path` are skipped, and
+    an interrupted fold resumes from its last completed stage.
+
+    With workers > 1 the folds run in forked processes, each limited to its
+    share of the CPU threads. That suits CPU-bound SetFit folds; folds that
+    share one GPU should keep workers=1.
+    """
+
+    def __init__(self, results_path="kfold_results.json", checkpoint_dir="fold_checkpoints", workers=KFOLD_WORKERS):
+        self.results_path = results_path
+        self.checkpoint_dir = checkpoint_dir
+        self.workers = max(1, workers)
+        self.data = {"folds": {}}
+        if os.path.exists(results_path):
+            with open(results_path, encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def results(self):
+        """
+        Records of the completed folds, in fold order.
+        """
+        folds = [record for record in self.data["folds"].values() if record["status"] == "done"]
+        return sorted(folds, key=lambda record: record["fold"])
+
+    def _record(self, fold, **fields):
+        record = self.data["folds"].setdefault(str(fold), {"fold": fold})
+        record.update(fields)
+        write_json(self.results_path, self.data)
+
+    def run(self, run_fold, splits):
+        """
+        `splits` yields (train_index, val_index) pairs, e.g. KFold.split(df).
+        Returns the records of all completed folds.
+        """
+        pending = []
+        for fold, (train_index, val_index) in enumerate(splits):
+            record = self.data["folds"].get(str(fold))
+            if record and record["status"] == "done":
+                print(f"Skipping Fold {fold + 1}, already completed.")
+                continue
+            pending.append((fold, list(map(int, train_index)), list(map(int, val_index))))
+
+        threads = max(1, (os.cpu_count() or 1) // self.workers) if self.workers > 1 else None
+        jobs = {}
+        executor = None
+        if self.workers > 1 and len(pending) > 1:
+            executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("fork"))
+
+        for fold, train_index, val_index in pending:
+            directory = os.path.join(self.checkpoint_dir, f"fold_{fold}")
+            self._record(
+                fold, status="running", started=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                train_size=len(train_index), validation_indices=val_index
+            )
+            args = (run_fold, fold, train_index, val_index, directory, threads)
+            if executor is None:
+                print(f"Starting Fold {fold + 1}...")
+                self._finish(fold, lambda: _run(*args))
+            else:
+                jobs[executor.submit(_run, *args)] = fold
+
+        if executor is not None:
+            for future in as_completed(jobs):
+                self._finish(jobs[future], future.result)
+            executor.shutdown()
+        return self.results()
+
+    def _finish(self, fold, result):
+        try:
+            metrics, seconds, timings = result()
+        except Exception:
+            self._record(fold, status="failed", error=traceback.format_exc())
+            print(f"Fold {fold + 1} failed; rerun to resume it.\n{traceback.format_exc()}")
+            return
+        self.data["folds"][str(fold)].pop("error", None)
+        self._record(
+            fold, status="done", finished=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            seconds=seconds, stages=timings, metrics=metrics
+        )
+        print(f"Fold {fold + 1} completed in {seconds:.1f}s.")
@@ -1,22 +1,83 @@
+import os
 import pandas as pd
 import ast
+import json
 
-df = pd.read_csv("fulloutput.csv")
+from instrumentation import METRICS, instrumented
 
-expanded_rows = []
+OUTPUT_FORMATS = os.environ.get("FORMATTING_OUTPUT", "csv").split(",")
 
-for _, row in df.iterrows():
-    id_value = row["id"]
-    sentence = row["Sentence"]
-    aspect_sentiment_pairs = ast.literal_eval(row["aspect_sentiment_pairs"])  
-    
-    for aspect, sentiment in aspect_sentiment_pairs:
-        expanded_rows.append([id_value, sentence, aspect, sentiment])
 
+def parse_pairs(value):
+    """
+    Parse one aspect_sentiment_pairs string.
+    JSON is tried first since that is what the LLM is asked to produce; Python
+    literals (single quotes, tuples) fall back to ast.literal_eval.
+    Returns (pairs, None) or (None, error message).
+    """
+    if not isinstance(value, str):
+        return None, "missing value"
+    try:
+        pairs = json.loads(value)
+    except ValueError:
+        try:
+            pairs = ast.literal_eval(value.strip())
+        except (SyntaxError, ValueError, TypeError, MemoryError, RecursionError) as e:
+            return None, f"unparseable: {type(e).__name__}"
+    if not isinstance(pairs, (list, tuple)):
+        return None, "not a list"
+    for pair in pairs:
+        if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+            return None, "entry is not an [aspect, sentiment] pair"
+    return list(pairs), None
 
-expanded_df = pd.DataFrame(expanded_rows, columns=["id", "text", "span", "label"])
 
+def expand(df):
+    """
+    Split df into one row per (aspect, sentiment) pair and a frame of rows
+    whose pairs could not be parsed.
+    """
+    parsed = [parse_pairs(value) for value in df["aspect_sentiment_pairs"]]
+    pairs = pd.Series([p for p, _ in parsed], index=df.index, dtype=object)
+    errors = pd.Series([e for _, e in parsed], index=df.index, dtype=object)
 
-expanded_df.to_csv("existingworktrainingdata.csv", index=False)
+    valid = errors.isna()
+    rejected = df.loc[~valid].assign(error=errors[~valid])
 
-print("Expanded CSV file saved as 'finaloutput.csv'")
+    exploded = pd.DataFrame({
+        "id": df.loc[valid, "id"],
+        "text": df.loc[valid, "Sentence"],
+        "pair": pairs[valid],
+    }).explode("pair")
+    exploded = exploded[exploded["pair"].notna()]
+
+    expanded_df = pd.DataFrame({
+        "id": exploded["id"].to_numpy(),
+        "text": exploded["text"].to_numpy(),
+        "span": [pair[0] for pair in exploded["pair"]],
+        "label": [pair[1] for pair in exploded["pair"]],
+    }, columns=["id", "text", "span", "label"])
+    return expanded_df, rejected
+
+
+@instrumented("formatting")
+def main():
+    df = pd.read_csv("fulloutput.csv")
+    METRICS.set("absa_stage_rows", len(df), stage="formatting")
+
+    expanded_df, rejected = expand(df)
+
+    if "csv" in OUTPUT_FORMATS:
+        expanded_df.to_csv("existingworktrainingdata.csv", index=False)
+        print("Expanded CSV file saved as 'existingworktrainingdata.csv'")
+    if "parquet" in OUTPUT_FORMATS:
+        expanded_df.to_parquet("existingworktrainingdata.parquet", index=False)
+        print("Expanded Parquet file saved as 'existingworktrainingdata.parquet'")
+
+    if len(rejected):
+        rejected.to_csv("formatting_rejected.csv", index=False)
+        print(f"{len(rejected)} malformed rows written to 'formatting_rejected.csv'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "metrics")
+METRICS_REPORT = os.environ.get("METRICS_REPORT", "run_report.json")
+
+# Histogram bucket upper bounds (seconds), from sub-millisecond spaCy parses
+# to multi-minute LLM generations.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (1, 2, 3, 4, 5, 10)
+
+HELP = {
+    "absa_stage_seconds": "Wall time of a pipeline stage.",
+    "absa_stage_rows": "Rows a stage processed.",
+    "absa_llm_request_seconds": "Latency of LLM requests that were sent (cache misses).",
+    "absa_llm_requests_total": "LLM requests by outcome (sent, cached, failed).",
+    "absa_llm_tokens_total": "Prompt and completion tokens reported by the LLM.",
+    "absa_llm_attempts": "Attempts process_with_retry needed per row.",
+    "absa_llm_retries_total": "Extra LLM attempts made after an empty answer.",
+    "absa_lexicon_rows_total": "Filtering rows resolved by the lexicon fast path or sent to the LLM.",
+    "absa_spacy_parse_seconds": "spaCy parse time per sentence, averaged over each pipe batch.",
+    "absa_spacy_sentences_total": "Sentences parsed by spaCy, or served from the DocStore.",
+    "absa_generate_seconds": "Latency of one batched generate call in localprediction.py.",
+    "absa_generated_tokens_total": "Tokens generated by localprediction.py.",
+    "absa_model_load_seconds": "Time the model registry took to load a model.",
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total, counts = 0, []
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.cumulative())},
+        }
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+class Metrics:
+    """
+    Process-wide counters, gauges and histograms with Prometheus-style labels.
+
+    Recording is a dict update under a lock, cheap enough to call around every
+    LLM request or spaCy batch. write(stage) saves what was recorded since the
+    previous write as a Prometheus text file under METRICS_DIR (for
+    node_exporter's textfile collector), with a `stage` label on every
+    sample, merges it into the JSON run report and starts over. Stages run
+    one after another in one process (pipeline.py) therefore never report
+    each other's samples.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.stages = []
+        self.active = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage; its wall time is recorded even if it fails.
+        """
+        start = time.perf_counter()
+        status = "failed"
+        self.active = name
+        try:
+            yield
+            status = "ok"
+        finally:
+            self.active = None
+            seconds = time.perf_counter() - start
+            self.set("absa_stage_seconds", seconds, stage=name)
+            with self.lock:
+                self.stages.append({
+                    "stage": name,
+                    "status": status,
+                    "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(time.time() - seconds)),
+                    "seconds": seconds,
+                })
+
+    def timed_iter(self, iterable, name, batch=1, **labels):
+        """
+        Yield from `iterable`, observing the time spent producing each item.
+        With batch > 1 (e.g. nlp.pipe), the time of every `batch` items is
+        averaged over them, since a pipe computes a whole batch on one item.
+        """
+        iterator = iter(iterable)
+        elapsed, pending = 0.0, 0
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            elapsed += time.perf_counter() - start
+            pending += 1
+            if pending >= batch:
+                for _ in range(pending):
+                    self.observe(name, elapsed / pending, **labels)
+                elapsed, pending = 0.0, 0
+            yield item
+        for _ in range(pending):
+            self.observe(name, elapsed / pending, **labels)
+
+    def prometheus(self, stage=None):
+        """
+        Prometheus text format; with `stage`, samples without a stage label
+        get stage=`stage`.
+        """
+        def labelled(labels):
+            if stage is None or any(k == "stage" for k, _ in labels):
+                return labels
+            return tuple(sorted(labels + (("stage", stage),)))
+
+        lines = []
+        with self.lock:
+            series = {}
+            for (name, labels), value in self.counters.items():
+                series.setdefault((name, "counter"), []).append((labelled(labels), value))
+            for (name, labels), value in self.gauges.items():
+                series.setdefault((name, "gauge"), []).append((labelled(labels), value))
+            for (name, labels), histogram in self.histograms.items():
+                series.setdefault((name, "histogram"), []).append((labelled(labels), histogram))
+
+            for (name, kind), samples in sorted(series.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(samples, key=lambda sample: sample[0]):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+                        continue
+                    for bound, count in zip(value.buckets, value.cumulative()):
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        def group(items, convert=lambda v: v):
+            grouped = {}
+            for (name, labels), value in sorted(items, key=lambda item: item[0]):
+                key = ",".join(f"{k}={v}" for k, v in labels) or "total"
+                grouped.setdefault(name, {})[key] = convert(value)
+            return grouped
+
+        with self.lock:
+            return {
+                "stages": list(self.stages),
+                "counters": group(self.counters.items()),
+                "gauges": group(self.gauges.items()),
+                "histograms": group(self.histograms.items(), Histogram.to_dict),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+            self.stages.clear()
+
+    def write(self, stage, metrics_dir=METRICS_DIR, report_path=METRICS_REPORT):
+        """
+        Save what was recorded since the last write as
+        `<metrics_dir>/<stage>.prom` and under `stage` in `report_path`,
+        then reset. Both files are replaced atomically.
+        """
+        os.makedirs(metrics_dir, exist_ok=True)
+        prom_path = os.path.join(metrics_dir, f"{stage}.prom")
+        with open(prom_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.prometheus(stage))
+        os.replace(prom_path + ".tmp", prom_path)
+
+        data = {}
+        if os.path.exists(report_path):
+            with open(report_path, encoding="utf-8") as f:
+                data = json.load(f)
+        data[stage] = {"written": time.strftime("%Y-%m-%dT%H:%M:%S"), **self.report()}
+        with open(report_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(report_path + ".tmp", report_path)
+        self.reset()
+
+
+METRICS = Metrics()
+
+
+def instrumented(stage):
+    """
+    Decorator for a stage script's main(): times the stage and writes the
+    metrics when it returns or fails. Inside a stage that is already being
+    timed (pipeline.py), main() runs as is and the caller writes.
+    """
+    def decorate(main):
+        @functools.wraps(main)
+        def wrapper(*args, **kwargs):
+            if METRICS.active is not None:
+                return main(*args, **kwargs)
+            try:
+                with METRICS.stage(stage):
+                    return main(*args, **kwargs)
+            finally:
+                METRICS.write(stage)
+        return wrapper
+    return decorate
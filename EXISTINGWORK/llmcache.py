@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class LLMCache:
+    """
+    Persistent, content-addressed store for LLM prompt/response pairs.
+
+    Entries are keyed by a SHA-256 hash of the model name, the prompt and the
+    sampling parameters, so a rerun with the same inputs is served from disk
+    instead of querying the model again. The store is a single SQLite file and
+    every insert is committed immediately, which lets a crashed run resume
+    where it stopped.
+
+    When the stored responses grow beyond `max_bytes`, the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        if path is None:
+            path = os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite")
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("LLM_CACHE_MAX_BYTES", 1 << 30))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+            "size INTEGER, created REAL, last_access REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, prompt, **params):
+        """
+        Hash of model, prompt and sampling parameters.
+        `prompt` may be a string or a list of chat messages.
+        """
+        payload = json.dumps(
+            {"model": model, "prompt": prompt, "params": params},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached response for `key`, or None on a miss.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key, response, model=None):
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now)
+            )
+            self.total_bytes += size
+            self._evict()
+            self.conn.commit()
+
+    def get_or_compute(self, model, prompt, compute, **params):
+        """
+        Serve the response from the cache, or call `compute()` and store its result.
+        """
+        key = self.make_key(model, prompt, **params)
+        response = self.get(key)
+        if response is None:
+            response = compute()
+            self.put(key, response, model=model)
+        return response
+
+    def _evict(self):
+        excess = self.total_bytes - self.max_bytes
+        if excess <= 0:
+            return
+        freed = 0
+        stale = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+        self.total_bytes -= freed
+
+    def stats(self):
+        """
+        Hits and misses of this process plus the current size of the store.
+        """
+        with self.lock:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,122 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import ollama
+
+from instrumentation import METRICS
+from llmcache import LLMCache
+
+# Errors of a request that got no usable answer from the server (error
+# status, timeout, refused or dropped connection). Retrying may succeed.
+TRANSPORT_ERRORS = (ollama.ResponseError, httpx.HTTPError, ConnectionError, TimeoutError)
+
+
+class LLMClient:
+    """
+    Shared client for the Ollama stages (augmentation, adversarial, filtering).
+
+    Requests are sent from a thread pool so that up to `concurrency` calls are
+    in flight at once, keeping the model server busy instead of idling between
+    rows. Every request is bounded by `timeout` seconds.
+
+    The Ollama server only answers requests in parallel when it is started with
+    OLLAMA_NUM_PARALLEL >= concurrency; otherwise extra requests just queue.
+
+    Responses are stored in an LLMCache keyed by model, prompt and request
+    options. Pass `cache=False` to always query the server.
+    """
+
+    def __init__(self, model="llama2:7b", concurrency=None, timeout=None, host=None, cache=None):
+        if concurrency is None:
+            concurrency = int(os.environ.get("LLM_CONCURRENCY", 4))
+        if timeout is None:
+            timeout = float(os.environ.get("LLM_TIMEOUT", 300))
+        self.model = model
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.client = ollama.Client(host=host, timeout=timeout)
+        if cache is None:
+            cache = LLMCache()
+        self.cache = cache if cache is not False else None
+
+    def _cached(self, kind, prompt, compute, attempt, delay, kwargs):
+        sent = []
+
+        def request():
+            sent.append(True)
+            if delay:
+                time.sleep(delay)
+            start = time.perf_counter()
+            try:
+                response = compute()
+            except Exception:
+                METRICS.inc("absa_llm_requests_total", model=self.model, kind=kind, outcome="failed")
+                raise
+            METRICS.observe("absa_llm_request_seconds", time.perf_counter() - start, model=self.model, kind=kind)
+            return response
+
+        if self.cache is None:
+            result = request()
+        else:
+            result = self.cache.get_or_compute(
+                self.model, prompt, request, kind=kind, attempt=attempt, **kwargs
+            )
+        METRICS.inc("absa_llm_requests_total", model=self.model, kind=kind, outcome="sent" if sent else "cached")
+        return result
+
+    def _count_tokens(self, response):
+        METRICS.inc("absa_llm_tokens_total", response.get("prompt_eval_count") or 0, model=self.model, type="prompt")
+        METRICS.inc("absa_llm_tokens_total", response.get("eval_count") or 0, model=self.model, type="completion")
+
+    def chat(self, prompt, attempt=0, delay=0, **kwargs):
+        """
+        Send a single-turn chat request and return the message content.
+        `attempt` is part of the cache key, so retries of the same prompt get
+        fresh responses while a rerun replays them from the cache. `delay`
+        seconds (a retry backoff) are waited only when the request is actually
+        sent, never for a cached response.
+        """
+        def compute():
+            response = self.client.chat(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                **kwargs
+            )
+            self._count_tokens(response)
+            return response["message"]["content"]
+
+        return self._cached("chat", prompt, compute, attempt, delay, kwargs)
+
+    def generate(self, prompt, attempt=0, delay=0, **kwargs):
+        """
+        Send a completion request and return the generated text.
+        """
+        def compute():
+            response = self.client.generate(model=self.model, prompt=prompt, **kwargs)
+            self._count_tokens(response)
+            return str(response.get("response", ""))
+
+        return self._cached("generate", prompt, compute, attempt, delay, kwargs)
+
+    def map(self, func, items, fallback=None):
+        """
+        Apply `func` to every item using the thread pool.
+        Results are returned as a list in the same order as `items`.
+
+        If `fallback` is given, a failing item (timeout, connection error, ...)
+        is reported and replaced by `fallback(item)` instead of aborting the run.
+        """
+        def run(item):
+            try:
+                return func(item)
+            except Exception as e:
+                if fallback is None:
+                    raise
+                print(f"LLM request failed, using fallback: {e}")
+                return fallback(item)
+
+        items = list(items)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(run, items))
@@ -1,20 +1,113 @@
+import os
+import numpy as np
 import pandas as pd
 
+from instrumentation import instrumented
 
-file1 = pd.read_csv('aug_data.csv')
-file2 = pd.read_csv('adversarial_data.csv')
 
+def interleave(file1, file2):
+    """
+    Return file1 row 0, file2 row 0, file1 row 1, file2 row 1, ...
+    The shorter frame is padded with empty rows, as the merged dataset has
+    always been built.
+    """
+    max_len = max(len(file1), len(file2))
+    if max_len == 0:
+        return pd.DataFrame()
 
-max_len = max(len(file1), len(file2))
+    file1 = file1.reindex(range(max_len))
+    file2 = file2.reindex(range(max_len))
 
+    stacked = pd.concat([file1, file2], ignore_index=True)
+    order = np.arange(2 * max_len).reshape(2, max_len).T.ravel()
+    return stacked.iloc[order].reset_index(drop=True)
 
-file1 = file1.reindex(range(max_len))
-file2 = file2.reindex(range(max_len))
 
+def merge(path1, path2, output_path):
+    file1 = pd.read_csv(path1)
+    file2 = pd.read_csv(path2)
+    interleave(file1, file2).to_csv(output_path, index=False)
 
-merged = pd.DataFrame()
-for i in range(max_len):
-    merged = pd.concat([merged, file1.iloc[[i]], file2.iloc[[i]]], ignore_index=True)
 
+def scan(path, chunk_size):
+    """
+    First pass of the streaming merge over one file: its row count and the
+    dtype pandas gives each column when reading the whole file.
+    """
+    kinds = {column: set() for column in pd.read_csv(path, nrows=0).columns}
+    length = 0
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        length += len(chunk)
+        for column, dtype in chunk.dtypes.items():
+            kinds[column].add(dtype.kind)
 
-merged.to_csv('merged.csv', index=False)
+    dtypes = {}
+    for column, column_kinds in kinds.items():
+        if column_kinds == {"b"}:
+            dtypes[column] = "bool"
+        elif column_kinds and column_kinds <= {"i", "u"}:
+            dtypes[column] = "int64"
+        elif column_kinds and column_kinds <= {"i", "u", "f"}:
+            dtypes[column] = "float64"
+        else:
+            dtypes[column] = "object"
+    return length, dtypes
+
+
+def merge_streaming(path1, path2, output_path, chunk_size=100000):
+    """
+    Interleave two CSV files with memory bounded by `chunk_size` rows per input.
+
+    Produces the same file as merge(). A first pass records each file's
+    length and whole-file column dtypes, and every chunk is read with those
+    dtypes, so values are formatted as in a full read. As in merge(), the
+    shorter file's padding turns its integer columns into floats and its
+    boolean columns into objects for the whole file, not just the tail.
+    Object columns are read as text, so they round-trip exactly.
+    """
+    paths = [path1, path2]
+    scans = [scan(path, chunk_size) for path in paths]
+    max_len = max(length for length, _ in scans)
+    if max_len == 0:
+        pd.DataFrame().to_csv(output_path, index=False)
+        return
+
+    readers = []
+    dtypes = []
+    for path, (length, file_dtypes) in zip(paths, scans):
+        if length < max_len:
+            file_dtypes = {c: "float64" if d == "int64" else d for c, d in file_dtypes.items()}
+        read_dtypes = {c: str if d == "object" else d for c, d in file_dtypes.items()}
+        readers.append(pd.read_csv(path, chunksize=chunk_size, dtype=read_dtypes))
+        # Padded boolean columns hold NaN, so pandas stores them as objects.
+        dtypes.append({c: "object" if d == "bool" and length < max_len else d for c, d in file_dtypes.items()})
+
+    written = 0
+    while written < max_len:
+        rows = min(chunk_size, max_len - written)
+        chunks = []
+        for reader, file_dtypes in zip(readers, dtypes):
+            chunk = next(reader, None)
+            if chunk is None:
+                chunk = pd.DataFrame({c: pd.Series(dtype=d) for c, d in file_dtypes.items()})
+            chunks.append(chunk.astype(file_dtypes).reset_index(drop=True).reindex(range(rows)))
+
+        stacked = pd.concat(chunks, ignore_index=True)
+        order = np.arange(2 * rows).reshape(2, rows).T.ravel()
+        stacked.iloc[order].to_csv(
+            output_path, mode="w" if written == 0 else "a", header=written == 0, index=False
+        )
+        written += rows
+
+
+@instrumented("merge")
+def main():
+    chunk_size = os.environ.get("MERGE_CHUNK_SIZE")
+    if chunk_size:
+        merge_streaming('aug_data.csv', 'adversarial_data.csv', 'merged.csv', int(chunk_size))
+    else:
+        merge('aug_data.csv', 'adversarial_data.csv', 'merged.csv')
+
+
+if __name__ == "__main__":
+    main()
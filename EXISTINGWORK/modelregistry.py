@@ -0,0 +1,158 @@
+import os
+import sys
+import time
+import threading
+import multiprocessing
+
+from instrumentation import METRICS
+
+# spaCy models used for dependency parsing. The extraction rules only read
+# tags, POS, dependencies and sentence boundaries, so SPACY_EXCLUDE is never
+# loaded.
+SPACY_MODEL = os.environ.get("SPACY_MODEL", "en_core_web_trf")
+SPACY_FAST_MODEL = os.environ.get("SPACY_FAST_MODEL", "en_core_web_sm")
+SPACY_EXCLUDE = ["ner", "lemmatizer"]
+
+# SetFit ABSA models. "onnx" runs the int8 ONNX export from onnxabsa.py on
+# CPU instead of torch.
+ABSA_BACKEND = os.environ.get("ABSA_BACKEND", "torch")
+ABSA_ASPECT_MODEL = os.environ.get("ABSA_ASPECT_MODEL", "models/setfit-absa-model-aspect")
+ABSA_POLARITY_MODEL = os.environ.get("ABSA_POLARITY_MODEL", "models/setfit-absa-model-polarity")
+ABSA_ONNX_DIR = os.environ.get("ABSA_ONNX_DIR", "models/onnx")
+
+
+class ModelRegistry:
+    """
+    Named model loaders, each run the first time its model is requested.
+
+    Stages ask the registry for a model instead of loading it at import, so
+    a stage only pays for the models it actually uses, and stages running in
+    the same process (pipeline.py, service.py) share one instance of each. Load times
+    are kept in `load_seconds` and recorded as absa_model_load_seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaders = {}
+        self.models = {}
+        self.load_seconds = {}
+
+    def register(self, name, loader):
+        """
+        Register `loader`, a function without arguments returning the model.
+        Re-registering a name that is already loaded keeps the loaded model.
+        """
+        with self.lock:
+            self.loaders[name] = loader
+
+    def get(self, name):
+        if name in self.models:
+            return self.models[name]
+        with self.lock:
+            if name not in self.models:
+                if name not in self.loaders:
+                    raise KeyError(f"no model registered as '{name}' (registered: {', '.join(sorted(self.loaders))})")
+                start = time.perf_counter()
+                self.models[name] = self.loaders[name]()
+                self.load_seconds[name] = time.perf_counter() - start
+                METRICS.set("absa_model_load_seconds", self.load_seconds[name], model=name)
+            return self.models[name]
+
+    def loaded(self):
+        return sorted(self.models)
+
+
+REGISTRY = ModelRegistry()
+
+
+def load_spacy(model):
+    import spacy
+
+    return spacy.load(model, exclude=SPACY_EXCLUDE)
+
+
+def load_absa_model():
+    if ABSA_BACKEND == "onnx":
+        from onnxabsa import OnnxAbsaModel
+
+        return OnnxAbsaModel(ABSA_ONNX_DIR)
+    from setfit import AbsaModel
+
+    return AbsaModel.from_pretrained(ABSA_ASPECT_MODEL, ABSA_POLARITY_MODEL)
+
+
+REGISTRY.register("spacy_trf", lambda: load_spacy(SPACY_MODEL))
+REGISTRY.register("spacy_fast", lambda: load_spacy(SPACY_FAST_MODEL))
+REGISTRY.register("setfit", load_absa_model)
+
+
+_worker = {}
+
+
+def _init_worker(threads, barrier):
+    # Forked workers inherit torch's thread count; split the cores instead of
+    # letting every worker use all of them.
+    torch = sys.modules.get("torch")
+    if torch is not None and threads:
+        torch.set_num_threads(threads)
+    _worker["barrier"] = barrier
+
+
+def _ready(_):
+    # Each ready task waits for the others, so every worker answers one.
+    _worker["barrier"].wait(timeout=60)
+    return os.getpid(), REGISTRY.loaded()
+
+
+class WarmPool:
+    """
+    Worker processes forked after the models in `names` are loaded, so every
+    worker starts with them in memory (shared copy-on-write with the parent)
+    instead of loading them again.
+
+    Only CPU models can be shared this way: CUDA does not survive a fork, so
+    a pool is refused once CUDA is initialised. Without fork (Windows) or
+    with processes <= 1, map() runs in this process.
+    """
+
+    def __init__(self, names, processes=None):
+        processes = processes or os.cpu_count() or 1
+        start = time.perf_counter()
+        for name in names:
+            REGISTRY.get(name)
+        self.load_seconds = time.perf_counter() - start
+
+        self.pool = None
+        self.ready_seconds = 0.0
+        self.workers = []
+        if processes > 1 and "fork" in multiprocessing.get_all_start_methods():
+            torch = sys.modules.get("torch")
+            if torch is not None and torch.cuda.is_initialized():
+                raise ValueError("CUDA is initialised in this process; forked workers cannot use it")
+            start = time.perf_counter()
+            context = multiprocessing.get_context("fork")
+            threads = max((os.cpu_count() or 1) // processes, 1)
+            self.pool = context.Pool(processes, initializer=_init_worker, initargs=(threads, context.Barrier(processes)))
+            self.workers = self.pool.map(_ready, range(processes), chunksize=1)
+            self.ready_seconds = time.perf_counter() - start
+
+    def map(self, func, items):
+        """
+        func(item) for every item, in order. `func` must be a module-level
+        function; it can fetch the preloaded models from the registry.
+        """
+        if self.pool is None:
+            return [func(item) for item in items]
+        return self.pool.map(func, items, chunksize=1)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,81 @@
+import re
+import json
+import time
+
+from openaistandin import NEGATIVE, POSITIVE, StandInServer, answer_sentence, count_tokens
+
+# Opinion word swaps used to "rephrase" sentences without touching aspects.
+REPHRASE = {
+    "great": "excellent", "excellent": "great", "delicious": "tasty", "friendly": "welcoming",
+    "amazing": "wonderful", "fast": "quick", "perfect": "flawless", "lovely": "charming",
+    "terrible": "awful", "awful": "terrible", "rude": "impolite", "slow": "sluggish",
+    "bland": "tasteless", "overpriced": "too expensive", "cold": "lukewarm", "noisy": "loud",
+}
+
+
+def rephrase(sentence):
+    return re.sub(r"[A-Za-z]+", lambda m: REPHRASE.get(m.group(0).lower(), m.group(0)), sentence)
+
+
+def answer_triples(sentence):
+    """
+    [[aspect, opinion, sentiment], ...] for a sentence, with the opinion being
+    the first sentiment word after the aspect.
+    """
+    lowered = sentence.lower()
+    triples = []
+    for aspect, sentiment in answer_sentence(sentence):
+        rest = lowered[lowered.find(aspect):]
+        found = sorted((rest.find(w), w) for w in POSITIVE + NEGATIVE if w in rest)
+        if found:
+            triples.append([aspect, found[0][1], sentiment])
+    return triples
+
+
+def answer_ollama_prompt(prompt):
+    """
+    Response to the prompts of the Ollama stages: triples for filtering.py,
+    a rephrased sentence for adversarial.py and augmentation.py.
+    """
+    if "aspect-opinion-sentiment triples" in prompt:
+        sentence = re.search(r'^Sentence: "(.*)"$', prompt, re.M)
+        return json.dumps(answer_triples(sentence.group(1) if sentence else ""))
+    original = re.search(r'Original Sentence: "(.*?)"\n', prompt)
+    if original:
+        return rephrase(original.group(1))
+    sentence = re.search(r"^Sentence: (.*)$", prompt, re.M)
+    return rephrase(sentence.group(1) if sentence else "")
+
+
+class OllamaStandInServer(StandInServer):
+    """
+    Local stand-in for the Ollama /api/chat and /api/generate endpoints,
+    with the same deterministic answers and latency model as StandInServer.
+    Point LLMClient (or OLLAMA_HOST) at `host`.
+    """
+
+    def __init__(self, base_latency=0.2, prompt_latency=0.00005, completion_latency=0.01, host="127.0.0.1", port=0):
+        super().__init__(base_latency, prompt_latency, completion_latency, host=host, port=port)
+        self.host = self.url[:-len("/v1/")]
+
+    def respond(self, path, body):
+        if path.endswith("/api/chat"):
+            prompt = "\n".join(m["content"] for m in body.get("messages", []))
+        else:
+            prompt = body.get("prompt", "")
+        content = answer_ollama_prompt(prompt)
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(content)
+        self.delay(prompt_tokens, completion_tokens)
+        response = {
+            "model": body.get("model", "llama2:7b"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": completion_tokens,
+        }
+        if path.endswith("/api/chat"):
+            response["message"] = {"role": "assistant", "content": content}
+        else:
+            response["response"] = content
+        return response
@@ -0,0 +1,321 @@
+import argparse
+import inspect
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+
+BODY_FILE = "body.onnx"
+QUANTIZED_BODY_FILE = "body-int8.onnx"
+HEAD_FILE = "model_head.pkl"
+CONFIG_FILE = "onnx_config.json"
+
+
+# Pooling modes OnnxSpanModel.pool implements.
+POOLING_MODES = {"cls", "max", "mean"}
+
+
+def pooling_mode(pooling):
+    """
+    Pooling mode of a sentence-transformers Pooling module, with several
+    modes joined by "+". Older releases only expose get_pooling_mode_str().
+    """
+    if hasattr(pooling, "get_pooling_mode_str"):
+        return pooling.get_pooling_mode_str()
+    mode = pooling.pooling_mode
+    return mode if isinstance(mode, str) else "+".join(mode)
+
+
+def export_setfit_model(setfit_model, output_dir, quantize=True, opset=14):
+    """
+    Export the sentence-transformer body of a SetFit span model to ONNX and,
+    by default, an int8 dynamically quantized copy of it. The sklearn head,
+    tokenizer, pooling mode and span settings are saved next to it so that
+    OnnxSpanModel can run without torch or setfit.
+    """
+    import torch
+    from sentence_transformers.models import Normalize
+
+    os.makedirs(output_dir, exist_ok=True)
+    body = setfit_model.model_body
+    transformer = body[0]
+    pooling = pooling_mode(body[1])
+    if pooling not in POOLING_MODES:
+        raise ValueError(f"Pooling mode '{pooling}' is not supported by OnnxSpanModel ({', '.join(sorted(POOLING_MODES))})")
+    tokenizer = transformer.tokenizer
+    auto_model = transformer.auto_model.cpu().eval()
+
+    dummy = tokenizer(["It's a test."], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(input_names, args)))[0]
+
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs["dynamo"] = False
+    body_path = os.path.join(output_dir, BODY_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(auto_model),
+            args=tuple(dummy[name] for name in input_names),
+            f=body_path,
+            opset_version=opset,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                **{name: {0: "batch_size", 1: "sequence"} for name in input_names},
+                "last_hidden_state": {0: "batch_size", 1: "sequence"},
+            },
+            **export_kwargs
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(body_path, os.path.join(output_dir, QUANTIZED_BODY_FILE), weight_type=QuantType.QInt8)
+
+    tokenizer.save_pretrained(output_dir)
+    joblib.dump(setfit_model.model_head, os.path.join(output_dir, HEAD_FILE))
+    config = {
+        "pooling": pooling,
+        "normalize": setfit_model.normalize_embeddings or any(isinstance(m, Normalize) for m in body),
+        "max_seq_length": transformer.max_seq_length,
+        "input_names": input_names,
+        "labels": setfit_model.labels,
+        "span_context": setfit_model.span_context,
+        "spacy_model": setfit_model.spacy_model,
+        "quantized": quantize,
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+
+def export_absa_model(model, output_dir, quantize=True):
+    export_setfit_model(model.aspect_model, os.path.join(output_dir, "aspect"), quantize)
+    export_setfit_model(model.polarity_model, os.path.join(output_dir, "polarity"), quantize)
+
+
+class OnnxSpanModel:
+    """
+    ONNX Runtime counterpart of setfit's SpanSetFitModel: embeds
+    "<aspect span>:<sentence>" inputs with the exported body and classifies
+    them with the original sklearn head.
+    """
+
+    def __init__(self, model_dir, quantized=True, num_threads=None):
+        with open(os.path.join(model_dir, CONFIG_FILE), encoding="utf-8") as f:
+            self.config = json.load(f)
+        body_file = QUANTIZED_BODY_FILE if quantized and self.config["quantized"] else BODY_FILE
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.body_path = os.path.join(model_dir, body_file)
+        self.session = ort.InferenceSession(self.body_path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model_head = joblib.load(os.path.join(model_dir, HEAD_FILE))
+        self.labels = self.config["labels"]
+        self.span_context = self.config["span_context"]
+
+    def encode(self, inputs, batch_size=32):
+        """
+        Sentence embeddings for `inputs`, pooled and normalized as the
+        SentenceTransformer body does. Inputs are sorted by length so each
+        batch pads to a similar size.
+        """
+        order = np.argsort([-len(text) for text in inputs], kind="stable")
+        embeddings = [None] * len(inputs)
+        for start in range(0, len(inputs), batch_size):
+            batch_ids = order[start:start + batch_size]
+            features = self.tokenizer(
+                [inputs[i] for i in batch_ids],
+                padding=True,
+                truncation="longest_first",
+                max_length=self.config["max_seq_length"],
+                return_tensors="np",
+            )
+            feed = {name: features[name].astype(np.int64) for name in self.config["input_names"]}
+            hidden = self.session.run(None, feed)[0]
+            pooled = self.pool(hidden, features["attention_mask"])
+            for row, i in enumerate(batch_ids):
+                embeddings[i] = pooled[row]
+        if not embeddings:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(embeddings)
+
+    def pool(self, hidden, attention_mask):
+        mode = self.config["pooling"]
+        mask = attention_mask[..., None].astype(hidden.dtype)
+        if mode == "cls":
+            pooled = hidden[:, 0]
+        elif mode == "max":
+            pooled = np.where(mask > 0, hidden, -1e9).max(axis=1)
+        else:
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+    def predict(self, inputs, batch_size=32):
+        if not inputs:
+            return []
+        preds = self.model_head.predict(self.encode(list(inputs), batch_size=batch_size))
+        if self.labels and preds.ndim == 1 and preds.dtype.char != "U":
+            return [self.labels[int(pred)] for pred in preds]
+        return preds
+
+    def prepend_aspects(self, docs, aspects_list):
+        for doc, aspects in zip(docs, aspects_list):
+            for aspect_slice in aspects:
+                aspect = doc[max(aspect_slice.start - self.span_context, 0): aspect_slice.stop + self.span_context]
+                yield aspect.text + ":" + doc.text
+
+    def __call__(self, docs, aspects_list):
+        preds = iter(self.predict(list(self.prepend_aspects(docs, aspects_list))))
+        return [[next(preds) for _ in aspects] for aspects in aspects_list]
+
+
+class OnnxAspectModel(OnnxSpanModel):
+    def __call__(self, docs, aspects_list):
+        sentence_preds = super().__call__(docs, aspects_list)
+        return [
+            [aspect for aspect, pred in zip(aspects, preds) if pred == "aspect"]
+            for aspects, preds in zip(aspects_list, sentence_preds)
+        ]
+
+
+class OnnxAbsaModel:
+    """
+    Drop-in replacement for setfit.AbsaModel.predict on str / list inputs,
+    backed by the exported ONNX models.
+    """
+
+    def __init__(self, model_dir, spacy_model=None, quantized=True, num_threads=None):
+        import spacy
+
+        self.aspect_model = OnnxAspectModel(os.path.join(model_dir, "aspect"), quantized, num_threads)
+        self.polarity_model = OnnxSpanModel(os.path.join(model_dir, "polarity"), quantized, num_threads)
+        self.nlp = spacy.load(spacy_model or self.aspect_model.config["spacy_model"])
+
+    @staticmethod
+    def find_groups(aspect_mask):
+        start = None
+        for idx, flag in enumerate(aspect_mask):
+            if flag:
+                if start is None:
+                    start = idx
+            elif start is not None:
+                yield slice(start, idx)
+                start = None
+        if start is not None:
+            yield slice(start, len(aspect_mask))
+
+    def extract_aspects(self, texts):
+        docs = list(self.nlp.pipe(texts))
+        aspects_list = [
+            list(self.find_groups([token.pos_ in ("NOUN", "PROPN") for token in doc]))
+            for doc in docs
+        ]
+        return docs, aspects_list
+
+    def predict(self, inputs):
+        is_str = isinstance(inputs, str)
+        inputs_list = [inputs] if is_str else list(inputs)
+        docs, aspects_list = self.extract_aspects(inputs_list)
+        if sum(aspects_list, []) == []:
+            return aspects_list
+        aspects_list = self.aspect_model(docs, aspects_list)
+        if sum(aspects_list, []) == []:
+            return aspects_list
+        polarity_list = self.polarity_model(docs, aspects_list)
+        outputs = [
+            [{"span": doc[aspect_slice].text, "polarity": polarity}
+             for aspect_slice, polarity in zip(aspects, polarities)]
+            for doc, aspects, polarities in zip(docs, aspects_list, polarity_list)
+        ]
+        return outputs if not is_str else outputs[0]
+
+    def __call__(self, inputs):
+        return self.predict(inputs)
+
+
+def parity(aspect_dir, polarity_dir, onnx_dir, split="test", limit=None):
+    """
+    Compare the eager SetFit model with the ONNX predictor on the SemEval 2014
+    restaurant split: share of sentences with identical predictions and
+    sentences per second for each backend.
+    """
+    from datasets import load_dataset
+    from setfit import AbsaModel
+
+    dataset = load_dataset("tomaarsen/setfit-absa-semeval-restaurants", split=split)
+    texts = list(dict.fromkeys(dataset["text"]))
+    if limit:
+        texts = texts[:limit]
+
+    eager = AbsaModel.from_pretrained(aspect_dir, polarity_dir)
+    eager.to("cpu")
+    onnx_model = OnnxAbsaModel(onnx_dir)
+
+    results = {}
+    for name, model in (("eager", eager), ("onnx", onnx_model)):
+        start = time.perf_counter()
+        predictions = model.predict(texts)
+        elapsed = time.perf_counter() - start
+        results[name] = (predictions, len(texts) / elapsed)
+
+    same = sum(a == b for a, b in zip(results["eager"][0], results["onnx"][0]))
+    report = {
+        "sentences": len(texts),
+        "identical": same,
+        "agreement": same / len(texts) if texts else 1.0,
+        "eager_sentences_per_second": results["eager"][1],
+        "onnx_sentences_per_second": results["onnx"][1],
+    }
+    report["speedup"] = report["onnx_sentences_per_second"] / report["eager_sentences_per_second"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export SetFit ABSA models to ONNX and check parity.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export")
+    export.add_argument("aspect_dir")
+    export.add_argument("polarity_dir")
+    export.add_argument("output_dir", nargs="?", default="models/onnx")
+    export.add_argument("--no-quantize", action="store_true")
+
+    check = subparsers.add_parser("parity")
+    check.add_argument("aspect_dir")
+    check.add_argument("polarity_dir")
+    check.add_argument("onnx_dir", nargs="?", default="models/onnx")
+    check.add_argument("--split", default="test")
+    check.add_argument("--limit", type=int)
+    check.add_argument("--min-agreement", type=float, default=0.95)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        from setfit import AbsaModel
+
+        model = AbsaModel.from_pretrained(args.aspect_dir, args.polarity_dir)
+        export_absa_model(model, args.output_dir, quantize=not args.no_quantize)
+        print(f"ONNX models saved to '{args.output_dir}'.")
+    else:
+        report = parity(args.aspect_dir, args.polarity_dir, args.onnx_dir, args.split, args.limit)
+        print(json.dumps(report, indent=2))
+        if report["agreement"] < args.min_agreement:
+            raise SystemExit(f"Agreement {report['agreement']:.3f} is below {args.min_agreement}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Prices of gpt-4o-mini in USD per million tokens, used to turn token counts into cost.
+PRICE_PROMPT = float(os.environ.get("OPENAI_PRICE_PROMPT", 0.15))
+PRICE_COMPLETION = float(os.environ.get("OPENAI_PRICE_COMPLETION", 0.60))
+
+ASPECTS = ["food", "service", "staff", "pizza", "sushi", "prices", "ambience", "drinks", "wine", "menu",
+           "decor", "waiter", "dessert", "portions", "music", "delivery times", "customer service"]
+POSITIVE = ["great", "excellent", "delicious", "friendly", "amazing", "fast", "perfect", "lovely"]
+NEGATIVE = ["terrible", "rude", "slow", "bland", "overpriced", "cold", "awful", "noisy"]
+
+
+def count_tokens(text):
+    """
+    Rough token count (about four characters per token, like GPT tokenizers
+    on English text). Good enough to compare prompt layouts.
+    """
+    return max(1, len(text) // 4)
+
+
+def answer_sentence(sentence):
+    """
+    Deterministic [[aspect, sentiment], ...] for a sentence: every known
+    aspect it mentions, rated by the nearest sentiment word after it.
+    """
+    lowered = sentence.lower()
+    pairs = []
+    for aspect in ASPECTS:
+        position = lowered.find(aspect)
+        if position == -1:
+            continue
+        rest = lowered[position:]
+        hits = [(rest.find(w), "positive") for w in POSITIVE if w in rest]
+        hits += [(rest.find(w), "negative") for w in NEGATIVE if w in rest]
+        pairs.append([aspect, min(hits)[1] if hits else "neutral"])
+    return pairs
+
+
+def answer_prompt(prompt, drop_rate=0.0, drop_single=False):
+    """
+    Response to an aspectsentiment.py prompt. Packed prompts get a JSON object
+    keyed by sentence ID; with `drop_rate` some IDs are deterministically left
+    out of multi-sentence answers, like a model that loses track in long packs.
+    With `drop_single` they are also left out of one-sentence packs, so only
+    the per-sentence prompt answers them.
+    """
+    packed = re.search(r"^Sentences: (\{.*?\n\})", prompt, re.S | re.M)
+    if packed:
+        sentences = json.loads(packed.group(1))
+        answer = {}
+        for id, sentence in sentences.items():
+            dropped = zlib.crc32(id.encode("utf-8")) % 1000 < drop_rate * 1000
+            if dropped and (len(sentences) > 1 or drop_single):
+                continue
+            answer[id] = answer_sentence(sentence)
+        return json.dumps(answer)
+    single = re.search(r'^Sentence: "(.*)"$', prompt, re.M)
+    return json.dumps(answer_sentence(single.group(1) if single else ""))
+
+
+class StandInServer:
+    """
+    Local stand-in for the OpenAI chat completions endpoint.
+
+    Answers are deterministic (see answer_sentence) and every response is
+    delayed by `base_latency + prompt_tokens * prompt_latency +
+    completion_tokens * completion_latency` seconds, so the effect of prompt
+    size on latency shows up as it would against the API. Usage token counts
+    are reported like the real endpoint, and every prompt received is kept in
+    `prompts`. Point the openai package at `url`.
+    """
+
+    def __init__(self, base_latency=0.2, prompt_latency=0.00005, completion_latency=0.01, drop_rate=0.0,
+                 drop_single=False, host="127.0.0.1", port=0):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                payload = json.dumps(server.respond(self.path, body)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 256
+            daemon_threads = True
+
+        self.base_latency = base_latency
+        self.prompt_latency = prompt_latency
+        self.completion_latency = completion_latency
+        self.drop_rate = drop_rate
+        self.drop_single = drop_single
+        self.prompts = []
+        self.httpd = Server((host, port), Handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}/v1/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def delay(self, prompt_tokens, completion_tokens):
+        time.sleep(self.base_latency + prompt_tokens * self.prompt_latency
+                   + completion_tokens * self.completion_latency)
+
+    def respond(self, path, body):
+        prompt = "\n".join(m["content"] for m in body.get("messages", []))
+        self.prompts.append(prompt)
+        content = answer_prompt(prompt, self.drop_rate, self.drop_single)
+        prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(content)
+        self.delay(prompt_tokens, completion_tokens)
+        return {
+            "id": "chatcmpl-standin",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def synthetic_sentences(n, seed=0):
+    rng = random.Random(seed)
+    templates = [
+        "The {a} was {s} and the {b} was {t}.",
+        "I thought the {a} was {s}, but the {b} felt {t}.",
+        "Our {a} came out {s}.",
+        "We went there on a friday night with friends.",
+    ]
+    return [
+        rng.choice(templates).format(
+            a=rng.choice(ASPECTS), b=rng.choice(ASPECTS),
+            s=rng.choice(POSITIVE + NEGATIVE), t=rng.choice(POSITIVE + NEGATIVE)
+        ) + f" (visit {i})"
+        for i in range(n)
+    ]
+
+
+def measure(aspectsentiment, sentences, pack_size):
+    """
+    Extract the pairs of `sentences` with an empty cache and return them with
+    the per-sentence cost and latency of the run. Deduplication is bypassed
+    so every sentence is really asked for.
+    """
+    from llmcache import LLMCache
+
+    directory = tempfile.mkdtemp()
+    aspectsentiment.cache = LLMCache(os.path.join(directory, "llm_cache.sqlite"))
+    for key in aspectsentiment.usage:
+        aspectsentiment.usage[key] = 0
+    try:
+        start = time.perf_counter()
+        if pack_size > 1:
+            pairs = aspectsentiment.process_sentences_packed(sentences, pack_size)
+        else:
+            pairs = [aspectsentiment.process_sentence(s) for s in sentences]
+        seconds = time.perf_counter() - start
+    finally:
+        aspectsentiment.cache.conn.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    usage = dict(aspectsentiment.usage)
+    cost = (usage["prompt_tokens"] * PRICE_PROMPT + usage["completion_tokens"] * PRICE_COMPLETION) / 1e6
+    n = len(sentences)
+    return pairs, {
+        "pack_size": pack_size,
+        "sentences": n,
+        **usage,
+        "prompt_tokens_per_sentence": usage["prompt_tokens"] / n,
+        "cost_per_1k_sentences_usd": cost / n * 1000,
+        "seconds_per_sentence": seconds / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure cost and latency of packed aspect-sentiment prompts against a local OpenAI stand-in."
+    )
+    parser.add_argument("--sentences", type=int, default=200)
+    parser.add_argument("--pack-sizes", default="1,2,5,10,20,40")
+    parser.add_argument("--drop-rate", type=float, default=0.02,
+                        help="fraction of IDs the stand-in leaves out of packed answers")
+    parser.add_argument("--base-latency", type=float, default=0.2)
+    parser.add_argument("--output", default="pack_benchmark.json")
+    args = parser.parse_args()
+
+    import openai
+    import aspectsentiment
+
+    sentences = synthetic_sentences(args.sentences)
+    results = []
+    with StandInServer(base_latency=args.base_latency, drop_rate=args.drop_rate) as server:
+        openai.base_url = server.url
+        openai.api_key = "standin"
+        for pack_size in [int(size) for size in args.pack_sizes.split(",")]:
+            pairs, result = measure(aspectsentiment, sentences, pack_size)
+            expected = [answer_sentence(s) for s in sentences]
+            result["correct"] = sum(json.loads(p) == e for p, e in zip(pairs, expected)) / len(sentences)
+            results.append(result)
+            print(f"pack {pack_size:>3}: {result['requests']:>4} requests ({result['splits']} splits), "
+                  f"{result['prompt_tokens_per_sentence']:.0f} prompt tokens/sentence, "
+                  f"${result['cost_per_1k_sentences_usd']:.4f}/1k sentences, "
+                  f"{result['seconds_per_sentence'] * 1000:.0f} ms/sentence, "
+                  f"{result['correct']:.3f} correct")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to '{args.output}'.")
+    wrong = [result["pack_size"] for result in results if result["correct"] < 1]
+    if wrong:
+        print(f"Pack sizes with wrong or missing answers: {wrong}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
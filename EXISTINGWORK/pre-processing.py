@@ -1,11 +1,17 @@
 import pandas as pd
 import re
+from instrumentation import METRICS, instrumented
 def clean_sentence(sentence: str) -> str:
     cleaned = re.sub(r'[^A-Za-z0-9.!? ]+', '', sentence)
     cleaned = re.sub(r'([.!?])\1+', r'\1', cleaned)
     cleaned = cleaned.lower()
     return cleaned
-df = pd.read_csv("Restaurants_Train.csv", encoding="utf-8")
-df["Sentence"] = df["Sentence"].apply(clean_sentence)
-df.to_csv("processed_sentences.csv", encoding="utf-8", index=False)
-print("Processing complete! Check 'processed_sentences.csv'.")
+@instrumented("pre-processing")
+def main():
+    df = pd.read_csv("Restaurants_Train.csv", encoding="utf-8")
+    METRICS.set("absa_stage_rows", len(df), stage="pre-processing")
+    df["Sentence"] = df["Sentence"].apply(clean_sentence)
+    df.to_csv("processed_sentences.csv", encoding="utf-8", index=False)
+    print("Processing complete! Check 'processed_sentences.csv'.")
+if __name__ == "__main__":
+    main()
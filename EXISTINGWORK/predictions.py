@@ -1,21 +1,52 @@
+import os
 import pandas as pd
-from setfit import AbsaModel
+from embeddingcache import EmbeddingCache, cache_absa_embeddings
+from modelregistry import REGISTRY, WarmPool
 
-model = AbsaModel.from_pretrained(
-        r"D:\ASPECT BASED SENTIMENT ANALYSIS\EXISTINGWORK\models\models\setfit-absa-model-aspect",
-        r"D:\ASPECT BASED SENTIMENT ANALYSIS\EXISTINGWORK\models\models\setfit-absa-model-polarity",
-    )
+# Model paths and ABSA_BACKEND are configured in modelregistry.py.
+# ABSA_WORKERS > 1 predicts in forked worker processes that share the
+# loaded SetFit model (CPU only).
+WORKERS = int(os.environ.get("ABSA_WORKERS", 1))
 
-file_path = "data.csv" 
-df = pd.read_csv(file_path)
-predictions = model.predict(df["text"])
-df["predicted_label"] = predictions 
 
-df_eval = pd.read_csv("data.csv")
+def predict_chunk(texts):
+    return list(REGISTRY.get("setfit").predict(texts))
 
-df_eval["predicted_label"] = predictions  
 
-df_grouped = df_eval.groupby(["id", "text"], sort=False).apply(lambda x: x[["span", "predicted_label"]].values.tolist()).reset_index()
+def predict(texts, workers=WORKERS):
+    if workers > 1:
+        # The embedding cache is one SQLite index over memory-mapped files,
+        # which forked workers must not share, so the workers run uncached.
+        size = -(-len(texts) // (workers * 4)) or 1
+        chunks = [texts.iloc[i:i + size] for i in range(0, len(texts), size)]
+        with WarmPool(["setfit"], workers) as pool:
+            print(f"Model loaded in {pool.load_seconds:.1f}s, {workers} warm workers ready in {pool.ready_seconds:.2f}s")
+            return [p for chunk in pool.map(predict_chunk, chunks) for p in chunk]
 
-df_grouped.columns = ["id", "text", "predicted_aspect_sentiment_pairs"]
-df_grouped.to_csv("data2.csv", index=False)
+    model = REGISTRY.get("setfit")
+    # Sentences repeat once per aspect span, and across runs; see embeddingcache.py.
+    embedding_cache = EmbeddingCache()
+    cache_absa_embeddings(model, embedding_cache)
+    predictions = model.predict(texts)
+    print(f"Embedding cache: {embedding_cache.stats()}")
+    return predictions
+
+
+def main():
+    file_path = "data.csv"
+    df = pd.read_csv(file_path)
+    predictions = predict(df["text"])
+    df["predicted_label"] = predictions
+
+    df_eval = pd.read_csv("data.csv")
+
+    df_eval["predicted_label"] = predictions
+
+    df_grouped = df_eval.groupby(["id", "text"], sort=False).apply(lambda x: x[["span", "predicted_label"]].values.tolist()).reset_index()
+
+    df_grouped.columns = ["id", "text", "predicted_aspect_sentiment_pairs"]
+    df_grouped.to_csv("data2.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import glob
+import json
+import time
+import torch
+import pandas as pd
+from transformers import AutoModelForCausalLM
+
+QUANTIZED_DIR = os.environ.get("QUANTIZED_DIR", "models_int8")
+# Weight files of a LoRA adapter or a merged model, as written by save_pretrained.
+WEIGHT_PATTERNS = ["adapter_model.safetensors", "adapter_model.bin", "model*.safetensors", "pytorch_model*.bin"]
+
+
+def merge_lora(model_dir, torch_dtype=torch.float32):
+    """
+    Load the fine-tuned model on CPU as a plain causal LM.
+    If `model_dir` holds a LoRA adapter (adapter_config.json), the adapter is
+    merged into its base weights; otherwise the directory already contains
+    merged weights, as saved by proposedtraining.ipynb.
+    """
+    if os.path.exists(os.path.join(model_dir, "adapter_config.json")):
+        from peft import PeftConfig, PeftModel
+
+        config = PeftConfig.from_pretrained(model_dir)
+        base = AutoModelForCausalLM.from_pretrained(config.base_model_name_or_path, torch_dtype=torch_dtype)
+        return PeftModel.from_pretrained(base, model_dir).merge_and_unload()
+    return AutoModelForCausalLM.from_pretrained(model_dir, torch_dtype=torch_dtype)
+
+
+def load_cpu_model(model_dir="models", quantized_dir=QUANTIZED_DIR):
+    """
+    Return the merged model with dynamic int8 quantization of its Linear layers.
+
+    The quantized module is saved to `quantized_dir` on first use and loaded
+    from there afterwards, which skips both the fp32 load and the quantization.
+    The cache records the source directory, its config and the size and
+    modification time of its weight files, so it is rebuilt after retraining
+    into the same directory.
+    """
+    model_file = os.path.join(quantized_dir, "model.pt")
+    source_file = os.path.join(quantized_dir, "source.json")
+    config_name = "adapter_config.json"
+    if not os.path.exists(os.path.join(model_dir, config_name)):
+        config_name = "config.json"
+    with open(os.path.join(model_dir, config_name), encoding="utf-8") as f:
+        source = {"model_dir": os.path.abspath(model_dir), "config": json.load(f)}
+    source["weights"] = {
+        os.path.basename(path): [os.path.getsize(path), os.stat(path).st_mtime_ns]
+        for pattern in WEIGHT_PATTERNS
+        for path in sorted(glob.glob(os.path.join(model_dir, pattern)))
+    }
+
+    if os.path.exists(model_file) and os.path.exists(source_file):
+        with open(source_file, encoding="utf-8") as f:
+            if json.load(f) == source:
+                model = torch.load(model_file, weights_only=False)
+                model.eval()
+                return model
+
+    model = merge_lora(model_dir)
+    model.eval()
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    os.makedirs(quantized_dir, exist_ok=True)
+    torch.save(model, model_file)
+    with open(source_file, "w", encoding="utf-8") as f:
+        json.dump(source, f)
+    return model
+
+
+def model_footprint(model):
+    """
+    Bytes held by the model's weights. Dynamically quantized Linear layers keep
+    their int8 weights in packed params that are not module parameters, so the
+    state dict is measured instead.
+    """
+    def tensor_bytes(value):
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(tensor_bytes(v) for v in value)
+        return 0
+
+    return sum(tensor_bytes(value) for value in model.state_dict().values())
+
+
+def main():
+    """
+    Compare the int8 CPU model with the unquantized model (fp16 on GPU, fp32
+    on CPU, where fp16 generation is slow or unsupported): weight memory,
+    latency per sentence and A-O-S metrics on the last 20% of actual.csv.
+    proposedtraining.ipynb splits proposedworktrainingdata.csv, not this
+    file, so these rows are not guaranteed to be unseen in training.
+    """
+    os.environ.setdefault("PREDICT_DEVICE", "cpu")
+    import localprediction
+    from modelregistry import REGISTRY
+    from localmetrics import AOSMetrics, extract_aos_from_actual, extract_aos_from_pred, lowercase
+
+    sample_size = int(os.environ.get("QUANT_EVAL_SAMPLE", 50))
+    df = lowercase(pd.read_csv("actual.csv"))
+    df = df.iloc[int(0.8 * len(df)):].head(sample_size)
+    sentences = df["text"].tolist()
+    actual = df.apply(extract_aos_from_actual, axis=1).tolist()
+
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    dtype = torch.float16 if device != "cpu" else torch.float32
+    reference = AutoModelForCausalLM.from_pretrained(localprediction.save_dir, torch_dtype=dtype)
+    reference.to(device)
+    reference.eval()
+
+    reference_name = {torch.float16: "fp16", torch.float32: "fp32"}[dtype]
+    models = [("int8 (cpu)", REGISTRY.get("llama")), (f"{reference_name} ({device})", reference)]
+    rows = []
+    for name, model in models:
+        start = time.perf_counter()
+        predictions, report = localprediction.predict_batch(sentences, model)
+        elapsed = time.perf_counter() - start
+
+        metrics = AOSMetrics()
+        metrics.update(actual, [extract_aos_from_pred(p.lower().strip()) for p in predictions])
+        m = metrics.compute()
+        rows.append({
+            "model": name,
+            "weights_mb": model_footprint(model) / 2**20,
+            "seconds_per_sentence": elapsed / max(len(sentences), 1),
+            "tokens_per_second": report["tokens_per_second"],
+            "precision": m["precision"],
+            "recall": m["recall"],
+            "f1": m["f1"],
+        })
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,41 @@
-import spacy
+import os
+import sys
+import time
+import argparse
 import pandas as pd
 import json
+from itertools import islice
+from collections import Counter
 
-nlp = spacy.load("en_core_web_trf")
+from docstore import DocStore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "EXISTINGWORK"))
+from dedup import DEDUP_MAX_ENTRIES, REPORT, DedupIndex, fan_out
+from instrumentation import METRICS, instrumented
+from modelregistry import REGISTRY, SPACY_FAST_MODEL
+
+BATCH_SIZE = int(os.environ.get("SPACY_BATCH_SIZE", 64))
+N_PROCESS = int(os.environ.get("SPACY_N_PROCESS", 1))
+CHUNK_SIZE = int(os.environ.get("SPACY_CHUNK_SIZE", 1000))
+
+# "trf" parses everything with the transformer model (SPACY_MODEL); "tiered"
+# parses with SPACY_FAST_MODEL first and re-parses only the sentences that raise one of
+# the SPACY_ESCALATE signals (see escalation_reasons) with the transformer.
+PARSE_MODE = os.environ.get("SPACY_PARSE_MODE", "trf")
+ESCALATE = set(os.environ.get("SPACY_ESCALATE", "no_pairs,pronoun,negation,uncertain,long").split(","))
+ESCALATE_LENGTH = int(os.environ.get("SPACY_ESCALATE_LENGTH", 30))
+
+_stores = {}
+
+
+def doc_store(model="spacy_trf"):
+    """
+    DocStore over a spaCy model of the registry, created the first time a
+    sentence is parsed with that model.
+    """
+    if model not in _stores:
+        _stores[model] = DocStore(REGISTRY.get(model), path=os.environ.get("SPACY_DOC_STORE", "parsed_docs"))
+    return _stores[model]
 
 
 def get_head_noun(token):
@@ -50,128 +83,409 @@ def extract_aspect_opinion_pairs(sentence):
       - E.g., "Straight-forward in presentation" -> (presentation, Straight-forward)
     
     For pronoun aspects, the immediately preceding noun (last encountered noun) is used.
+
+    The parse is read from the DocStore when available; new parses are kept in
+    the store's pending shard until store.flush() is called.
+    """
+    store = doc_store()
+    doc = store.get(sentence)
+    if doc is None:
+        doc = store.nlp(sentence)
+        store.add(doc)
+    return extract_pairs_from_doc(doc)
+
+NOUN_POS = {"NOUN", "PROPN"}
+SUBJECT_POS = {"NOUN", "PROPN", "PRON"}
+SUBJECT_DEPS = {"nsubj", "nsubjpass"}
+
+
+class DocIndex:
+    """
+    Lookup tables built in one pass over a Doc and shared by all rules:
+
+    - prev_noun[i]: index of the nearest NOUN/PROPN before token i (-1 if none),
+      with prev_noun[len(doc)] covering the end of the Doc.
+    - head_noun[i]: text returned by get_head_noun for token i, with compound
+      chains resolved once instead of recursively on every lookup.
+    - neg[i] / subj[i]: first "neg" child and first nominal subject child of
+      token i, as found by scanning token.children.
+    """
+
+    def __init__(self, doc):
+        n = len(doc)
+        self.doc = doc
+        self.prev_noun = [-1] * (n + 1)
+        self.head_noun = [None] * n
+        self.neg = [None] * n
+        self.subj = [None] * n
+
+        last = -1
+        for token in doc:
+            i = token.i
+            self.prev_noun[i] = last
+            if token.pos_ in NOUN_POS:
+                last = i
+            dep = token.dep_
+            head = token.head.i
+            if head != i:
+                if dep == "neg" and self.neg[head] is None:
+                    self.neg[head] = token
+                elif dep in SUBJECT_DEPS and token.pos_ in SUBJECT_POS and self.subj[head] is None:
+                    self.subj[head] = token
+        self.prev_noun[n] = last
+
+        for token in doc:
+            if self.head_noun[token.i] is not None:
+                continue
+            chain = []
+            while token.dep_ == "compound" and token.head.pos_ in NOUN_POS and self.head_noun[token.i] is None:
+                chain.append(token.i)
+                token = token.head
+            text = self.head_noun[token.i] or token.text
+            self.head_noun[token.i] = text
+            for i in chain:
+                self.head_noun[i] = text
+
+    def subject_aspect(self, subj):
+        """
+        Aspect for a subject token; pronouns are returned as the token itself
+        so the engine can resolve them against the running last noun.
+        """
+        if subj.pos_ != "PRON":
+            return self.head_noun[subj.i]
+        return subj
+
+
+class AmodRule:
+    """
+    Pattern A: direct adjectival modifier (amod).
     """
-    doc = nlp(sentence)
+    excluded = {"asian", "japanese", "chinese"}
+
+    def match(self, token, index):
+        if token.pos_ == "ADJ" and token.dep_ == "amod" and token.head.pos_ in NOUN_POS:
+            if token.text.lower() not in self.excluded:
+                return index.head_noun[token.head.i], clean_opinion(token)
+        return None
+
+
+class CopularRule:
+    """
+    Pattern B: copular constructions (acomp, attr), with negation on the head.
+    """
+
+    def match(self, token, index):
+        if token.pos_ == "ADJ" and token.dep_ in {"acomp", "attr"}:
+            head = token.head.i
+            subj = index.subj[head]
+            if subj is not None:
+                neg = ""
+                neg_token = index.neg[head]
+                if neg_token is not None:
+                    neg = "not " if neg_token.text.strip() == "n't" else neg_token.text + " "
+                return index.subject_aspect(subj), neg + clean_opinion(token)
+        return None
+
+
+class NegatedVerbRule:
+    """
+    Pattern C: negated verbs; the opinion is the negation and the token after it.
+    """
+
+    def match(self, token, index):
+        if token.pos_ == "VERB" and token.tag_ != "AUX":
+            neg_token = index.neg[token.i]
+            subj = index.subj[token.i]
+            if neg_token is not None and subj is not None:
+                subtree_tokens = sorted(token.subtree, key=lambda t: t.i)
+                try:
+                    neg_index = subtree_tokens.index(neg_token)
+                except ValueError:
+                    neg_index = 0
+                opinion = " ".join(
+                    "not" if t.text.strip() == "n't" else t.text
+                    for t in subtree_tokens[neg_index: neg_index+2]
+                )
+                return index.subject_aspect(subj), opinion
+        return None
+
+
+class LooseAdjectiveRule:
+    """
+    Pattern D: loose adjectives, paired with the nearest preceding noun.
+    """
+
+    def match(self, token, index):
+        if token.pos_ == "ADJ" and token.dep_ not in {"amod", "acomp", "attr"}:
+            noun = index.prev_noun[token.i]
+            if noun != -1:
+                return index.head_noun[noun], clean_opinion(token)
+        return None
+
+
+RULES = [AmodRule(), CopularRule(), NegatedVerbRule(), LooseAdjectiveRule()]
+
+
+def extract_pairs_from_doc(doc, rules=RULES):
+    """
+    Apply Patterns A-D to an already parsed Doc.
+
+    Each sentence is scanned once; every token is offered to every rule and
+    matches are collected per rule. Matches are then emitted rule by rule in
+    token order, which is the order the original one-loop-per-pattern code
+    produced, so pronoun aspects resolve against the same last noun.
+    """
+    index = DocIndex(doc)
     pairs = []
-    last_noun = None  
+    last_noun = None
 
-    
     for sent in doc.sents:
-        
-        for token in sent:
-            if token.pos_ in {"NOUN", "PROPN"}:
-                last_noun = get_head_noun(token)
+        last_index = index.prev_noun[sent.end]
+        if last_index >= sent.start:
+            last_noun = index.head_noun[last_index]
 
-        
-        for token in sent:
-            if token.pos_ == "ADJ" and token.dep_ == "amod":
-                if token.head.pos_ in {"NOUN", "PROPN"}:
-                    aspect = get_head_noun(token.head)
-                    
-                    if token.text.lower() not in {"asian", "japanese", "chinese"}:
-                        opinion = clean_opinion(token)
-                        pairs.append((aspect, opinion))
-                        last_noun = aspect
-
-        
-        for token in sent:
-            if token.pos_ == "ADJ" and token.dep_ in {"acomp", "attr"}:
-                subj = None
-                for child in token.head.children:
-                    if child.dep_ in {"nsubj", "nsubjpass"} and child.pos_ in {"NOUN", "PROPN", "PRON"}:
-                        subj = child
-                        break
-                if subj:
-                    aspect = (get_head_noun(subj)
-                              if subj.pos_ != "PRON"
-                              else resolve_pronoun(subj, last_noun))
-                    neg = ""
-                    for child in token.head.children:
-                        if child.dep_ == "neg":
-                            neg = child.text + " "
-                            
-                            if neg.strip() == "n't":
-                                neg = "not "
-                            break
-                    opinion = neg + clean_opinion(token)
-                    pairs.append((aspect, opinion))
-                    last_noun = aspect
-
-        
+        matches = [[] for _ in rules]
         for token in sent:
-            if token.pos_ == "VERB" and token.tag_ != "AUX":
-                neg_token = None
-                for child in token.children:
-                    if child.dep_ == "neg":
-                        neg_token = child
-                        break
-                if neg_token:
-                    subj = None
-                    for child in token.children:
-                        if child.dep_ in {"nsubj", "nsubjpass"} and child.pos_ in {"NOUN", "PROPN", "PRON"}:
-                            subj = child
-                            break
-                    if subj:
-                        aspect = (get_head_noun(subj)
-                                  if subj.pos_ != "PRON"
-                                  else resolve_pronoun(subj, last_noun))
-                        
-                        subtree_tokens = list(token.subtree)
-                        subtree_tokens = sorted(subtree_tokens, key=lambda t: t.i)
-                        try:
-                            neg_index = subtree_tokens.index(neg_token)
-                        except ValueError:
-                            neg_index = 0
-                    
-                        selected_tokens = subtree_tokens[neg_index: neg_index+2]
-                        
-                        opinion_tokens = []
-                        for t in selected_tokens:
-                            if t.text.strip() == "n't":
-                                opinion_tokens.append("not")
-                            else:
-                                opinion_tokens.append(t.text)
-                        opinion = " ".join(opinion_tokens)
-                        pairs.append((aspect, opinion))
-                        last_noun = aspect
-
-        
-        for token in sent:
-            if token.pos_ == "ADJ" and token.dep_ not in {"amod", "acomp", "attr"}:
-                for i in range(token.i - 1, -1, -1):
-                    if doc[i].pos_ in {"NOUN", "PROPN"}:
-                        aspect = get_head_noun(doc[i])
-                        opinion = clean_opinion(token)
-                        pairs.append((aspect, opinion))
-                        last_noun = aspect
-                        break
+            for rule_matches, rule in zip(matches, rules):
+                match = rule.match(token, index)
+                if match is not None:
+                    rule_matches.append(match)
+
+        for rule_matches in matches:
+            for aspect, opinion in rule_matches:
+                if not isinstance(aspect, str):
+                    aspect = resolve_pronoun(aspect, last_noun)
+                pairs.append((aspect, opinion))
+                last_noun = aspect
 
-    
     unique_pairs = list(set(pairs))
     return unique_pairs
 
+def extract_pairs_batch(sentences, batch_size=BATCH_SIZE, n_process=N_PROCESS):
+    """
+    Stream sentences through nlp.pipe and yield the aspect-opinion pairs of
+    each sentence in input order. Parses already in the DocStore are reused.
+
+    `sentences` may be any iterable, including a generator over a file that
+    does not fit in memory. With n_process > 1 spaCy forks worker processes;
+    on CPU-only nodes set torch to one thread per worker (e.g. OMP_NUM_THREADS=1)
+    so the workers do not compete for cores.
+    """
+    store = doc_store()
+    docs = store.parse(sentences, batch_size=batch_size, n_process=n_process)
+    for doc in METRICS.timed_iter(docs, "absa_spacy_parse_seconds", batch=batch_size, model=store.nlp.meta["name"]):
+        METRICS.inc("absa_spacy_sentences_total", model=store.nlp.meta["name"])
+        yield extract_pairs_from_doc(doc)
+
+def fast_store():
+    """
+    DocStore of the fast model, loaded the first time tiered parsing runs.
+    """
+    return doc_store("spacy_fast")
+
+PRONOUNS = {"it", "this", "that", "they"}
+NEGATIONS = {"not", "n't", "never", "no", "nothing", "nobody", "neither", "nor", "hardly"}
+
+def escalation_reasons(doc, pairs, signals=ESCALATE):
+    """
+    Signals in a fast-model parse that the transformer parse may extract
+    different pairs:
+
+    - no_pairs: no rule matched.
+    - pronoun: a pronoun subject, whose aspect comes from resolve_pronoun.
+    - negation: a negation word, which Patterns B and C attach by dependency.
+    - uncertain: a sign of a low-confidence parse (the parser's fallback
+      "dep" label, POS "X", or an adjective only Pattern D could place).
+    - long: more than SPACY_ESCALATE_LENGTH tokens.
+    """
+    reasons = []
+    if "no_pairs" in signals and not pairs:
+        reasons.append("no_pairs")
+    if "pronoun" in signals and any(t.lower_ in PRONOUNS and t.dep_ in SUBJECT_DEPS for t in doc):
+        reasons.append("pronoun")
+    if "negation" in signals and any(t.dep_ == "neg" or t.lower_ in NEGATIONS for t in doc):
+        reasons.append("negation")
+    if "uncertain" in signals and any(
+        t.dep_ == "dep" or t.pos_ == "X" or (t.pos_ == "ADJ" and t.dep_ not in {"amod", "acomp", "attr"})
+        for t in doc
+    ):
+        reasons.append("uncertain")
+    if "long" in signals and len(doc) > ESCALATE_LENGTH:
+        reasons.append("long")
+    return reasons
+
+# Counts of the tiered runs in this process, printed by main().
+tier_stats = Counter()
+
+def extract_pairs_tiered(sentences, batch_size=BATCH_SIZE, n_process=N_PROCESS):
+    """
+    Aspect-opinion pairs of every sentence, parsed with the fast model and
+    re-parsed with the transformer model only where escalation_reasons
+    finds a signal. Returns the pairs and the reasons of every sentence.
+    """
+    sentences = list(sentences)
+    pairs, reasons = [], []
+    start = time.perf_counter()
+    fast = fast_store()
+    docs = fast.parse(sentences, batch_size=batch_size, n_process=n_process)
+    for doc in METRICS.timed_iter(docs, "absa_spacy_parse_seconds", batch=batch_size, model=fast.nlp.meta["name"]):
+        METRICS.inc("absa_spacy_sentences_total", model=fast.nlp.meta["name"])
+        doc_pairs = extract_pairs_from_doc(doc)
+        pairs.append(doc_pairs)
+        reasons.append(escalation_reasons(doc, doc_pairs))
+    tier_stats["fast_seconds"] += time.perf_counter() - start
+
+    escalated = [i for i, r in enumerate(reasons) if r]
+    start = time.perf_counter()
+    for i, doc_pairs in zip(escalated, extract_pairs_batch([sentences[i] for i in escalated], batch_size, n_process)):
+        pairs[i] = doc_pairs
+    tier_stats["trf_seconds"] += time.perf_counter() - start
+
+    tier_stats["sentences"] += len(sentences)
+    tier_stats["escalated"] += len(escalated)
+    tier_stats.update(reason for r in reasons for reason in r)
+    return pairs, reasons
+
+def extract_pairs_mode(sentences, mode=None):
+    """
+    Aspect-opinion pairs of every sentence with the configured parse mode.
+    """
+    if (mode or PARSE_MODE) == "tiered":
+        return extract_pairs_tiered(sentences)[0]
+    return list(extract_pairs_batch(sentences))
+
+def extract_pairs_dedup(sentences, index=None):
+    """
+    Aspect-opinion pairs for every sentence, parsing one representative per
+    duplicate cluster. Pass the same DedupIndex for consecutive chunks of a
+    stream so duplicates of earlier chunks are not parsed again.
+    """
+    return fan_out(extract_pairs_mode, sentences, index=index, stage="dependancy_parsing")
+
+def agreement_report(sentences, batch_size=BATCH_SIZE):
+    """
+    Compare tiered parsing with the all-transformer baseline on `sentences`.
+
+    Both sides are parsed from scratch with nlp.pipe (the DocStores are
+    bypassed, so stored parses do not flatter either timing). Reports the
+    share of sentences whose pair sets are identical, pair-level precision
+    and recall of the tiered output against the baseline, the escalation
+    rate per signal and the parse time of both modes.
+    """
+    sentences = [str(s) for s in sentences]
+    nlp = doc_store().nlp
+    fast_nlp = fast_store().nlp
+
+    start = time.perf_counter()
+    baseline = [extract_pairs_from_doc(doc) for doc in nlp.pipe(sentences, batch_size=batch_size)]
+    trf_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tiered, reasons = [], []
+    for doc in fast_nlp.pipe(sentences, batch_size=batch_size):
+        doc_pairs = extract_pairs_from_doc(doc)
+        tiered.append(doc_pairs)
+        reasons.append(escalation_reasons(doc, doc_pairs))
+    escalated = [i for i, r in enumerate(reasons) if r]
+    for i, doc in zip(escalated, nlp.pipe([sentences[i] for i in escalated], batch_size=batch_size)):
+        tiered[i] = extract_pairs_from_doc(doc)
+    tiered_seconds = time.perf_counter() - start
+
+    matched = predicted = expected = 0
+    identical = kept_identical = 0
+    for i, (base, tier) in enumerate(zip(baseline, tiered)):
+        base, tier = set(base), set(tier)
+        matched += len(base & tier)
+        predicted += len(tier)
+        expected += len(base)
+        identical += base == tier
+        kept_identical += not reasons[i] and base == tier
+    n = max(len(sentences), 1)
+    kept = len(sentences) - len(escalated)
+    return {
+        "sentences": len(sentences),
+        "fast_model": SPACY_FAST_MODEL,
+        "signals": sorted(ESCALATE),
+        "escalated": len(escalated),
+        "escalation_rate": len(escalated) / n,
+        "escalation_reasons": dict(Counter(reason for r in reasons for reason in r)),
+        "identical_pairs": identical / n,
+        "identical_pairs_not_escalated": kept_identical / kept if kept else None,
+        "pair_precision": matched / predicted if predicted else None,
+        "pair_recall": matched / expected if expected else None,
+        "trf_seconds": trf_seconds,
+        "tiered_seconds": tiered_seconds,
+        "speedup": trf_seconds / tiered_seconds if tiered_seconds else None,
+    }
+
+def read_chunks(input_file, chunk_size=CHUNK_SIZE):
+    """
+    Yield the input CSV in chunks with a "sentence" column, without loading it whole.
+    """
+    for chunk in pd.read_csv(input_file, encoding="utf-8", chunksize=chunk_size):
+        if "Sentence" in chunk.columns and "sentence" not in chunk.columns:
+            chunk = chunk.rename(columns={"Sentence": "sentence"})
+        yield chunk
+
+def read_rows(input_file, chunk_size=CHUNK_SIZE):
+    """
+    Yield (id, sentence) rows from the input CSV without loading it whole.
+    """
+    for chunk in read_chunks(input_file, chunk_size):
+        yield from zip(chunk["id"], chunk["sentence"])
+
+def write_chunk(output_data, output_file, first_chunk):
+    pd.DataFrame(output_data, columns=["id", "sentence", "aspect_opinion_pairs"]).to_csv(
+        output_file,
+        mode="w" if first_chunk else "a",
+        header=first_chunk,
+        index=False,
+        encoding="utf-8"
+    )
+
+@instrumented("dependancy_parsing")
 def main():
+    parser = argparse.ArgumentParser(description="Extract aspect-opinion pairs with spaCy dependency rules.")
+    parser.add_argument("--mode", choices=["trf", "tiered"], default=PARSE_MODE)
+    parser.add_argument("--compare", type=int, metavar="N", nargs="?", const=1000,
+                        help="instead of extracting, compare tiered parsing with the all-transformer "
+                             "baseline on the first N input sentences and write tiered_agreement.json")
+    args = parser.parse_args()
+
     input_file = "merged.csv" #From existing work  
     output_file = "dependancy_output.csv" 
 
-    df = pd.read_csv(input_file, encoding="utf-8")
-    if "Sentence" in df.columns and "sentence" not in df.columns:
-        df.rename(columns={"Sentence": "sentence"}, inplace=True)
-
-    output_data = []
-    for _, row in df.iterrows():
-        id=row["id"]
-        sentence = row["sentence"]
-        pairs = extract_aspect_opinion_pairs(sentence)
-        output_data.append({
-            "id":id,
-            "sentence": sentence,
-            "aspect_opinion_pairs": json.dumps(pairs, ensure_ascii=False)
-        })
-
-    output_df = pd.DataFrame(output_data)
-    output_df.to_csv(output_file, index=False, encoding="utf-8")
+    if args.compare:
+        chunks = read_chunks(input_file, min(CHUNK_SIZE, args.compare))
+        sentences = list(islice((sentence for chunk in chunks for sentence in chunk["sentence"]), args.compare))
+        report = agreement_report(sentences)
+        with open("tiered_agreement.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(json.dumps(report, indent=2))
+        return
+
+    index = DedupIndex(max_entries=DEDUP_MAX_ENTRIES)
+    first_chunk = True
+    for chunk in read_chunks(input_file):
+        pairs = fan_out(lambda reps: extract_pairs_mode(reps, args.mode), chunk["sentence"],
+                        index=index, stage="dependancy_parsing")
+        output_data = [
+            {"id": id, "sentence": sentence, "aspect_opinion_pairs": json.dumps(p, ensure_ascii=False)}
+            for id, sentence, p in zip(chunk["id"], chunk["sentence"], pairs)
+        ]
+        write_chunk(output_data, output_file, first_chunk)
+        first_chunk = False
+
+    if first_chunk:
+        write_chunk([], output_file, first_chunk)
+    METRICS.set("absa_stage_rows", REPORT.stages.get("dependancy_parsing", {}).get("rows", 0), stage="dependancy_parsing")
     print(f"Extraction complete. Results saved to '{output_file}'.")
+    if args.mode == "tiered":
+        print(f"Tiered parsing: {tier_stats['escalated']} of {tier_stats['sentences']} sentences escalated "
+              f"({ {k: v for k, v in tier_stats.items() if k in ESCALATE} }), "
+              f"fast {tier_stats['fast_seconds']:.1f}s, trf {tier_stats['trf_seconds']:.1f}s")
+    print(REPORT.summary("dependancy_parsing"))
+    REPORT.save()
 
 if __name__ == "__main__":
     main()
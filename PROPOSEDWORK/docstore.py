@@ -0,0 +1,142 @@
+import glob
+import hashlib
+import json
+import os
+from collections import OrderedDict, deque
+
+from spacy.tokens import DocBin
+
+
+class DocStore:
+    """
+    Persistent store of parsed Docs, so changing the extraction rules does not
+    require re-running the transformer parser.
+
+    Docs are saved as spaCy DocBin shards under a directory named after the
+    pipeline (model name, version and enabled components). Each shard has a
+    JSON sidecar listing the sentence hashes it contains; only those sidecars
+    are read at start-up, and the shards themselves are loaded lazily the first
+    time one of their Docs is requested.
+    """
+
+    def __init__(self, nlp, path="parsed_docs", shard_size=1000, max_loaded_shards=8):
+        self.nlp = nlp
+        self.dir = os.path.join(path, self.model_key(nlp))
+        self.shard_size = shard_size
+        self.max_loaded_shards = max_loaded_shards
+        os.makedirs(self.dir, exist_ok=True)
+
+        self.index = {}
+        for keys_file in sorted(glob.glob(os.path.join(self.dir, "shard-*.json"))):
+            shard = os.path.basename(keys_file)[:-len(".json")]
+            with open(keys_file, encoding="utf-8") as f:
+                for position, key in enumerate(json.load(f)):
+                    self.index[key] = (shard, position)
+        self.shard_count = len(glob.glob(os.path.join(self.dir, "shard-*.json")))
+        self.loaded = OrderedDict()
+        self.pending = {}
+
+    @staticmethod
+    def model_key(nlp):
+        """
+        Directory name identifying the pipeline that produced the parses.
+        """
+        meta = nlp.meta
+        components = hashlib.sha1(",".join(nlp.pipe_names).encode("utf-8")).hexdigest()[:8]
+        return f"{meta['lang']}_{meta['name']}-{meta['version']}-{components}"
+
+    @staticmethod
+    def key(sentence):
+        return hashlib.sha1(sentence.encode("utf-8")).hexdigest()
+
+    def __contains__(self, sentence):
+        key = self.key(sentence)
+        return key in self.pending or key in self.index
+
+    def get(self, sentence):
+        """
+        Return the stored Doc for `sentence`, or None if it was never parsed.
+        """
+        key = self.key(sentence)
+        if key in self.pending:
+            return self.pending[key]
+        if key not in self.index:
+            return None
+        shard, position = self.index[key]
+        return self._load_shard(shard)[position]
+
+    def add(self, doc):
+        self.pending[self.key(doc.text)] = doc
+        if len(self.pending) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write pending Docs to a new shard.
+        """
+        if not self.pending:
+            return
+        shard = f"shard-{self.shard_count:05d}"
+        doc_bin = DocBin(store_user_data=False)
+        for doc in self.pending.values():
+            doc_bin.add(doc)
+        doc_bin.to_disk(os.path.join(self.dir, shard + ".spacy"))
+        keys = list(self.pending)
+        with open(os.path.join(self.dir, shard + ".json"), "w", encoding="utf-8") as f:
+            json.dump(keys, f)
+        for position, key in enumerate(keys):
+            self.index[key] = (shard, position)
+        self.shard_count += 1
+        self.pending = {}
+
+    def _load_shard(self, shard):
+        if shard in self.loaded:
+            self.loaded.move_to_end(shard)
+            return self.loaded[shard]
+        doc_bin = DocBin().from_disk(os.path.join(self.dir, shard + ".spacy"))
+        docs = list(doc_bin.get_docs(self.nlp.vocab))
+        self.loaded[shard] = docs
+        if len(self.loaded) > self.max_loaded_shards:
+            self.loaded.popitem(last=False)
+        return docs
+
+    def parse(self, sentences, batch_size=64, n_process=1, as_tuples=False):
+        """
+        Yield a Doc for every sentence in input order, parsing only the
+        sentences that are not stored yet. All missing sentences go through a
+        single nlp.pipe call, so worker processes are started once per run.
+        With as_tuples=True, items are (sentence, context) pairs and
+        (doc, context) pairs are yielded, as in nlp.pipe.
+        """
+        queue = deque()
+        in_flight = set()
+
+        def missing_sentences():
+            for item in sentences:
+                sentence = item[0] if as_tuples else item
+                key = self.key(sentence)
+                if key in in_flight or sentence in self:
+                    queue.append((item, False))
+                else:
+                    in_flight.add(key)
+                    queue.append((item, True))
+                    yield sentence
+
+        def output(item, doc):
+            return (doc, item[1]) if as_tuples else doc
+
+        def stored(item):
+            return self.get(item[0] if as_tuples else item)
+
+        for doc in self.nlp.pipe(missing_sentences(), batch_size=batch_size, n_process=n_process):
+            while True:
+                item, is_missing = queue.popleft()
+                if is_missing:
+                    break
+                yield output(item, stored(item))
+            self.add(doc)
+            yield output(item, doc)
+        while queue:
+            item, _ = queue.popleft()
+            yield output(item, stored(item))
+        self.flush()
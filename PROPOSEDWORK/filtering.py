@@ -1,11 +1,44 @@
+import os
+import sys
+import re
+import json
 import pandas as pd
-import ollama
 import ast 
 
-
-df = pd.read_csv("dependancy_output.csv", encoding="utf-8")
-
-def process_aspect_opinion(sentence, aspect_opinion_pairs):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "EXISTINGWORK"))
+from dedup import REPORT, fan_out
+from instrumentation import METRICS, COUNT_BUCKETS, instrumented
+from llmclient import LLMClient, TRANSPORT_ERRORS
+from lexicon import Lexicon
+
+client = LLMClient(model="llama2:7b")
+# Aspect vocabulary and opinion lexicon for the local fast path (built with
+# lexicon.py); without it every row goes to the LLM.
+lexicon = Lexicon.load()
+lexicon_stats = {"rows": 0, "resolved": 0}
+
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 0.5
+
+# JSON schema passed to Ollama's structured output ("format") so the model can
+# only emit a list of [aspect, opinion, sentiment] triples.
+TRIPLES_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "array",
+        "items": {"type": "string"},
+        "minItems": 3,
+        "maxItems": 3
+    }
+}
+
+def process_aspect_opinion(sentence, aspect_opinion_pairs, attempt=0, delay=0):
+    """
+    Query the LLM once and return the repaired triples as a string, or "[]".
+    The first attempt is greedy; later attempts raise the temperature so a
+    retry does not just reproduce the same failure. `delay` is waited before
+    the request only if it is sent to the server.
+    """
     prompt = f"""You will receive a sentence and a list of aspect-opinion pairs.
 Your task:
 1. Extract aspect-opinion pairs from the given sentence for restaurant domain. Validate this list by making it more meaningful. Remove pairs with unnecessary aspects(not present in your extracted pairs) from the list.Make the opinions meaningful.Replace pronoun aspects with corresponding nouns.
@@ -29,48 +62,163 @@ Output:
 
 """
 
-
-    
     try:
-        response = ollama.chat(model="llama2:7b", messages=[{"role": "user", "content": prompt}])
-        raw_output = response["message"]["content"].strip() 
-
-        
-        start = raw_output.find("[[")
-        end = raw_output.rfind("]]") + 2
-        cleaned_output = raw_output[start:end]
-
-        
-        aspect_opinion_triples = ast.literal_eval(cleaned_output)
-
-        
-        if isinstance(aspect_opinion_triples, list) and all(
-            isinstance(triple, list) and len(triple) == 3 for triple in aspect_opinion_triples
-        ):
-            return str(aspect_opinion_triples) 
-        else:
-            return "[]"  
-    except (SyntaxError, ValueError, KeyError):
-        return "[]"  
-
-def process_with_retry(sentence, aspect_opinion_pairs, max_retries=1000):
-    for _ in range(max_retries):
-        result = process_aspect_opinion(sentence,aspect_opinion_pairs)
+        raw_output = client.chat(
+            prompt,
+            attempt=attempt,
+            delay=delay,
+            format=TRIPLES_SCHEMA,
+            options={"temperature": min(0.3 * attempt, 0.9)}
+        ).strip()
+    except KeyError:
+        return "[]"
+
+    aspect_opinion_triples = repair_triples(raw_output)
+    if aspect_opinion_triples:
+        return str(aspect_opinion_triples)
+    return "[]"
+
+def repair_triples(raw_output):
+    """
+    Tolerant parser for near-miss LLM outputs.
+    Handles code fences, text around the list, single or curly quotes,
+    trailing commas, missing closing brackets, a bare single triple and
+    {"triples": [...]} wrappers. Returns a list of [aspect, opinion, sentiment]
+    lists, dropping entries that are not triples.
+    """
+    text = raw_output.replace("```json", "").replace("```", "")
+    text = text.replace("\u201c", '"').replace("\u201d", '"').replace("\u2018", "'").replace("\u2019", "'")
+    start = text.find("[")
+    if start == -1:
+        return []
+    end = text.rfind("]")
+    candidate = text[start:end + 1] if end > start else text[start:]
+
+    parsed = _parse_list(candidate)
+    if parsed is None:
+        candidate = re.sub(r",\s*([\]}])", r"\1", candidate)
+        depth = candidate.count("[") - candidate.count("]")
+        if depth > 0:
+            candidate += "]" * depth
+        parsed = _parse_list(candidate)
+    if parsed is None:
+        return []
+
+    if len(parsed) == 3 and all(isinstance(item, str) for item in parsed):
+        parsed = [parsed]
+    return [
+        [str(item).strip() for item in triple]
+        for triple in parsed
+        if isinstance(triple, (list, tuple)) and len(triple) == 3
+    ]
+
+def _parse_list(candidate):
+    for parser in (json.loads, ast.literal_eval):
+        try:
+            parsed = parser(candidate)
+        except (SyntaxError, ValueError, TypeError, MemoryError, RecursionError):
+            continue
+        if isinstance(parsed, list):
+            return parsed
+    return None
+
+def process_with_retry(sentence, aspect_opinion_pairs, max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS):
+    """
+    Call the LLM until it returns a non-empty list of triples, at most
+    `max_retries` times, waiting `backoff * 2**(attempt - 1)` seconds before
+    each retry that goes to the server (a retry answered from the LLM cache
+    does not wait). A request that fails in transport (timeout, connection
+    or server error) counts as a failed attempt and is retried the same way;
+    if the last attempt fails like that, its error is raised. Returns the
+    result together with the number of attempts used.
+    """
+    error = None
+    for attempt in range(max_retries):
+        delay = backoff * 2 ** (attempt - 1) if attempt else 0
+        if attempt:
+            METRICS.inc("absa_llm_retries_total", stage="filtering")
+        try:
+            result = process_aspect_opinion(sentence,aspect_opinion_pairs,attempt,delay)
+        except TRANSPORT_ERRORS as e:
+            error = e
+            continue
+        error = None
         if result != "[]": 
-            return result
-    return "[]"  
+            METRICS.observe("absa_llm_attempts", attempt + 1, buckets=COUNT_BUCKETS, stage="filtering")
+            return result, attempt + 1
+    METRICS.observe("absa_llm_attempts", max_retries, buckets=COUNT_BUCKETS, stage="filtering")
+    if error is not None:
+        raise error
+    return "[]", max_retries
 
 def clean_faulty_outputs(result):
     if "aspect" in result and "opinion" in result and "sentiment" in result:
         return "[]"  
     return result
 
-
-df["aspect_opinion_sentiment_triples"] = df.apply(
-    lambda row: clean_faulty_outputs(process_with_retry(row["sentence"],row["aspect_opinion_pairs"])), axis=1
-)
-
-
-df.to_csv("filtering_output.csv", encoding="utf-8", index=False)
-
-print("Aspect-based sentiment analysis enhancement complete! Check 'filtering_output.csv'.")
+def filter_row(row):
+    result, attempts = process_with_retry(row["sentence"],row["aspect_opinion_pairs"])
+    return clean_faulty_outputs(result), attempts
+
+
+def filter_rows(rows):
+    """
+    (result, attempts) for every row. Rows the lexicon resolves locally take
+    0 attempts; the rest query the LLM once per cluster of duplicate
+    sentences with the same aspect_opinion_pairs. The avoided-calls count
+    includes the retries a representative needed. A row whose every attempt
+    failed in transport gets "[]" with MAX_RETRIES attempts.
+    """
+    rows = list(rows)
+    results = [None] * len(rows)
+    ambiguous = []
+    for position, row in enumerate(rows):
+        resolved = lexicon.resolve(row["sentence"], row["aspect_opinion_pairs"]) if lexicon else None
+        if resolved is None:
+            ambiguous.append(position)
+        else:
+            results[position] = (resolved, 0)
+    lexicon_stats["rows"] += len(rows)
+    lexicon_stats["resolved"] += len(rows) - len(ambiguous)
+    METRICS.inc("absa_lexicon_rows_total", len(rows) - len(ambiguous), outcome="resolved")
+    METRICS.inc("absa_lexicon_rows_total", len(ambiguous), outcome="llm")
+
+    llm_results = fan_out(
+        lambda reps: client.map(filter_row, reps, fallback=lambda row: ("[]", MAX_RETRIES)),
+        [rows[position] for position in ambiguous],
+        text=lambda row: row["sentence"],
+        group=lambda row: str(row["aspect_opinion_pairs"]),
+        stage="filtering",
+        cost=lambda result: result[1]
+    )
+    for position, result in zip(ambiguous, llm_results):
+        results[position] = result
+    return results
+
+
+@instrumented("filtering")
+def main():
+    df = pd.read_csv("dependancy_output.csv", encoding="utf-8")
+    METRICS.set("absa_stage_rows", len(df), stage="filtering")
+
+    results = filter_rows(df.to_dict("records"))
+    df["aspect_opinion_sentiment_triples"] = [result for result, _ in results]
+    df["attempts"] = [attempts for _, attempts in results]
+
+    df.to_csv("filtering_output.csv", encoding="utf-8", index=False)
+
+    print("Aspect-based sentiment analysis enhancement complete! Check 'filtering_output.csv'.")
+    avoided = REPORT.stages.get("filtering", {}).get("calls_avoided", 0)
+    print(f"LLM calls: {df['attempts'].sum() - avoided} for {len(df)} rows "
+          f"(attempts per row mean {df['attempts'].mean():.2f}, max {df['attempts'].max()}), "
+          f"{(df['aspect_opinion_sentiment_triples'] == '[]').sum()} rows left empty")
+    skipped = lexicon_stats["resolved"] / lexicon_stats["rows"] if lexicon_stats["rows"] else 0
+    print(f"Lexicon fast path: {lexicon_stats['resolved']} of {lexicon_stats['rows']} rows "
+          f"({skipped:.1%}) resolved without the LLM" + ("" if lexicon else " (no lexicon, run lexicon.py)"))
+    print(f"LLM cache: {client.cache.stats()}")
+    print(REPORT.summary("filtering"))
+    REPORT.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import re
+import ast
+import json
+import argparse
+from collections import Counter, defaultdict
+import pandas as pd
+
+FILTER_LEXICON = os.environ.get("FILTER_LEXICON", "filter_lexicon.json")
+
+POLAR = {"positive", "negative"}
+# clean_sentence strips apostrophes, so contractions also arrive as "wasnt"
+# (or "was" + "nt" once parsed).
+NEGATIONS = {
+    "not", "no", "never", "n't", "nt", "nothing", "nobody", "none", "hardly", "barely", "neither", "nor",
+    "without", "dont", "doesnt", "didnt", "isnt", "wasnt", "arent", "werent", "cant", "cannot", "couldnt",
+    "wont", "wouldnt", "shouldnt", "havent", "hasnt", "hadnt", "aint",
+}
+# Words that usually make the sentiment of a pair depend on the rest of the sentence.
+HEDGES = {"but", "although", "though", "however", "except", "too", "if", "would", "could", "should", "?"}
+
+_WORD = re.compile(r"[a-z0-9]+(?=n't)|n't|[a-z0-9']+|\?")
+
+
+def words(text):
+    return _WORD.findall(str(text).lower())
+
+
+def parse_list(value):
+    """
+    Parse a stored list of pairs or triples (JSON or Python literal); None if
+    it is not a list.
+    """
+    if isinstance(value, list):
+        return value
+    for parser in (json.loads, ast.literal_eval):
+        try:
+            parsed = parser(str(value))
+        except (SyntaxError, ValueError, TypeError, MemoryError, RecursionError):
+            continue
+        if isinstance(parsed, list):
+            return parsed
+    return None
+
+
+def build_lexicon(filtered_file="filtering_output.csv", semeval_file="Restaurants_Train.csv",
+                  min_count=3, min_purity=0.9):
+    """
+    Build the restaurant aspect vocabulary and opinion polarity lexicon.
+
+    Aspects are the SemEval aspect terms (whole term and head word) plus the
+    aspects that the LLM kept at least `min_count` times in filtered output.
+    An opinion word enters the lexicon when the filtered triples give it one
+    polarity in at least `min_purity` of `min_count` or more uses, and the
+    SemEval sentences it occurs in (those whose labelled aspects all share
+    one polarity) do not point the other way with the same confidence.
+    Either file may be missing.
+    """
+    aspects = Counter()
+    opinions = defaultdict(Counter)
+    if os.path.exists(filtered_file):
+        for value in pd.read_csv(filtered_file, encoding="utf-8")["aspect_opinion_sentiment_triples"]:
+            for triple in parse_list(value) or []:
+                if not isinstance(triple, (list, tuple)) or len(triple) != 3:
+                    continue
+                aspect, opinion, sentiment = (str(item).strip().lower() for item in triple)
+                aspects[aspect] += 1
+                if len(words(opinion)) == 1:
+                    opinions[opinion][sentiment] += 1
+
+    vocabulary = {aspect for aspect, count in aspects.items() if count >= min_count}
+    semeval = defaultdict(Counter)
+    if os.path.exists(semeval_file):
+        df = pd.read_csv(semeval_file, encoding="utf-8")
+        for term in df["Aspect Term"].dropna().str.lower().str.strip():
+            vocabulary.add(term)
+            vocabulary.add(term.split()[-1])
+        for sentence, polarities in df.groupby("Sentence")["polarity"]:
+            polarity = set(polarities.dropna())
+            if len(polarity) != 1 or not polarity & POLAR:
+                continue
+            label = polarity.pop()
+            for word in set(words(sentence)):
+                semeval[word][label] += 1
+
+    lexicon = {}
+    for opinion, counts in opinions.items():
+        sentiment, count = counts.most_common(1)[0]
+        total = sum(counts.values())
+        if sentiment not in POLAR or total < min_count or count / total < min_purity:
+            continue
+        evidence = semeval.get(opinion)
+        if evidence:
+            other = (POLAR - {sentiment}).pop()
+            if evidence[other] >= min_count and evidence[other] / sum(evidence.values()) >= min_purity:
+                continue
+        lexicon[opinion] = sentiment
+    return {"aspects": sorted(vocabulary), "opinions": dict(sorted(lexicon.items()))}
+
+
+class Lexicon:
+    """
+    Local resolver for rows whose aspect-opinion pairs are unambiguous.
+
+    A row is resolved only if it has pairs, every aspect is in the restaurant
+    vocabulary, every opinion is a single word with a known polarity, and
+    the sentence has no negation or hedge (but, although, a question...)
+    that could flip or qualify it. All other rows go to the LLM.
+    """
+
+    def __init__(self, aspects, opinions):
+        self.aspects = set(aspects)
+        self.opinions = dict(opinions)
+
+    @classmethod
+    def load(cls, path=FILTER_LEXICON):
+        """
+        The lexicon saved at `path`, or None if it has not been built.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["aspects"], data["opinions"])
+
+    def resolve(self, sentence, aspect_opinion_pairs):
+        """
+        Triples for the row as filtering.py formats them, or None if the row
+        needs the LLM.
+        """
+        pairs = parse_list(aspect_opinion_pairs)
+        if not pairs:
+            return None
+        tokens = set(words(sentence))
+        if tokens & NEGATIONS or tokens & HEDGES:
+            return None
+        triples = []
+        for pair in pairs:
+            if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+                return None
+            aspect, opinion = str(pair[0]).strip(), str(pair[1]).strip()
+            sentiment = self.opinions.get(opinion.lower())
+            if aspect.lower() not in self.aspects or sentiment is None:
+                return None
+            triples.append([aspect, opinion, sentiment])
+        return str(triples)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the aspect vocabulary and opinion lexicon used by filtering.py's fast path."
+    )
+    parser.add_argument("--filtered", default="filtering_output.csv")
+    parser.add_argument("--semeval", default="Restaurants_Train.csv")
+    parser.add_argument("--min-count", type=int, default=3)
+    parser.add_argument("--min-purity", type=float, default=0.9)
+    parser.add_argument("--output", default=FILTER_LEXICON)
+    args = parser.parse_args()
+
+    data = build_lexicon(args.filtered, args.semeval, args.min_count, args.min_purity)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    print(f"Lexicon with {len(data['aspects'])} aspects and {len(data['opinions'])} opinions "
+          f"saved to '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
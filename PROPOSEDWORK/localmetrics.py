@@ -1,7 +1,14 @@
+import os
+import sys
+import math
 import pandas as pd
-import numpy as np
 import re
-from sklearn.metrics import hamming_loss
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "EXISTINGWORK"))
+from instrumentation import METRICS, instrumented
+
+CHUNK_SIZE = int(os.environ.get("METRICS_CHUNK_SIZE", 10000))
 
 
 def extract_aos_from_actual(row):
@@ -31,68 +38,147 @@ def extract_aos_from_pred(pred_str):
     else:
         return set()
 
-df_actual = pd.read_csv("actual.csv")
-df_actual = df_actual.apply(lambda col: col.map(lambda x: x.lower().strip() if isinstance(x, str) else x))
-df_actual['aos'] = df_actual.apply(extract_aos_from_actual, axis=1)
-
-
-df_pred = pd.read_csv('predicted_annotations.csv')
-df_pred = df_pred.apply(lambda col: col.map(lambda x: x.lower().strip() if isinstance(x, str) else x))
-df_pred['aos'] = df_pred['prediction'].apply(extract_aos_from_pred)
-
-
-df_merged = df_actual[['text', 'aos']].merge(df_pred[['text', 'aos']], on='text', suffixes=('_actual', '_pred'))
-
-global_triples = sorted(set().union(*df_merged['aos_actual']).union(*df_merged['aos_pred']))
-triple_to_idx = {triple: i for i, triple in enumerate(global_triples)}
-
-def aos_to_vector(aos_set):
-    vec = [0] * len(global_triples)
-    for triple in aos_set:
-        if triple in triple_to_idx:
-            vec[triple_to_idx[triple]] = 1
-    return np.array(vec)
-
-df_merged['vector_actual'] = df_merged['aos_actual'].apply(aos_to_vector)
-df_merged['vector_pred'] = df_merged['aos_pred'].apply(aos_to_vector)
-
-actual_vectors = np.stack(df_merged['vector_actual'].values)
-pred_vectors = np.stack(df_merged['vector_pred'].values)
+def lowercase(df):
+    return df.apply(lambda col: col.map(lambda x: x.lower().strip() if isinstance(x, str) else x))
 
 
-TP = np.sum(np.logical_and(actual_vectors == 1, pred_vectors == 1))
-TN = np.sum(np.logical_and(actual_vectors == 0, pred_vectors == 0))
-FP = np.sum(np.logical_and(actual_vectors == 0, pred_vectors == 1))
-FN = np.sum(np.logical_and(actual_vectors == 1, pred_vectors == 0))
-
-precision = TP / (TP + FP) if (TP + FP) > 0 else 0  
-recall = TP / (TP + FN) if (TP + FN) > 0 else 0     
-f1 = (2 * precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
-mcc = ((TP * TN) - (FP * FN)) / (np.sqrt((TP + FP) * (TP + FN) * (TN + FP) * (TN + FN))) \
-      if ((TP + FP) * (TP + FN) * (TN + FP) * (TN + FN)) > 0 else 0
-hamming = hamming_loss(actual_vectors, pred_vectors)
-fdr = FP / (FP + TP) if (FP + TP) > 0 else 0
-
-print("\n=== Evaluation Metrics ===")
-print(f"True Positives (TP): {TP}")
-print(f"True Negatives (TN): {TN}")
-print(f"False Positives (FP): {FP}")
-print(f"False Negatives (FN): {FN}")
-print(f"Precision: {precision:.4f} (TP / (TP + FP))")
-print(f"Recall: {recall:.4f} (TP / (TP + FN))")
-print(f"F1 Score: {f1:.4f} (2 * (Precision * Recall) / (Precision + Recall))")
-print(f"MCC: {mcc:.4f} (((TP * TN) - (FP * FN)) / sqrt((TP+FP)(TP+FN)(TN+FP)(TN+FN)))")
-print(f"Hamming Loss: {hamming:.4f} ((FP + FN) / total samples)")
-print(f"False Discovery Rate: {fdr:.4f} (FP / (FP + TP))")
-
-empty_preds = df_merged[df_merged['aos_pred'].apply(lambda x: len(x) == 0)]
-if not empty_preds.empty:
-    print("\n⚠️ Warning: Some predictions are empty!")
-    print(empty_preds[['text', 'aos_actual', 'aos_pred']].head())
-
-
-df_actual[['text', 'aos']].to_csv("actual_aos.csv", index=False)
-
-df_pred[['text', 'aos']].to_csv("predicted_aos.csv", index=False)
+class AOSMetrics:
+    """
+    Streaming evaluation over sets of A-O-S triples.
+
+    The dense formulation builds a 0/1 vector over every distinct triple for
+    every sentence. Only the set differences matter: per sentence,
+    TP = |actual & pred|, FP = |pred - actual| and FN = |actual - pred|, and
+    every other cell of the dense matrix is a true negative, so
+    TN = sentences * distinct triples - TP - FP - FN. Memory therefore grows
+    with the number of distinct triples only, and rows can be fed in chunks.
+    """
 
-print("\n✅ A-O-S files saved: 'actual_aos.csv' and 'predicted_aos.csv'")
+    def __init__(self):
+        self.rows = 0
+        self.tp = self.fp = self.fn = 0
+        self.triples = set()
+        self.by_aspect = defaultdict(lambda: [0, 0, 0])
+        self.by_sentiment = defaultdict(lambda: [0, 0, 0])
+
+    def update(self, actual_sets, pred_sets):
+        for actual, pred in zip(actual_sets, pred_sets):
+            self.rows += 1
+            self.triples.update(actual)
+            self.triples.update(pred)
+            tp, fp, fn = actual & pred, pred - actual, actual - pred
+            self.tp += len(tp)
+            self.fp += len(fp)
+            self.fn += len(fn)
+            for position, triples in enumerate((tp, fp, fn)):
+                for aspect, _, sentiment in triples:
+                    self.by_aspect[aspect][position] += 1
+                    self.by_sentiment[sentiment][position] += 1
+
+    @staticmethod
+    def scores(tp, fp, fn):
+        precision = tp / (tp + fp) if (tp + fp) > 0 else 0
+        recall = tp / (tp + fn) if (tp + fn) > 0 else 0
+        f1 = (2 * precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+        return precision, recall, f1
+
+    def compute(self):
+        TP, FP, FN = self.tp, self.fp, self.fn
+        cells = self.rows * len(self.triples)
+        TN = cells - TP - FP - FN
+
+        precision, recall, f1 = self.scores(TP, FP, FN)
+        mcc_den = (TP + FP) * (TP + FN) * (TN + FP) * (TN + FN)
+        mcc = ((TP * TN) - (FP * FN)) / math.sqrt(mcc_den) if mcc_den > 0 else 0
+        hamming = (FP + FN) / cells if cells > 0 else 0
+        fdr = FP / (FP + TP) if (FP + TP) > 0 else 0
+        return {
+            "TP": TP,
+            "TN": TN,
+            "FP": FP,
+            "FN": FN,
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            "mcc": mcc,
+            "hamming_loss": hamming,
+            "fdr": fdr
+        }
+
+    def breakdown(self, by="aspect"):
+        """
+        Per-aspect or per-sentiment TP/FP/FN with precision, recall and F1.
+        """
+        groups = self.by_aspect if by == "aspect" else self.by_sentiment
+        rows = []
+        for key, (tp, fp, fn) in groups.items():
+            precision, recall, f1 = self.scores(tp, fp, fn)
+            rows.append({by: key, "TP": tp, "FP": fp, "FN": fn, "support": tp + fn,
+                         "precision": precision, "recall": recall, "f1": f1})
+        columns = [by, "TP", "FP", "FN", "support", "precision", "recall", "f1"]
+        return pd.DataFrame(rows, columns=columns).sort_values("support", ascending=False, ignore_index=True)
+
+
+def evaluate(actual_file, pred_file, chunk_size=CHUNK_SIZE):
+    """
+    Evaluate predictions against the actual annotations, reading the actual
+    file in chunks. Also writes the A-O-S files and returns the metrics object
+    together with a sample of rows whose prediction is empty.
+    """
+    df_pred = lowercase(pd.read_csv(pred_file))
+    df_pred['aos'] = df_pred['prediction'].apply(extract_aos_from_pred)
+    df_pred[['text', 'aos']].to_csv("predicted_aos.csv", index=False)
+
+    metrics = AOSMetrics()
+    empty_preds = []
+    first_chunk = True
+    for df_actual in pd.read_csv(actual_file, chunksize=chunk_size):
+        df_actual = lowercase(df_actual)
+        df_actual['aos'] = df_actual.apply(extract_aos_from_actual, axis=1)
+        df_actual[['text', 'aos']].to_csv(
+            "actual_aos.csv", mode="w" if first_chunk else "a", header=first_chunk, index=False
+        )
+        first_chunk = False
+
+        df_merged = df_actual[['text', 'aos']].merge(df_pred[['text', 'aos']], on='text', suffixes=('_actual', '_pred'))
+        metrics.update(df_merged['aos_actual'], df_merged['aos_pred'])
+
+        if sum(len(df) for df in empty_preds) < 5:
+            empty_preds.append(df_merged[df_merged['aos_pred'].apply(lambda x: len(x) == 0)].head())
+
+    empty_preds = pd.concat(empty_preds) if empty_preds else pd.DataFrame()
+    return metrics, empty_preds
+
+
+@instrumented("localmetrics")
+def main():
+    metrics, empty_preds = evaluate("actual.csv", "predicted_annotations.csv")
+    m = metrics.compute()
+    METRICS.set("absa_stage_rows", metrics.rows, stage="localmetrics")
+
+    print("\n=== Evaluation Metrics ===")
+    print(f"True Positives (TP): {m['TP']}")
+    print(f"True Negatives (TN): {m['TN']}")
+    print(f"False Positives (FP): {m['FP']}")
+    print(f"False Negatives (FN): {m['FN']}")
+    print(f"Precision: {m['precision']:.4f} (TP / (TP + FP))")
+    print(f"Recall: {m['recall']:.4f} (TP / (TP + FN))")
+    print(f"F1 Score: {m['f1']:.4f} (2 * (Precision * Recall) / (Precision + Recall))")
+    print(f"MCC: {m['mcc']:.4f} (((TP * TN) - (FP * FN)) / sqrt((TP+FP)(TP+FN)(TN+FP)(TN+FN)))")
+    print(f"Hamming Loss: {m['hamming_loss']:.4f} ((FP + FN) / total samples)")
+    print(f"False Discovery Rate: {m['fdr']:.4f} (FP / (FP + TP))")
+
+    print("\n=== Per-Sentiment Breakdown ===")
+    print(metrics.breakdown("sentiment").to_string(index=False))
+    print("\n=== Per-Aspect Breakdown (top 20 by support) ===")
+    print(metrics.breakdown("aspect").head(20).to_string(index=False))
+
+    if not empty_preds.empty:
+        print("\n⚠️ Warning: Some predictions are empty!")
+        print(empty_preds[['text', 'aos_actual', 'aos_pred']].head())
+
+    print("\n✅ A-O-S files saved: 'actual_aos.csv' and 'predicted_aos.csv'")
+
+
+if __name__ == "__main__":
+    main()
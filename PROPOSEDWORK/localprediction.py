@@ -1,51 +1,127 @@
 import os
+import sys
 import gc
+import time
 import torch
 import pandas as pd
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
-
-save_dir = "models" 
-tokenizer = AutoTokenizer.from_pretrained(save_dir)
-inference_model = AutoModelForCausalLM.from_pretrained(save_dir, torch_dtype=torch.float16)
-inference_model.to("cuda:0")  
-inference_model.eval()
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "EXISTINGWORK"))
+from instrumentation import METRICS, instrumented
+from modelregistry import REGISTRY
+
+BATCH_SIZE = int(os.environ.get("PREDICT_BATCH_SIZE", 8))
+# "cpu" serves the LoRA-merged model with int8 weights (see cpuquant.py).
+DEVICE = os.environ.get("PREDICT_DEVICE", "cuda:0")
+
+save_dir = os.environ.get("PREDICT_MODEL_DIR", "models")
+
+
+def load_tokenizer():
+    tokenizer = AutoTokenizer.from_pretrained(save_dir)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Decoder-only models continue from the last position, so batches are padded on the left.
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+
+def load_model():
+    if DEVICE == "cpu":
+        from cpuquant import load_cpu_model
+        return load_cpu_model(save_dir)
+    model = AutoModelForCausalLM.from_pretrained(save_dir, torch_dtype=torch.float16)
+    model.to(DEVICE)
+    model.eval()
+    return model
+
+
+REGISTRY.register("llama_tokenizer", load_tokenizer)
+REGISTRY.register("llama", load_model)
+
+
+def build_prompt(user_prompt):
+    return f"### Human: {user_prompt} ###"
+
+
+def predict_batch(sentences, model=None, batch_size=BATCH_SIZE):
+    """
+    Generate predictions for many sentences with one model instance.
+
+    Prompts are sorted by token length and grouped into batches, so each batch
+    pads to a similar length. Each sentence keeps the generation budget it had
+    with the single-sentence pipeline (a total length of 3.5x the sentence's
+    token count), and results are returned in input order.
+    Returns the generated texts and a throughput report. `model` defaults
+    to the registry's "llama" model.
+    """
+    tokenizer = REGISTRY.get("llama_tokenizer")
+    model = REGISTRY.get("llama") if model is None else model
+    prompts = [build_prompt(sentence) for sentence in sentences]
+    prompt_lengths = [len(ids) for ids in tokenizer(prompts)["input_ids"]]
+    budgets = [
+        max(int(len(tokenizer.encode(sentence)) * 3.5) - length, 1)
+        for sentence, length in zip(sentences, prompt_lengths)
+    ]
+    order = sorted(range(len(prompts)), key=lambda i: prompt_lengths[i])
+
+    predictions = [None] * len(prompts)
+    generated_tokens = 0
+    start_time = time.perf_counter()
+    for start in range(0, len(order), batch_size):
+        batch_ids = order[start:start + batch_size]
+        inputs = tokenizer(
+            [prompts[i] for i in batch_ids], return_tensors="pt", padding=True
+        ).to(model.device)
+        with torch.no_grad(), METRICS.timer("absa_generate_seconds", device=str(model.device)):
+            output = model.generate(
+                **inputs,
+                max_new_tokens=max(budgets[i] for i in batch_ids),
+                pad_token_id=tokenizer.pad_token_id
+            )
+        new_tokens = output[:, inputs["input_ids"].shape[1]:]
+        for row, i in enumerate(batch_ids):
+            tokens = new_tokens[row, :budgets[i]]
+            tokens = tokens[tokens != tokenizer.pad_token_id]
+            generated_tokens += len(tokens)
+            METRICS.inc("absa_generated_tokens_total", len(tokens), device=str(model.device))
+            predictions[i] = prompts[i] + tokenizer.decode(tokens, skip_special_tokens=True)
+
+    elapsed = time.perf_counter() - start_time
+    report = {
+        "sentences": len(prompts),
+        "generated_tokens": generated_tokens,
+        "seconds": elapsed,
+        "sentences_per_second": len(prompts) / elapsed if elapsed > 0 else 0.0,
+        "tokens_per_second": generated_tokens / elapsed if elapsed > 0 else 0.0,
+    }
+    return predictions, report
 
 
 def process_prompt(user_prompt, model):
     print('Prediction running')
-    text_input = f"### Human: {user_prompt} ###"
-    pipe = pipeline(
-        task="text-generation",
-        model=model,
-        tokenizer=tokenizer,
-        max_length=int(len(tokenizer.encode(user_prompt)) * 3.5),
-        device=0  
-    )
-    return pipe(text_input)
-
-
-input_file = "50sentences.csv"  
-output_file = "predicted_annotations.csv" 
-
-
-df = pd.read_csv(input_file)
-df["text"] = df["text"].str.lower() 
-
-
-predictions = []
+    predictions, _ = predict_batch([user_prompt], model)
+    return [{"generated_text": predictions[0]}]
 
 
-for idx, row in df.iterrows():
-    sentence = row["text"]
+@instrumented("localprediction")
+def main():
+    input_file = "50sentences.csv"
+    output_file = "predicted_annotations.csv"
 
-    result = process_prompt(sentence, inference_model)
-  
-    generated_text = result[0]["generated_text"]
-    predictions.append(generated_text)
+    df = pd.read_csv(input_file)
+    df["text"] = df["text"].str.lower()
 
+    predictions, report = predict_batch(df["text"].tolist())
+    df["prediction"] = predictions
+    METRICS.set("absa_stage_rows", len(df), stage="localprediction")
 
-df["prediction"] = predictions
+    df.to_csv(output_file, index=False)
+    print(f"Predictions saved to {output_file}")
+    print(f"{report['sentences']} sentences in {report['seconds']:.1f}s: "
+          f"{report['sentences_per_second']:.2f} sentences/s, "
+          f"{report['tokens_per_second']:.1f} tokens/s")
 
 
-df.to_csv(output_file, index=False)
-print(f"Predictions saved to {output_file}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import sys
+import random
+import argparse
+
+from spacy.tokens import Doc
+from spacy.vocab import Vocab
+
+from dependancy_parsing import extract_pairs_from_doc
+
+# Random trees draw from these, so every rule and every special case
+# (pronouns, "n't", excluded nationalities, compounds) is hit often.
+WORDS = ["food", "service", "staff", "pizza", "menu", "place", "waiter", "it", "this", "they", "that",
+         "good", "great", "slow", "asian", "japanese", "not", "n't", "never", "was", "is", "cooked",
+         "the", "a", "very", "in", "straight-forward", "customer", "wine", "list", "Joe"]
+POS = ["NOUN", "PROPN", "PRON", "ADJ", "VERB", "AUX", "DET", "ADV", "PART", "ADP"]
+TAGS = ["NN", "NNP", "PRP", "JJ", "VB", "VBD", "AUX", "DT", "RB", "IN"]
+DEPS = ["amod", "acomp", "attr", "nsubj", "nsubjpass", "neg", "compound", "dobj", "prep", "pobj",
+        "advmod", "det", "conj"]
+
+
+def reference_head_noun(token):
+    if token.dep_ == "compound" and token.head.pos_ in {"NOUN", "PROPN"}:
+        return reference_head_noun(token.head)
+    return token.text
+
+
+def reference_resolve_pronoun(token, last_noun):
+    if token.lower_ in {"it", "this", "that", "they"} and last_noun:
+        return last_noun
+    return token.text
+
+
+def reference_pairs(doc):
+    """
+    Patterns A-D as one scan per pattern, the implementation the rule engine
+    in dependancy_parsing.py replaced. Kept unchanged as the reference.
+    """
+    pairs = []
+    last_noun = None
+
+    for sent in doc.sents:
+        for token in sent:
+            if token.pos_ in {"NOUN", "PROPN"}:
+                last_noun = reference_head_noun(token)
+
+        for token in sent:
+            if token.pos_ == "ADJ" and token.dep_ == "amod":
+                if token.head.pos_ in {"NOUN", "PROPN"}:
+                    aspect = reference_head_noun(token.head)
+                    if token.text.lower() not in {"asian", "japanese", "chinese"}:
+                        pairs.append((aspect, token.text.strip()))
+                        last_noun = aspect
+
+        for token in sent:
+            if token.pos_ == "ADJ" and token.dep_ in {"acomp", "attr"}:
+                subj = None
+                for child in token.head.children:
+                    if child.dep_ in {"nsubj", "nsubjpass"} and child.pos_ in {"NOUN", "PROPN", "PRON"}:
+                        subj = child
+                        break
+                if subj:
+                    aspect = (reference_head_noun(subj)
+                              if subj.pos_ != "PRON"
+                              else reference_resolve_pronoun(subj, last_noun))
+                    neg = ""
+                    for child in token.head.children:
+                        if child.dep_ == "neg":
+                            neg = child.text + " "
+                            if neg.strip() == "n't":
+                                neg = "not "
+                            break
+                    pairs.append((aspect, neg + token.text.strip()))
+                    last_noun = aspect
+
+        for token in sent:
+            if token.pos_ == "VERB" and token.tag_ != "AUX":
+                neg_token = None
+                for child in token.children:
+                    if child.dep_ == "neg":
+                        neg_token = child
+                        break
+                if neg_token:
+                    subj = None
+                    for child in token.children:
+                        if child.dep_ in {"nsubj", "nsubjpass"} and child.pos_ in {"NOUN", "PROPN", "PRON"}:
+                            subj = child
+                            break
+                    if subj:
+                        aspect = (reference_head_noun(subj)
+                                  if subj.pos_ != "PRON"
+                                  else reference_resolve_pronoun(subj, last_noun))
+                        subtree_tokens = sorted(token.subtree, key=lambda t: t.i)
+                        try:
+                            neg_index = subtree_tokens.index(neg_token)
+                        except ValueError:
+                            neg_index = 0
+                        opinion = " ".join(
+                            "not" if t.text.strip() == "n't" else t.text
+                            for t in subtree_tokens[neg_index: neg_index + 2]
+                        )
+                        pairs.append((aspect, opinion))
+                        last_noun = aspect
+
+        for token in sent:
+            if token.pos_ == "ADJ" and token.dep_ not in {"amod", "acomp", "attr"}:
+                for i in range(token.i - 1, -1, -1):
+                    if doc[i].pos_ in {"NOUN", "PROPN"}:
+                        aspect = reference_head_noun(doc[i])
+                        pairs.append((aspect, token.text.strip()))
+                        last_noun = aspect
+                        break
+
+    return list(set(pairs))
+
+
+def random_doc(vocab, rng, max_length=25, max_sentences=3):
+    """
+    A Doc of 1-`max_sentences` random projective dependency trees with random
+    words, POS tags and labels.
+    """
+    words, pos, tags, deps, heads, sent_starts = [], [], [], [], [], []
+    for _ in range(rng.randint(1, max_sentences)):
+        start = len(words)
+        length = rng.randint(1, max_length)
+        sentence_heads = random_tree(rng, length)
+        for i, head in enumerate(sentence_heads):
+            p = rng.randrange(len(POS))
+            words.append(rng.choice(WORDS))
+            pos.append(POS[p])
+            tags.append(TAGS[p] if rng.random() < 0.8 else rng.choice(TAGS))
+            deps.append("ROOT" if head == i else rng.choice(DEPS))
+            heads.append(start + head)
+            sent_starts.append(i == 0)
+    return Doc(vocab, words=words, pos=pos, tags=tags, deps=deps, heads=heads, sent_starts=sent_starts)
+
+
+def random_tree(rng, length):
+    """
+    Heads of a random projective tree over `length` tokens (the root is its
+    own head), built by recursively splitting spans around a head.
+    """
+    heads = [None] * length
+
+    def attach(lo, hi, parent):
+        if lo >= hi:
+            return
+        head = rng.randrange(lo, hi)
+        heads[head] = head if parent is None else parent
+        attach(lo, head, head)
+        attach(head + 1, hi, head)
+
+    attach(0, length, None)
+    return heads
+
+
+def describe(doc):
+    return " ".join(f"{t.text}/{t.pos_}/{t.tag_}/{t.dep_}->{t.head.i}" for t in doc)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check extract_pairs_from_doc against the one-scan-per-pattern reference on random trees."
+    )
+    parser.add_argument("--trees", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-length", type=int, default=25)
+    parser.add_argument("--show", type=int, default=5, help="mismatches to print")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab = Vocab()
+    mismatches = pairs = 0
+    for _ in range(args.trees):
+        doc = random_doc(vocab, rng, args.max_length)
+        expected = set(reference_pairs(doc))
+        actual = set(extract_pairs_from_doc(doc))
+        pairs += len(expected)
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= args.show:
+                print(f"Mismatch: {describe(doc)}\n  reference: {sorted(expected)}\n  rules:     {sorted(actual)}")
+    print(f"{args.trees} trees, {pairs} reference pairs, {mismatches} mismatches.")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
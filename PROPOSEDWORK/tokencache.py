@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+import torch
+from datasets import Dataset, load_from_disk
+
+TOKEN_CACHE_DIR = os.environ.get("TOKEN_CACHE_DIR", "tokenized_cache")
+
+
+def build_training_text(example):
+    """
+    Prompt and target of one training row, as the proposed notebooks train on.
+    """
+    target = (
+        f"Aspect detected: {example['span']} ## "
+        f"Opinion detected: {example['opinion']} ## "
+        f"Sentiment detected: {example['sentiment']}"
+    )
+    return f"### Human: {example['text']} ### Assistant: {target}"
+
+
+def cache_key(texts, tokenizer, max_length):
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        {"tokenizer": tokenizer.name_or_path, "vocab": len(tokenizer), "max_length": max_length},
+        sort_keys=True
+    ).encode("utf-8"))
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def tokenize_dataset(df, tokenizer, max_length=256, cache_dir=TOKEN_CACHE_DIR):
+    """
+    Tokenize every row of df once and return it as a memory-mapped Arrow dataset.
+
+    Sequences are stored unpadded with a trailing EOS token (the target the
+    fixed-length padding used to teach the model to stop on), plus a "length"
+    column for length-grouped batching. The result is saved under `cache_dir`,
+    keyed by the texts, tokenizer and max_length, and later runs load it from
+    disk. Folds are taken with dataset.select(indices), which only stores an
+    index mapping over the cached table.
+    """
+    texts = [build_training_text(row) for row in df.to_dict("records")]
+    path = os.path.join(cache_dir, cache_key(texts, tokenizer, max_length))
+    if os.path.exists(os.path.join(path, "dataset_info.json")):
+        return load_from_disk(path)
+
+    def tokenize(batch):
+        tokenized = tokenizer(batch["text"], truncation=True, max_length=max_length - 1)
+        tokenized["input_ids"] = [ids + [tokenizer.eos_token_id] for ids in tokenized["input_ids"]]
+        tokenized["attention_mask"] = [mask + [1] for mask in tokenized["attention_mask"]]
+        tokenized["labels"] = [ids.copy() for ids in tokenized["input_ids"]]
+        tokenized["length"] = [len(ids) for ids in tokenized["input_ids"]]
+        return tokenized
+
+    dataset = Dataset.from_dict({"text": texts}).map(tokenize, batched=True, remove_columns=["text"])
+    dataset.save_to_disk(path)
+    return load_from_disk(path)
+
+
+class DynamicPaddingCollator:
+    """
+    Pad each batch to its longest sequence (rounded up to `pad_to_multiple_of`)
+    instead of a fixed max_length. Padded label positions are set to -100 so
+    they do not contribute to the loss.
+    """
+
+    def __init__(self, tokenizer, pad_to_multiple_of=8, label_pad_token_id=-100):
+        self.pad_token_id = tokenizer.pad_token_id
+        self.padding_side = tokenizer.padding_side
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.label_pad_token_id = label_pad_token_id
+
+    def __call__(self, features):
+        max_len = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            max_len = -(-max_len // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        pad_values = {
+            "input_ids": self.pad_token_id,
+            "attention_mask": 0,
+            "labels": self.label_pad_token_id,
+        }
+        batch = {}
+        for key, pad_value in pad_values.items():
+            rows = []
+            for f in features:
+                values = list(f[key])
+                padding = [pad_value] * (max_len - len(values))
+                rows.append(padding + values if self.padding_side == "left" else values + padding)
+            batch[key] = torch.tensor(rows, dtype=torch.long)
+        return batch
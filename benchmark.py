@@ -0,0 +1,447 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import importlib.util
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+EXISTINGWORK = os.path.join(ROOT, "EXISTINGWORK")
+PROPOSEDWORK = os.path.join(ROOT, "PROPOSEDWORK")
+for directory in (EXISTINGWORK, PROPOSEDWORK):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+from openaistandin import ASPECTS, NEGATIVE, POSITIVE, StandInServer, answer_sentence
+from ollamastandin import OllamaStandInServer, answer_triples
+
+SIZES = "1000,10000,100000,1000000"
+# Modules whose import registers a model with the model registry; the other
+# models are registered by modelregistry.py itself.
+MODEL_MODULES = {"llama": "localprediction", "llama_tokenizer": "localprediction"}
+
+
+def synthetic_corpus(n, seed=0):
+    """
+    SemEval-shaped corpus of `n` review sentences: id, Sentence, Aspect Term,
+    polarity, from, to, one labelled aspect per row. Sentences are built from
+    restaurant templates and carry their row number, so they are distinct.
+    """
+    rng = np.random.default_rng(seed)
+    templates = np.array([
+        "The {a} was {s} and the {b} was {t}",
+        "I thought the {a} was {s}, but the {b} felt {t}",
+        "Our {a} came out {s}",
+        "We went there on a friday night and the {a} was {s}",
+    ])
+    opinions = np.array(POSITIVE + NEGATIVE)
+    aspects = np.array(ASPECTS)
+    picked = {
+        "template": templates[rng.integers(len(templates), size=n)],
+        "a": aspects[rng.integers(len(aspects), size=n)],
+        "b": aspects[rng.integers(len(aspects), size=n)],
+        "s": opinions[rng.integers(len(opinions), size=n)],
+        "t": opinions[rng.integers(len(opinions), size=n)],
+    }
+    sentences = [
+        template.format(a=a, b=b, s=s, t=t) + f" on visit {i}."
+        for i, (template, a, b, s, t) in enumerate(zip(*picked.values()))
+    ]
+    start = np.array([sentence.find(a) for sentence, a in zip(sentences, picked["a"])])
+    return pd.DataFrame({
+        "id": np.arange(n),
+        "Sentence": sentences,
+        "Aspect Term": picked["a"],
+        "polarity": np.where(np.isin(picked["s"], POSITIVE), "positive", "negative"),
+        "from": start,
+        "to": start + np.char.str_len(picked["a"].astype(str)),
+    })
+
+
+def pairs_column(sentences):
+    return [json.dumps(answer_sentence(s)) for s in sentences]
+
+
+def prepare_preprocessing(corpus):
+    corpus.to_csv("Restaurants_Train.csv", index=False)
+
+
+def prepare_merge(corpus):
+    df = corpus[["id", "Sentence"]].assign(aspect_sentiment_pairs=pairs_column(corpus["Sentence"]))
+    df.to_csv("aug_data.csv", index=False)
+    df.to_csv("adversarial_data.csv", index=False)
+
+
+def prepare_formatting(corpus):
+    corpus[["id", "Sentence"]].assign(aspect_sentiment_pairs=pairs_column(corpus["Sentence"])).to_csv(
+        "fulloutput.csv", index=False
+    )
+
+
+def prepare_localmetrics(corpus):
+    triples = [answer_triples(s) for s in corpus["Sentence"]]
+    pd.DataFrame({
+        "text": corpus["Sentence"],
+        "span": [", ".join(t[0] for t in ts) for ts in triples],
+        "opinion": [", ".join(t[1] for t in ts) for ts in triples],
+        "sentiment": [", ".join(t[2] for t in ts) for ts in triples],
+    }).to_csv("actual.csv", index=False)
+    # Every other prediction drops its last triple, so the metrics see errors.
+    predictions = [
+        f"### Human: {s} ### Assistant: Aspect detected: {', '.join(t[0] for t in ts)} ## "
+        f"Opinion detected: {', '.join(t[1] for t in ts)} ## Sentiment detected: {', '.join(t[2] for t in ts)}"
+        for s, ts in zip(corpus["Sentence"], [ts[:-1] if i % 2 else ts for i, ts in enumerate(triples)])
+    ]
+    pd.DataFrame({"text": corpus["Sentence"], "prediction": predictions}).to_csv(
+        "predicted_annotations.csv", index=False
+    )
+
+
+def prepare_sentences(filename):
+    def prepare(corpus):
+        corpus[["id", "Sentence"]].to_csv(filename, index=False)
+    return prepare
+
+
+def prepare_adversarial(corpus):
+    corpus[["id", "Sentence"]].assign(aspect_sentiment_pairs=pairs_column(corpus["Sentence"])).to_csv(
+        "aug_data.csv", index=False
+    )
+
+
+def prepare_filtering(corpus):
+    pairs = [json.dumps([[t[0], t[1]] for t in answer_triples(s)]) for s in corpus["Sentence"]]
+    pd.DataFrame({"id": corpus["id"], "sentence": corpus["Sentence"], "aspect_opinion_pairs": pairs}).to_csv(
+        "dependancy_output.csv", index=False
+    )
+
+
+# name: (script, input preparation, kind). "llm" stages talk to the stand-ins
+# and are capped at --llm-rows; "spacy" stages need a spaCy model and are
+# capped at --parse-rows.
+BENCHMARKS = {
+    "pre-processing": (os.path.join(EXISTINGWORK, "pre-processing.py"), prepare_preprocessing, "local"),
+    "merge": (os.path.join(EXISTINGWORK, "merge.py"), prepare_merge, "local"),
+    "formatting": (os.path.join(EXISTINGWORK, "formatting.py"), prepare_formatting, "local"),
+    "localmetrics": (os.path.join(PROPOSEDWORK, "localmetrics.py"), prepare_localmetrics, "local"),
+    "dependancy_parsing": (os.path.join(PROPOSEDWORK, "dependancy_parsing.py"), prepare_sentences("merged.csv"), "spacy"),
+    "augmentation": (os.path.join(EXISTINGWORK, "augmentation.py"), prepare_sentences("processed_sentences.csv"), "llm"),
+    "adversarial": (os.path.join(EXISTINGWORK, "adversarial.py"), prepare_adversarial, "llm"),
+    "aspectsentiment": (os.path.join(EXISTINGWORK, "aspectsentiment.py"), prepare_sentences("merged.csv"), "llm"),
+    "filtering": (os.path.join(PROPOSEDWORK, "filtering.py"), prepare_filtering, "llm"),
+}
+
+
+def peak_rss_mb():
+    """
+    High-water mark of this process's resident memory. Linux's VmHWM starts
+    fresh at exec, while ru_maxrss can carry over the parent's peak.
+    """
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def run_stage(name, directory, trace=False):
+    """
+    Run one stage's main() in `directory` and return its timing and memory.
+    Called in a fresh interpreter per measurement (see measure), so module
+    state, caches and the memory high-water mark start clean.
+    """
+    script = BENCHMARKS[name][0]
+    os.chdir(directory)
+    module_name = os.path.splitext(os.path.basename(script))[0].replace("-", "_")
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(module_name, script)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    import_seconds = time.perf_counter() - start
+    import_rss = peak_rss_mb()
+
+    if trace:
+        import tracemalloc
+        tracemalloc.start()
+    start = time.perf_counter()
+    sys.argv = [script]
+    module.main()
+    seconds = time.perf_counter() - start
+    result = {"seconds": seconds, "import_seconds": import_seconds,
+              "import_rss_mb": import_rss, "peak_rss_mb": peak_rss_mb()}
+    if trace:
+        result["python_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result
+
+
+def measure(name, corpus, env, trace=False, timeout=None):
+    """
+    Prepare the stage's input files from `corpus` in a scratch directory and
+    run the stage in a child process.
+    """
+    directory = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    cwd = os.getcwd()
+    try:
+        os.chdir(directory)
+        BENCHMARKS[name][1](corpus)
+        os.chdir(cwd)
+        command = [sys.executable, os.path.abspath(__file__), "run-stage", name, directory]
+        if trace:
+            command.append("--trace")
+        completed = subprocess.run(command, capture_output=True, text=True, env=env, timeout=timeout)
+        if completed.returncode != 0:
+            return {"status": "failed", "error": completed.stderr.strip().splitlines()[-1:]}
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        result["status"] = "ok"
+        result["rows_per_second"] = len(corpus) / result["seconds"] if result["seconds"] else None
+        return result
+    except subprocess.TimeoutExpired:
+        return {"status": "timeout"}
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def cold_start(name):
+    """
+    Import the model registry and load `name`. Called in a fresh interpreter
+    (see startup_report), as every stage run used to load its models.
+    """
+    start = time.perf_counter()
+    from modelregistry import REGISTRY
+    if name in MODEL_MODULES:
+        importlib.import_module(MODEL_MODULES[name])
+    import_seconds = time.perf_counter() - start
+    REGISTRY.get(name)
+    return {"import_seconds": import_seconds, "load_seconds": REGISTRY.load_seconds[name],
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def startup_report(names, workers):
+    """
+    Cold and warm startup of the registry's models.
+
+    cold: a fresh interpreter per model, from launch until the model is
+    loaded. shared_lookup_seconds: how long a later stage in the same
+    process waits for a model already loaded. warm_pool: how long a pool of
+    `workers` processes forked after loading takes until every worker is
+    ready, and how many of them already hold all the models.
+    """
+    from modelregistry import REGISTRY, WarmPool
+
+    models = {}
+    for name in names:
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "cold-start", name],
+                                   capture_output=True, text=True)
+        if completed.returncode != 0:
+            models[name] = {"status": "failed", "error": completed.stderr.strip().splitlines()[-1:]}
+            continue
+        cold = json.loads(completed.stdout.strip().splitlines()[-1])
+        cold["process_seconds"] = time.perf_counter() - start
+        models[name] = {"status": "ok", "cold": cold}
+
+    loaded = [name for name, result in models.items() if result["status"] == "ok"]
+    for name in loaded:
+        if name in MODEL_MODULES:
+            importlib.import_module(MODEL_MODULES[name])
+    try:
+        with WarmPool(loaded, workers) as pool:
+            warm = {
+                "load_seconds": pool.load_seconds,
+                "workers": len(pool.workers),
+                "ready_seconds": pool.ready_seconds,
+                "workers_with_models": sum(set(loaded) <= set(held) for _, held in pool.workers),
+            }
+    except ValueError as e:
+        warm = {"error": str(e)}
+    for name in loaded:
+        start = time.perf_counter()
+        REGISTRY.get(name)
+        models[name]["shared_lookup_seconds"] = time.perf_counter() - start
+    return {"models": models, "warm_pool": warm}
+
+
+def available(kind):
+    if kind != "spacy":
+        return True
+    return all(importlib.util.find_spec(m) is not None for m in ("spacy", "en_core_web_trf"))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old_path, new):
+    """
+    Print rows/s and peak memory of `new` against an earlier results file.
+    """
+    with open(old_path, encoding="utf-8") as f:
+        old = {(r["stage"], r["rows"]): r for r in json.load(f)["results"] if r.get("status") == "ok"}
+    print(f"\nCompared with {old_path}:")
+    for r in new["results"]:
+        before = old.get((r["stage"], r["rows"]))
+        if r.get("status") != "ok" or before is None:
+            continue
+        speed = r["rows_per_second"] / before["rows_per_second"]
+        memory = r["peak_rss_mb"] / before["peak_rss_mb"]
+        flag = "  <-- slower" if speed < 0.9 else ""
+        print(f"  {r['stage']:<20} {r['rows']:>8} rows: {speed:.2f}x rows/s, {memory:.2f}x peak memory{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages on synthetic SemEval-shaped corpora with offline LLM stand-ins."
+    )
+    commands = parser.add_subparsers(dest="command")
+    one = commands.add_parser("run-stage", help=argparse.SUPPRESS)
+    one.add_argument("stage")
+    one.add_argument("directory")
+    one.add_argument("--trace", action="store_true")
+    cold = commands.add_parser("cold-start", help=argparse.SUPPRESS)
+    cold.add_argument("model")
+    startup = commands.add_parser("startup", help="report cold and warm startup times of the registry's models")
+    startup.add_argument("--models", default="spacy_trf,spacy_fast,setfit")
+    startup.add_argument("--workers", type=int, default=4, help="size of the warm worker pool")
+
+    parser.add_argument("--stages", default=",".join(BENCHMARKS))
+    parser.add_argument("--sizes", default=SIZES)
+    parser.add_argument("--llm-rows", type=int, default=1000, help="row cap for the LLM stages")
+    parser.add_argument("--parse-rows", type=int, default=5000, help="row cap for spaCy parsing")
+    parser.add_argument("--llm-latency-ms", type=float, default=5.0, help="fixed latency per stand-in request")
+    parser.add_argument("--llm-token-latency-ms", type=float, default=0.0,
+                        help="extra stand-in latency per generated token")
+    parser.add_argument("--dedup-threshold", default="1.0",
+                        help="DEDUP_THRESHOLD for the stages (below 1.0 near duplicates are also searched for and reported)")
+    parser.add_argument("--trace", action="store_true",
+                        help="also report the tracemalloc peak of Python allocations (slows the stages down)")
+    parser.add_argument("--timeout", type=float, help="seconds before a stage run is abandoned")
+    parser.add_argument("--output", help="results file (default: benchmark_results/<timestamp>.json)")
+    parser.add_argument("--compare", metavar="RESULTS", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    if args.command == "run-stage":
+        print(json.dumps(run_stage(args.stage, args.directory, args.trace)))
+        return
+    if args.command == "cold-start":
+        print(json.dumps(cold_start(args.model)))
+        return
+    if args.command == "startup":
+        report = {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "cpus": os.cpu_count(),
+            **startup_report([name.strip() for name in args.models.split(",") if name.strip()], args.workers),
+        }
+        for name, result in report["models"].items():
+            if result["status"] == "ok":
+                cold = result["cold"]
+                print(f"{name:<16} cold {cold['process_seconds']:>7.2f}s (import {cold['import_seconds']:.2f}s, "
+                      f"load {cold['load_seconds']:.2f}s), warm lookup {result['shared_lookup_seconds'] * 1e6:.0f}us")
+            else:
+                print(f"{name:<16} failed {result['error']}")
+        warm = report["warm_pool"]
+        if "error" in warm:
+            print(f"warm pool: {warm['error']}")
+        else:
+            print(f"warm pool: {warm['workers']} workers ready in {warm['ready_seconds']:.2f}s, "
+                  f"{warm['workers_with_models']} holding every model")
+        output = args.output or os.path.join("benchmark_results", "startup-" + time.strftime("%Y%m%d-%H%M%S") + ".json")
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to '{output}'.")
+        return
+
+    stages = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = [name for name in stages if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown stages {unknown} (available: {', '.join(BENCHMARKS)})")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    caps = {"local": None, "llm": args.llm_rows, "spacy": args.parse_rows}
+
+    latency = args.llm_latency_ms / 1000, 0.0, args.llm_token_latency_ms / 1000
+    openai_server = StandInServer(*latency).__enter__()
+    ollama_server = OllamaStandInServer(*latency).__enter__()
+    scratch = tempfile.mkdtemp(prefix="bench-state-")
+    env = dict(
+        os.environ,
+        OLLAMA_HOST=ollama_server.host,
+        OPENAI_BASE_URL=openai_server.url,
+        OPENAI_API_KEY="standin",
+        LLM_CACHE_PATH=os.path.join(scratch, "llm_cache.sqlite"),
+        SPACY_DOC_STORE=os.path.join(scratch, "parsed_docs"),
+        DEDUP_THRESHOLD=args.dedup_threshold,
+        PYTHONPATH=os.pathsep.join([EXISTINGWORK, PROPOSEDWORK, os.environ.get("PYTHONPATH", "")]),
+    )
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("command", "output", "compare")},
+        "results": [],
+    }
+    try:
+        corpora = {}
+        for size in sizes:
+            for name in stages:
+                kind = BENCHMARKS[name][2]
+                rows = min(size, caps[kind]) if caps[kind] else size
+                if not available(kind):
+                    result = {"status": "skipped", "error": "spaCy or en_core_web_trf is not installed"}
+                elif any(r["stage"] == name and r["rows"] == rows for r in report["results"]):
+                    continue
+                else:
+                    if rows not in corpora:
+                        corpora[rows] = synthetic_corpus(rows)
+                    # Every run starts with cold caches.
+                    for path in (env["LLM_CACHE_PATH"], env["SPACY_DOC_STORE"]):
+                        if os.path.isdir(path):
+                            shutil.rmtree(path)
+                        elif os.path.exists(path):
+                            os.remove(path)
+                    result = measure(name, corpora[rows], env, args.trace, args.timeout)
+                result = {"stage": name, "rows": rows, **result}
+                report["results"].append(result)
+                if result["status"] == "ok":
+                    print(f"{name:<20} {rows:>8} rows: {result['rows_per_second']:>10.1f} rows/s, "
+                          f"peak {result['peak_rss_mb']:.0f} MB (after import {result['import_rss_mb']:.0f} MB)")
+                else:
+                    print(f"{name:<20} {rows:>8} rows: {result['status']} {result.get('error', '')}")
+    finally:
+        openai_server.__exit__(None, None, None)
+        ollama_server.__exit__(None, None, None)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    output = args.output or os.path.join("benchmark_results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to '{output}'.")
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import os
+import re
+import sys
+import json
+import argparse
+import tempfile
+import traceback
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+EXISTINGWORK = os.path.join(ROOT, "EXISTINGWORK")
+PROPOSEDWORK = os.path.join(ROOT, "PROPOSEDWORK")
+for directory in (EXISTINGWORK, PROPOSEDWORK):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+
+class Skipped(Exception):
+    """
+    Raised by a check whose optional dependencies are not installed.
+    """
+
+
+def check_lexicon_negations():
+    """
+    Negated sentences are never resolved by the lexicon, including the
+    apostrophe-less contractions clean_sentence produces.
+    """
+    from lexicon import Lexicon
+
+    lexicon = Lexicon(["food", "service"], {"great": "positive", "good": "positive"})
+    assert lexicon.resolve("the food was great", '[["food","great"]]') == "[['food', 'great', 'positive']]"
+    for sentence in ["the food wasnt great", "the food was nt great", "the food wasn't great",
+                     "the food was not great", "the food didnt taste great", "the food never is great"]:
+        assert lexicon.resolve(sentence, '[["food","great"]]') is None, sentence
+    for sentence in ["the service isnt good", "the service cant be good", "the service doesnt look good"]:
+        assert lexicon.resolve(sentence, '[["service","good"]]') is None, sentence
+
+
+def check_merge_streaming():
+    """
+    merge_streaming() writes the same file as merge() when the inputs differ
+    in length and columns, whatever the chunk size.
+    """
+    from merge import merge, merge_streaming
+
+    inputs = {
+        "aug.csv": "id,Sentence,pairs,score,flag\n"
+                   + "".join(f'{i},"The food, {i}","[(\'food\', \'good\')]",{i}.5,{i % 2 == 0}\n' for i in range(7)),
+        "adv.csv": "id,Sentence,pairs\n"
+                   + "".join(f'{i},The service {i},"[(\'service\', \'slow\')]"\n' for i in range(3)),
+        "empty.csv": "id,Sentence,pairs\n",
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {}
+        for name, text in inputs.items():
+            paths[name] = os.path.join(directory, name)
+            with open(paths[name], "w", encoding="utf-8") as f:
+                f.write(text)
+        expected = os.path.join(directory, "merged.csv")
+        streamed = os.path.join(directory, "streamed.csv")
+        for first, second in [("aug.csv", "adv.csv"), ("adv.csv", "aug.csv"), ("aug.csv", "empty.csv")]:
+            merge(paths[first], paths[second], expected)
+            with open(expected, encoding="utf-8") as f:
+                reference = f.read()
+            for chunk_size in (1, 2, 3, 100):
+                merge_streaming(paths[first], paths[second], streamed, chunk_size)
+                with open(streamed, encoding="utf-8") as f:
+                    assert f.read() == reference, (first, second, chunk_size)
+
+
+def check_packed_retries():
+    """
+    Packed aspect-sentiment requests against the OpenAI stand-in with
+    dropped IDs: every sentence gets its answer, a retry only re-sends IDs
+    no earlier request answered, and a rerun (fallbacks included) is served
+    from the cache.
+    """
+    try:
+        import openai
+    except ImportError:
+        raise Skipped("openai is not installed")
+    import aspectsentiment
+    from llmcache import LLMCache
+    from openaistandin import StandInServer, answer_prompt, answer_sentence, synthetic_sentences
+
+    def asked(prompt):
+        packed = re.search(r"^Sentences: (\{.*?\n\})", prompt, re.S | re.M)
+        if packed:
+            return set(json.loads(packed.group(1)))
+        return {aspectsentiment.sentence_id(re.search(r'^Sentence: "(.*)"$', prompt, re.M).group(1))}
+
+    sentences = synthetic_sentences(60)
+    drop_rate = 0.2
+    with tempfile.TemporaryDirectory() as directory, \
+            StandInServer(base_latency=0, completion_latency=0, drop_rate=drop_rate, drop_single=True) as server:
+        openai.base_url = server.url
+        openai.api_key = "standin"
+        aspectsentiment.cache = LLMCache(os.path.join(directory, "llm_cache.sqlite"))
+        try:
+            pairs = aspectsentiment.process_sentences_packed(sentences, 10)
+            assert [json.loads(p) for p in pairs] == [answer_sentence(s) for s in sentences]
+
+            answered = set()
+            fallbacks = 0
+            for prompt in server.prompts:
+                ids = asked(prompt)
+                assert not ids & answered, f"re-sent answered IDs {sorted(ids & answered)}"
+                answer = json.loads(answer_prompt(prompt, drop_rate, drop_single=True))
+                if isinstance(answer, dict):
+                    answered |= set(answer)
+                else:
+                    answered |= ids
+                    fallbacks += 1
+            assert fallbacks, "no sentence needed the per-sentence fallback"
+
+            sent = len(server.prompts)
+            assert aspectsentiment.process_sentences_packed(sentences, 7) == pairs
+            assert len(server.prompts) == sent, f"rerun sent {len(server.prompts) - sent} requests"
+        finally:
+            aspectsentiment.cache.conn.close()
+
+
+PARITY_SENTENCES = [
+    "The food was great but the service was slow.",
+    "Our waiter was friendly and the wine list is long.",
+    "The pizza crust was cold.",
+    "We loved the ambience, the music and the dessert menu.",
+    "Prices are high for such small portions.",
+    "Nothing special.",
+]
+
+
+def tiny_absa_model(directory):
+    """
+    A SetFit AbsaModel small enough to build and export in seconds: a
+    randomly initialised two-layer BERT body, logistic regression heads fit
+    on arbitrary labels, and a blank spaCy pipeline that tags a fixed word
+    list as nouns. Only useful for comparing backends, not for predictions.
+    """
+    import spacy
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+    from setfit import AbsaModel, AspectModel, PolarityModel
+    from setfit.span.aspect_extractor import AspectExtractor
+    from sklearn.linear_model import LogisticRegression
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    nouns = ["food", "service", "waiter", "wine", "list", "pizza", "crust", "ambience", "music", "dessert",
+             "menu", "prices", "portions"]
+    nlp = spacy.blank("en")
+    nlp.add_pipe("attribute_ruler").add_patterns(
+        [{"patterns": [[{"LOWER": noun}]], "attrs": {"POS": "NOUN"}} for noun in nouns]
+    )
+    spacy_dir = os.path.join(directory, "spacy")
+    nlp.to_disk(spacy_dir)
+
+    body_dir = os.path.join(directory, "body")
+    os.makedirs(body_dir)
+    words = sorted({w for s in PARITY_SENTENCES for w in re.findall(r"\w+|[^\w\s]", s.lower())})
+    with open(os.path.join(body_dir, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words) + "\n")
+    BertTokenizerFast(os.path.join(body_dir, "vocab.txt")).save_pretrained(body_dir)
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(words) + 5, hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=64, max_position_embeddings=128)
+    BertModel(config).save_pretrained(body_dir)
+
+    def span_model(cls, labels, span_context, target):
+        transformer = models.Transformer(body_dir, max_seq_length=64)
+        pooling = models.Pooling(config.hidden_size, "mean")
+        body = SentenceTransformer(modules=[transformer, pooling], device="cpu")
+        model = cls(model_body=body, labels=labels, spacy_model=spacy_dir, span_context=span_context)
+        docs = list(nlp.pipe(PARITY_SENTENCES))
+        aspects = [[slice(t.i, t.i + 1) for t in doc if t.pos_ == "NOUN"] for doc in docs]
+        inputs = list(model.prepend_aspects(docs, aspects))
+        model.model_head = LogisticRegression(C=100, max_iter=1000).fit(body.encode(inputs), [target(i) for i in range(len(inputs))])
+        return model
+
+    extractor = AspectExtractor(spacy_dir)
+    return AbsaModel(extractor, span_model(AspectModel, ["no aspect", "aspect"], 0, lambda i: int(i % 4 != 0)),
+                     span_model(PolarityModel, ["negative", "neutral", "positive"], 3, lambda i: i % 3))
+
+
+def check_onnx_parity():
+    """
+    The ONNX predictor (onnxabsa.py) agrees with eager SetFit on a tiny
+    exported model: same span inputs, same embeddings and same predictions.
+    The int8 body is not compared, its agreement is measured on real models
+    with `onnxabsa.py parity`.
+    """
+    try:
+        import onnxruntime  # noqa: F401
+        import setfit  # noqa: F401
+    except ImportError as e:
+        raise Skipped(f"{e.name} is not installed")
+    import numpy as np
+    from onnxabsa import OnnxAbsaModel, export_absa_model
+
+    with tempfile.TemporaryDirectory() as directory:
+        eager = tiny_absa_model(directory)
+        onnx_dir = os.path.join(directory, "onnx")
+        export_absa_model(eager, onnx_dir, quantize=False)
+        onnx_model = OnnxAbsaModel(onnx_dir, quantized=False)
+
+        docs, aspects_list = eager.aspect_extractor(PARITY_SENTENCES)
+        assert onnx_model.extract_aspects(PARITY_SENTENCES)[1] == aspects_list
+        for name in ("aspect_model", "polarity_model"):
+            inputs = list(getattr(eager, name).prepend_aspects(docs, aspects_list))
+            assert list(getattr(onnx_model, name).prepend_aspects(docs, aspects_list)) == inputs
+            expected = getattr(eager, name).model_body.encode(inputs)
+            assert np.allclose(getattr(onnx_model, name).encode(inputs), expected, atol=1e-5), name
+        expected = eager.predict(PARITY_SENTENCES)
+        assert any(expected), "the tiny model found no aspects to compare"
+        assert onnx_model.predict(PARITY_SENTENCES) == expected
+
+
+CHECKS = {
+    "lexicon-negations": check_lexicon_negations,
+    "merge-streaming": check_merge_streaming,
+    "packed-retries": check_packed_retries,
+    "onnx-parity": check_onnx_parity,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline's regression checks.")
+    parser.add_argument("checks", nargs="*", metavar="check",
+                        help=f"checks to run (default: all): {', '.join(CHECKS)}")
+    args = parser.parse_args()
+    unknown = sorted(set(args.checks) - set(CHECKS))
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)}")
+
+    failed = 0
+    for name in args.checks or CHECKS:
+        try:
+            CHECKS[name]()
+        except Skipped as e:
+            print(f"SKIP {name}: {e}")
+        except Exception:
+            failed += 1
+            print(f"FAIL {name}")
+            traceback.print_exc()
+        else:
+            print(f"ok   {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
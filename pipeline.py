@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import argparse
+import importlib.util
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+EXISTINGWORK = os.path.join(ROOT, "EXISTINGWORK")
+PROPOSEDWORK = os.path.join(ROOT, "PROPOSEDWORK")
+STATE_DIR = os.environ.get("PIPELINE_STATE_DIR", ".pipeline")
+
+for directory in (EXISTINGWORK, PROPOSEDWORK):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+from instrumentation import METRICS
+
+
+def load_module(script):
+    """
+    Import a stage script by path. Scripts are only imported when their stage
+    actually runs, since several of them import torch or spaCy. Their models
+    are loaded on first use through the model registry, and shared by every
+    stage of the run.
+    """
+    name = os.path.splitext(os.path.basename(script))[0].replace("-", "_")
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, script)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def optional_hash(path):
+    return file_hash(path) if os.path.exists(path) else None
+
+
+def row_hashes(df, salt):
+    """
+    Hash of every row's content (all columns, NaN as null) plus `salt`.
+    """
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    return [
+        hashlib.sha256((salt + json.dumps(record, sort_keys=True, default=str)).encode("utf-8")).hexdigest()
+        for record in records
+    ]
+
+
+class RowMemo:
+    """
+    Output row of a row-wise stage for each input row hash, kept in SQLite.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rows (hash TEXT PRIMARY KEY, output TEXT)")
+        self.conn.commit()
+
+    def get_many(self, hashes):
+        found = {}
+        unique = list(set(hashes))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            found.update(self.conn.execute(
+                f"SELECT hash, output FROM rows WHERE hash IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return {h: json.loads(output) for h, output in found.items()}
+
+    def replace(self, outputs):
+        """
+        Keep exactly the given {hash: output row} entries, dropping rows that
+        are no longer part of the input.
+        """
+        self.conn.execute("DELETE FROM rows")
+        self.conn.executemany(
+            "INSERT INTO rows (hash, output) VALUES (?, ?)",
+            [(h, json.dumps(row, default=str)) for h, row in outputs.items()]
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class Stage:
+    """
+    One step of the pipeline: a script that reads `inputs` and writes `output`
+    in the working directory.
+
+    Row-wise stages map each input row to one output row with
+    `compute(df) -> df`; only rows whose content hash is not memoized are
+    passed to it. Table stages (`compute()` with no arguments) are rerun as a
+    whole when any input changes. The stage config hash covers the script's
+    source and `config`, so editing a prompt or a rule recomputes the stage.
+    """
+
+    def __init__(self, name, script, inputs, output, compute, rows=True, config=None):
+        self.name = name
+        self.script = script
+        self.inputs = inputs
+        self.output = output
+        self.compute = compute
+        self.rows = rows
+        self.config = config or {}
+
+    def config_hash(self):
+        payload = json.dumps({"script": file_hash(self.script), "config": self.config}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def clean_sentences(df):
+    preprocessing = load_module(os.path.join(EXISTINGWORK, "pre-processing.py"))
+    return df.assign(Sentence=df["Sentence"].apply(preprocessing.clean_sentence))
+
+
+def augment(df):
+    augmentation = load_module(os.path.join(EXISTINGWORK, "augmentation.py"))
+    return df.assign(Sentence=augmentation.augment_sentences(df["Sentence"]))
+
+
+def generate_adversarial(df):
+    adversarial = load_module(os.path.join(EXISTINGWORK, "adversarial.py"))
+    return df.assign(Sentence=adversarial.generate_adversarial_texts(df.to_dict("records")))
+
+
+def merge_files():
+    load_module(os.path.join(EXISTINGWORK, "merge.py")).main()
+
+
+def extract_aspect_sentiment(df):
+    aspectsentiment = load_module(os.path.join(EXISTINGWORK, "aspectsentiment.py"))
+    return df.assign(aspect_sentiment_pairs=aspectsentiment.extract_pairs(df["Sentence"]))
+
+
+def format_training_data():
+    load_module(os.path.join(EXISTINGWORK, "formatting.py")).main()
+
+
+def parse_dependencies(df):
+    parsing = load_module(os.path.join(PROPOSEDWORK, "dependancy_parsing.py"))
+    if "Sentence" in df.columns and "sentence" not in df.columns:
+        df = df.rename(columns={"Sentence": "sentence"})
+    pairs = parsing.extract_pairs_dedup(df["sentence"])
+    return pd.DataFrame({
+        "id": df["id"].to_numpy(),
+        "sentence": df["sentence"].to_numpy(),
+        "aspect_opinion_pairs": [json.dumps(p, ensure_ascii=False) for p in pairs],
+    })
+
+
+def filter_triples(df):
+    filtering = load_module(os.path.join(PROPOSEDWORK, "filtering.py"))
+    results = filtering.filter_rows(df.to_dict("records"))
+    return df.assign(
+        aspect_opinion_sentiment_triples=[result for result, _ in results],
+        attempts=[attempts for _, attempts in results],
+    )
+
+
+STAGES = [
+    Stage("pre-processing", os.path.join(EXISTINGWORK, "pre-processing.py"),
+          ["Restaurants_Train.csv"], "processed_sentences.csv", clean_sentences),
+    Stage("augmentation", os.path.join(EXISTINGWORK, "augmentation.py"),
+          ["processed_sentences.csv"], "aug_data.csv", augment),
+    Stage("adversarial", os.path.join(EXISTINGWORK, "adversarial.py"),
+          ["aug_data.csv"], "adversarial_data.csv", generate_adversarial),
+    Stage("merge", os.path.join(EXISTINGWORK, "merge.py"),
+          ["aug_data.csv", "adversarial_data.csv"], "merged.csv", merge_files, rows=False,
+          config={"MERGE_CHUNK_SIZE": os.environ.get("MERGE_CHUNK_SIZE")}),
+    Stage("aspectsentiment", os.path.join(EXISTINGWORK, "aspectsentiment.py"),
+          ["merged.csv"], "fulloutput.csv", extract_aspect_sentiment,
+          config={"ASPECT_PACK_SIZE": os.environ.get("ASPECT_PACK_SIZE", "1")}),
+    Stage("formatting", os.path.join(EXISTINGWORK, "formatting.py"),
+          ["fulloutput.csv"], "existingworktrainingdata.csv", format_training_data, rows=False,
+          config={"FORMATTING_OUTPUT": os.environ.get("FORMATTING_OUTPUT", "csv")}),
+    Stage("dependancy_parsing", os.path.join(PROPOSEDWORK, "dependancy_parsing.py"),
+          ["merged.csv"], "dependancy_output.csv", parse_dependencies,
+          config={key: os.environ.get(key) for key in
+                  ("SPACY_PARSE_MODE", "SPACY_MODEL", "SPACY_FAST_MODEL", "SPACY_ESCALATE", "SPACY_ESCALATE_LENGTH")}),
+    Stage("filtering", os.path.join(PROPOSEDWORK, "filtering.py"),
+          ["dependancy_output.csv"], "filtering_output.csv", filter_triples,
+          config={"FILTER_LEXICON": optional_hash(os.environ.get("FILTER_LEXICON", "filter_lexicon.json"))}),
+]
+
+
+def topological_order(stages):
+    """
+    Order stages so that every stage runs after the stages producing its inputs.
+    """
+    producers = {stage.output: stage for stage in stages}
+    ordered, visiting, done = [], set(), set()
+
+    def visit(stage):
+        if stage.name in done:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Cycle in pipeline at stage '{stage.name}'")
+        visiting.add(stage.name)
+        for path in stage.inputs:
+            if path in producers:
+                visit(producers[path])
+        visiting.discard(stage.name)
+        done.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+class Pipeline:
+    def __init__(self, stages=STAGES, state_dir=STATE_DIR):
+        self.stages = topological_order(stages)
+        self.producers = {stage.output: stage for stage in self.stages}
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, "state.json")
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def is_current(self, stage, config_hash):
+        """
+        True if the stage's config and input files are the ones it last ran
+        with and its output has not been modified since.
+        """
+        recorded = self.state.get(stage.name)
+        if not recorded or recorded["config"] != config_hash:
+            return False
+        if not os.path.exists(stage.output) or file_hash(stage.output) != recorded["output"]:
+            return False
+        return all(
+            os.path.exists(path) and file_hash(path) == recorded["inputs"].get(path)
+            for path in stage.inputs
+        )
+
+    def run(self, dry_run=False, force=(), until=None):
+        """
+        Run every stage whose inputs or config changed, in dependency order.
+        With dry_run, nothing is executed; the plan is returned instead.
+        Stages downstream of a stage that would run are reported as stale,
+        since their input rows are only known once it has run.
+        """
+        plan = []
+        changing = set()
+        for stage in self.stages:
+            config_hash = stage.config_hash()
+            upstream = [self.producers[p].name for p in stage.inputs if p in self.producers]
+            missing = [p for p in stage.inputs if p not in self.producers and not os.path.exists(p)]
+
+            if missing:
+                entry = {"stage": stage.name, "action": "blocked", "detail": f"missing input {', '.join(missing)}"}
+            elif dry_run and any(name in changing for name in upstream):
+                entry = {"stage": stage.name, "action": "stale", "detail": "upstream output will change"}
+                changing.add(stage.name)
+            elif stage.name not in force and self.is_current(stage, config_hash):
+                entry = {"stage": stage.name, "action": "up-to-date"}
+            else:
+                if dry_run:
+                    entry = self._run_stage(stage, config_hash, dry_run, stage.name in force)
+                else:
+                    try:
+                        with METRICS.stage(stage.name):
+                            entry = self._run_stage(stage, config_hash, dry_run, stage.name in force)
+                    finally:
+                        METRICS.write(stage.name)
+                changing.add(stage.name)
+
+            plan.append(entry)
+            print(f"{entry['stage']:<20} {entry['action']:<12} {entry.get('detail', '')}")
+            if until and stage.name == until:
+                break
+        return plan
+
+    def _run_stage(self, stage, config_hash, dry_run, forced):
+        before = file_hash(stage.output) if os.path.exists(stage.output) else None
+        if stage.rows:
+            entry = self._run_rows(stage, config_hash, dry_run, forced)
+        else:
+            entry = {"stage": stage.name, "action": "run", "detail": "table stage, recomputed whole"}
+            if not dry_run:
+                stage.compute()
+        if dry_run:
+            return entry
+
+        after = file_hash(stage.output)
+        self.state[stage.name] = {
+            "config": config_hash,
+            "inputs": {path: file_hash(path) for path in stage.inputs},
+            "output": after,
+        }
+        self.save_state()
+        if after == before:
+            entry["detail"] += "; output unchanged"
+        return entry
+
+    def _run_rows(self, stage, config_hash, dry_run, forced):
+        df = pd.read_csv(stage.inputs[0], encoding="utf-8")
+        hashes = row_hashes(df, config_hash)
+        memo = RowMemo(os.path.join(self.state_dir, f"{stage.name}.sqlite"))
+        try:
+            known = {} if forced else memo.get_many(hashes)
+            dirty = {}
+            for position, h in enumerate(hashes):
+                if h not in known and h not in dirty:
+                    dirty[h] = position
+            entry = {
+                "stage": stage.name,
+                "action": "run",
+                "rows": len(hashes),
+                "recompute": len(dirty),
+                "detail": f"{len(dirty)} of {len(hashes)} rows to recompute",
+            }
+            if dry_run:
+                return entry
+
+            if dirty:
+                computed = stage.compute(df.iloc[list(dirty.values())].reset_index(drop=True))
+                records = computed.astype(object).where(computed.notna(), None).to_dict("records")
+                known.update(zip(dirty, records))
+            outputs = [known[h] for h in hashes]
+            columns = list(outputs[0]) if outputs else list(df.columns)
+            pd.DataFrame(outputs, columns=columns).to_csv(stage.output, encoding="utf-8", index=False)
+            memo.replace({h: known[h] for h in hashes})
+            return entry
+        finally:
+            memo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the ABSA data pipeline incrementally from the current directory."
+    )
+    parser.add_argument("--dry-run", action="store_true", help="show what would be recomputed")
+    parser.add_argument("--force", nargs="*", default=[], metavar="STAGE", help="recompute these stages fully")
+    parser.add_argument("--until", metavar="STAGE", help="stop after this stage")
+    args = parser.parse_args()
+
+    names = {stage.name for stage in STAGES}
+    for name in args.force + ([args.until] if args.until else []):
+        if name not in names:
+            parser.error(f"unknown stage '{name}' (stages: {', '.join(sorted(names))})")
+    Pipeline().run(dry_run=args.dry_run, force=set(args.force), until=args.until)
+
+
+if __name__ == "__main__":
+    main()
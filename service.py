@@ -0,0 +1,374 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import urllib.request
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+for directory in (os.path.join(ROOT, "EXISTINGWORK"), os.path.join(ROOT, "PROPOSEDWORK")):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+from modelregistry import REGISTRY
+
+SERVICE_MODELS = os.environ.get("SERVICE_MODELS", "setfit,llama")
+SERVICE_MAX_BATCH = int(os.environ.get("SERVICE_MAX_BATCH", 32))
+# How long the first request of a batch may wait for others to join it.
+SERVICE_MAX_LATENCY_MS = float(os.environ.get("SERVICE_MAX_LATENCY_MS", 20))
+SERVICE_TIMEOUT = float(os.environ.get("SERVICE_TIMEOUT", 300))
+
+
+def load_setfit():
+    """
+    SetFit ABSA predictor: the int8 ONNX export with ABSA_BACKEND=onnx,
+    otherwise the torch models in ABSA_ASPECT_MODEL / ABSA_POLARITY_MODEL.
+    SetFit predicts aspects and their polarity only, so opinions are None.
+    """
+    model = REGISTRY.get("setfit")
+
+    def predict(sentences):
+        return [
+            [{"aspect": p["span"], "opinion": None, "sentiment": p["polarity"]} for p in predictions]
+            for predictions in model.predict(sentences)
+        ]
+
+    return predict
+
+
+def load_llama():
+    """
+    LLaMA-LoRA generator from localprediction.py (PREDICT_MODEL_DIR,
+    PREDICT_DEVICE), with the generated text parsed into triples as
+    localmetrics.py does.
+    """
+    import localprediction
+    from localmetrics import extract_aos_from_pred
+
+    REGISTRY.get("llama_tokenizer")
+    model = REGISTRY.get("llama")
+
+    def predict(sentences):
+        predictions, _ = localprediction.predict_batch(
+            [str(s).lower() for s in sentences], model, batch_size=len(sentences)
+        )
+        return [
+            [{"aspect": a, "opinion": o, "sentiment": s} for a, o, s in sorted(extract_aos_from_pred(p.lower()))]
+            for p in predictions
+        ]
+
+    return predict
+
+
+LOADERS = {"setfit": load_setfit, "llama": load_llama}
+
+
+class _Server(ThreadingHTTPServer):
+    # Many clients connect at once; the default backlog of 5 resets the rest.
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class ThroughputStats:
+    """
+    Counters of one batcher: requests, sentences, batch sizes, request
+    latency percentiles over the last 1000 requests and sentences per second
+    over the last `window` seconds.
+    """
+
+    def __init__(self, window=60):
+        self.lock = threading.Lock()
+        self.window = window
+        self.started = time.time()
+        self.requests = self.sentences = self.batches = self.errors = 0
+        self.busy_seconds = 0.0
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=1000)
+        self.recent = deque()
+
+    def record(self, batch_size, requests, seconds, latencies, error=False):
+        now = time.time()
+        with self.lock:
+            self.batches += 1
+            self.requests += requests
+            self.sentences += batch_size
+            self.errors += requests if error else 0
+            self.busy_seconds += seconds
+            self.batch_sizes[batch_size] += 1
+            self.latencies.extend(latencies)
+            self.recent.append((now, batch_size))
+            while self.recent and self.recent[0][0] < now - self.window:
+                self.recent.popleft()
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            elapsed = min(self.window, time.time() - self.started) or 1.0
+
+            def percentile(q):
+                return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else None
+
+            return {
+                "requests": self.requests,
+                "sentences": self.sentences,
+                "batches": self.batches,
+                "errors": self.errors,
+                "mean_batch_size": self.sentences / self.batches if self.batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)},
+                "sentences_per_second": sum(n for _, n in self.recent) / elapsed,
+                "utilization": self.busy_seconds / (time.time() - self.started),
+            }
+
+
+_STOP = ("stop",)
+
+
+class MicroBatcher:
+    """
+    Gather concurrent requests for one model into micro-batches.
+
+    A single worker thread owns the model. It takes the oldest waiting
+    request and keeps adding requests until the batch holds `max_batch_size`
+    sentences or the oldest request has waited `max_latency` seconds, then
+    runs one predict call for the whole batch and hands every request its
+    slice of the results. A request larger than `max_batch_size` runs as a
+    batch of its own.
+    """
+
+    def __init__(self, predict, max_batch_size=SERVICE_MAX_BATCH, max_latency=SERVICE_MAX_LATENCY_MS / 1000):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.stats = ThroughputStats()
+        self.queue = queue.Queue()
+        # A request taken from the queue that did not fit into the last batch.
+        self.held = None
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, sentences):
+        """
+        Queue a request and return a Future of its list of predictions.
+        """
+        future = Future()
+        self.queue.put((list(sentences), future, time.perf_counter()))
+        return future
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def _collect(self, first):
+        """
+        Requests already waiting join the batch immediately; new ones are
+        waited for only until the oldest request's deadline.
+        """
+        batch, size = [first], len(first[0])
+        deadline = first[2] + self.max_latency
+        while size < self.max_batch_size:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if item is _STOP or size + len(item[0]) > self.max_batch_size:
+                self.held = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _loop(self):
+        while True:
+            first, self.held = self.held or self.queue.get(), None
+            if first is _STOP:
+                return
+            batch = self._collect(first)
+            sentences = [sentence for request, _, _ in batch for sentence in request]
+            start = time.perf_counter()
+            try:
+                results = self.predict(sentences)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                self.stats.record(len(sentences), len(batch), time.perf_counter() - start, [], error=True)
+                continue
+            end = time.perf_counter()
+            position = 0
+            for request, future, _ in batch:
+                future.set_result(results[position:position + len(request)])
+                position += len(request)
+            self.stats.record(len(sentences), len(batch), end - start, [end - queued for _, _, queued in batch])
+
+
+class InferenceService:
+    """
+    HTTP service over one MicroBatcher per loaded model.
+
+    POST /predict         {"sentences": [...], "model": "setfit"}  -> {"model", "results"}
+                          ("text": "..." is accepted for one sentence)
+    GET  /health          loaded models and uptime
+    GET  /throughput      ThroughputStats of every model
+    """
+
+    def __init__(self, models, host="127.0.0.1", port=8000, max_batch_size=SERVICE_MAX_BATCH,
+                 max_latency=SERVICE_MAX_LATENCY_MS / 1000):
+        self.started = time.time()
+        self.batchers = {}
+        self.load_seconds = {}
+        for name, predict in models.items():
+            start = time.perf_counter()
+            if predict is None:
+                predict = LOADERS[name]()
+            self.load_seconds[name] = time.perf_counter() - start
+            self.batchers[name] = MicroBatcher(predict, max_batch_size, max_latency)
+        self.default_model = next(iter(self.batchers))
+        self.httpd = _Server((host, port), self._handler())
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+
+    def _handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, status, data):
+                payload = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    self.reply(200, {
+                        "status": "ok",
+                        "models": list(service.batchers),
+                        "load_seconds": service.load_seconds,
+                        "uptime_seconds": time.time() - service.started,
+                    })
+                elif self.path == "/throughput":
+                    self.reply(200, {name: b.stats.snapshot() for name, b in service.batchers.items()})
+                else:
+                    self.reply(404, {"error": f"unknown path {self.path}"})
+
+            def do_POST(self):
+                if self.path != "/predict":
+                    self.reply(404, {"error": f"unknown path {self.path}"})
+                    return
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                    sentences = body["sentences"] if "sentences" in body else [body["text"]]
+                    if not isinstance(sentences, list) or not all(isinstance(s, str) for s in sentences):
+                        raise ValueError("'sentences' must be a list of strings")
+                except (ValueError, KeyError, TypeError) as e:
+                    self.reply(400, {"error": f"bad request: {e}"})
+                    return
+                model = body.get("model", service.default_model)
+                if model not in service.batchers:
+                    self.reply(404, {"error": f"model '{model}' is not loaded", "models": list(service.batchers)})
+                    return
+                if not sentences:
+                    self.reply(200, {"model": model, "results": []})
+                    return
+                try:
+                    results = service.batchers[model].submit(sentences).result(timeout=SERVICE_TIMEOUT)
+                except Exception as e:
+                    self.reply(500, {"error": f"{type(e).__name__}: {e}"})
+                    return
+                self.reply(200, {"model": model, "results": results})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        print(f"Serving {', '.join(self.batchers)} on {self.url} "
+              f"(loaded in {', '.join(f'{n} {s:.1f}s' for n, s in self.load_seconds.items())})")
+        self.httpd.serve_forever()
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for batcher in self.batchers.values():
+            batcher.close()
+
+
+def post(url, data, timeout=SERVICE_TIMEOUT):
+    request = urllib.request.Request(url, json.dumps(data).encode("utf-8"), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+
+def load_test(url, sentences, model=None, concurrency=16):
+    """
+    Send every sentence as its own request from `concurrency` client threads
+    and return the client-side throughput and the server's /throughput view.
+    """
+    body = {} if model is None else {"model": model}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda s: post(f"{url}/predict", {**body, "sentences": [s]}), sentences))
+    seconds = time.perf_counter() - start
+    with urllib.request.urlopen(f"{url}/throughput") as response:
+        server = json.load(response)
+    return results, {
+        "requests": len(sentences),
+        "concurrency": concurrency,
+        "seconds": seconds,
+        "requests_per_second": len(sentences) / seconds if seconds else 0.0,
+        "server": server,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the ABSA models over HTTP with dynamic micro-batching.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve")
+    serve.add_argument("--models", default=SERVICE_MODELS, help="comma-separated: setfit, llama")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--max-batch", type=int, default=SERVICE_MAX_BATCH)
+    serve.add_argument("--max-latency-ms", type=float, default=SERVICE_MAX_LATENCY_MS)
+
+    load = commands.add_parser("load", help="load-test a running service with sentences from a CSV file")
+    load.add_argument("input_file")
+    load.add_argument("--column", default="text")
+    load.add_argument("--url", default="http://127.0.0.1:8000")
+    load.add_argument("--model")
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        names = [name.strip() for name in args.models.split(",") if name.strip()]
+        unknown = [name for name in names if name not in LOADERS]
+        if unknown:
+            parser.error(f"unknown models {unknown} (available: {', '.join(LOADERS)})")
+        service = InferenceService(
+            {name: None for name in names}, args.host, args.port, args.max_batch, args.max_latency_ms / 1000
+        )
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            service.shutdown()
+    else:
+        import pandas as pd
+
+        sentences = pd.read_csv(args.input_file, encoding="utf-8")[args.column].astype(str).head(args.limit).tolist()
+        _, report = load_test(args.url, sentences, args.model, args.concurrency)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()